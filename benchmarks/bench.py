@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+import compileall
+import gc
+import json
+import os
+import pathlib
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+SCRIPTS_DIR = pathlib.Path(sys.path[0], '../scripts').resolve()
+sys.path.insert(1, str(SCRIPTS_DIR))
+
+# The scripts aren't a package, so they're only importable once their
+# directory is on the path
+import codec # noqa: E402
+import loadtags # noqa: E402
+import mesh_tag # noqa: E402
+import myth_collection # noqa: E402
+import myth_headers # noqa: E402
+import myth_sound # noqa: E402
+import reco_tag # noqa: E402
+import synthetic # noqa: E402
+import tag2png # noqa: E402
+
+DEBUG = (os.environ.get('DEBUG') == '1')
+
+RESULTS_VERSION = 1
+BASELINE_FILE = 'baseline.json'
+OUTPUT_DIR = '../output/benchmarks'
+
+# Bump when synthetic.py generates a different corpus for the same sizes
+CORPUS_VERSION = 2
+
+# Synthetic corpus the benchmarks run on, see synthetic.DEFAULTS
+CORPUS_SIZES = {
+    'seed': 1,
+    'plugins': 2,
+    'tfl_archives': 0,
+    'tags': 2000,
+    'tag_size': 2048,
+    'collections': 4,
+    'bitmaps': 10,
+    'bitmap_size': 128,
+    'sounds': 8,
+    'permutations': 4,
+    'sound_frames': 4000,
+    'meshes': 2,
+    'markers': 4000,
+    'actions': 1000,
+    'films': 2,
+    'commands': 50000,
+    'players': 16,
+}
+
+# Startup budgets in seconds: the cumulative `python -X importtime` time
+# of importing each tool. Advisory only, as import times depend on the
+# machine: going over prints a warning, the baseline comparison decides
+# whether an import regressed
+IMPORT_BUDGETS = OrderedDict({
+    'mono2tag': 0.035,
+    'loadtags': 0.035,
+    'mesh2info': 0.045,
+    'reco_tag': 0.050,
+    'film_index': 0.060,
+})
+
+# Left out of the environment of import benchmarks
+IMPORT_IGNORE_ENV = ['TRACE', 'MEMTRACE', 'TAGSERVER']
+
+# Options, all can be overridden with key=value arguments
+OPTIONS = OrderedDict({
+    'repeat': 7, # timed runs per benchmark, the fastest is compared
+    'time_threshold': 0.3, # fail if the fastest time grows by more than this fraction
+    'memory_threshold': 0.10, # fail if the peak memory grows by more than this fraction
+})
+
+def main(command, args):
+    """
+    Time and measure peak memory of the core parsing paths on a synthetic
+    corpus, and compare against a stored baseline
+    """
+    (options, filters) = parse_args(args)
+    corpus_dir = ensure_corpus()
+    results = run_benchmarks(corpus_dir, filters, options['repeat'])
+    path = write_results(results, output_path())
+    print(f'Results saved to {path}')
+
+    if command == 'baseline':
+        path = write_results(results, baseline_path())
+        print(f'Baseline saved to {path}')
+    elif command == 'run':
+        baseline = load_results(baseline_path())
+        if baseline:
+            regressions = compare(baseline, results, options['time_threshold'], options['memory_threshold'])
+        else:
+            print_results(results)
+            print('No baseline, run with `baseline` to create one')
+            regressions = []
+        over_budget(results)
+        if regressions:
+            print(f'{len(regressions)} regressions: {", ".join(regressions)}')
+            sys.exit(1)
+    else:
+        print(f'Unknown command: {command}')
+        sys.exit(1)
+
+def parse_args(args):
+    options = dict(OPTIONS)
+    filters = []
+    for arg in args:
+        (key, sep, value) = arg.partition('=')
+        if not sep:
+            filters.append(arg)
+        elif key in options:
+            options[key] = type(OPTIONS[key])(value)
+        else:
+            print(f'Unknown option: {key} (expected one of {", ".join(OPTIONS)})')
+            sys.exit(1)
+    return (options, filters)
+
+def baseline_path():
+    return pathlib.Path(sys.path[0], BASELINE_FILE).resolve()
+
+def output_path():
+    return pathlib.Path(sys.path[0], OUTPUT_DIR, 'results.json').resolve()
+
+def ensure_corpus():
+    """Generate the corpus, unless it already exists with the same version and sizes"""
+    corpus_dir = pathlib.Path(sys.path[0], OUTPUT_DIR, 'corpus').resolve()
+    sizes_path = corpus_dir / 'sizes.json'
+    corpus = {'version': CORPUS_VERSION, 'sizes': CORPUS_SIZES}
+    try:
+        with open(sizes_path, 'r') as sizes_file:
+            if json.load(sizes_file) == corpus:
+                return corpus_dir
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    print(f'Generating corpus in {corpus_dir}')
+    synthetic.generate(corpus_dir, **CORPUS_SIZES)
+    with open(sizes_path, 'w') as sizes_file:
+        json.dump(corpus, sizes_file)
+    return corpus_dir
+
+# Benchmarks. Each setup function does the untimed preparation and
+# returns the function to measure
+
+def bench_load_tags(corpus_dir):
+    plugin_names = [p.name for p in sorted((corpus_dir / 'plugins').iterdir())]
+    return lambda: loadtags.load_tags(corpus_dir, plugin_names)
+
+def foundation_archive(corpus_dir):
+    path = next((corpus_dir / 'tags').iterdir())
+    data = path.read_bytes()
+    return (data, myth_headers.parse_mono_header(path.name, data))
+
+def bench_get_mono_tags(corpus_dir):
+    (data, mono_header) = foundation_archive(corpus_dir)
+    return lambda: list(myth_headers.get_mono_tags(data, mono_header))
+
+def bench_codec_decode(corpus_dir):
+    (data, mono_header) = foundation_archive(corpus_dir)
+    header_codec = myth_headers.SBHeader
+    size = myth_headers.TAG_HEADER_SIZE
+    offsets = range(mono_header.tag_list_start, mono_header.tag_list_start + mono_header.tag_list_size, size)
+    return lambda: [header_codec(data, offset=offset) for offset in offsets]
+
+def bench_codec_encode(corpus_dir):
+    (data, mono_header) = foundation_archive(corpus_dir)
+    headers = list(myth_headers.get_mono_tags(data, mono_header))
+    return lambda: [header._replace(tag_data_offset=0).value for header in headers]
+
+def loaded_tags(corpus_dir):
+    plugin_names = [p.name for p in sorted((corpus_dir / 'plugins').iterdir())]
+    (game_version, tags, entrypoint_map, data_map, cutscenes) = loadtags.load_tags(corpus_dir, plugin_names)
+    return (tags, data_map)
+
+def encoding_collection(encoding):
+    rng = synthetic.rng_for(CORPUS_SIZES['seed'], f'bench:{encoding}')
+    payload = synthetic.collection_payload(
+        rng, CORPUS_SIZES['bitmaps'], CORPUS_SIZES['bitmap_size'], [encoding]
+    )
+    return synthetic.make_tag('.256', 'bnch', encoding, payload)
+
+def bench_parse_bitmaps(encoding):
+    def setup(corpus_dir):
+        data = encoding_collection(encoding)
+        header = myth_headers.parse_header(data)
+        coll_header = myth_collection.parse_collection_header(data, header)
+        color_table = myth_collection.parse_color_table(data, coll_header)
+        return lambda: myth_collection.parse_bitmaps(data, coll_header, color_table)
+    return setup
+
+def bench_make_png(corpus_dir):
+    data = encoding_collection('argb8888')
+    header = myth_headers.parse_header(data)
+    coll_header = myth_collection.parse_collection_header(data, header)
+    color_table = myth_collection.parse_color_table(data, coll_header)
+    bitmaps = myth_collection.parse_bitmaps(data, coll_header, color_table)
+    return lambda: [tag2png.make_png(width, height, rows) for (name, width, height, rows) in bitmaps]
+
+def mesh_data(corpus_dir):
+    (tags, data_map) = loaded_tags(corpus_dir)
+    mesh_id = next(iter(tags['mesh']))
+    data = loadtags.get_tag_data(tags, data_map, 'mesh', mesh_id)
+    return (mesh_tag.parse_header(data), data)
+
+def bench_parse_markers(corpus_dir):
+    (mesh_header, data) = mesh_data(corpus_dir)
+    return lambda: mesh_tag.parse_markers(mesh_header, data)
+
+def bench_parse_map_actions(corpus_dir):
+    (mesh_header, data) = mesh_data(corpus_dir)
+    return lambda: mesh_tag.parse_map_actions(mesh_header, data)
+
+def bench_parse_soun_tag(corpus_dir):
+    (tags, data_map) = loaded_tags(corpus_dir)
+    sounds = [loadtags.get_tag_data(tags, data_map, 'soun', tag_id) for tag_id in tags['soun']]
+    return lambda: [myth_sound.parse_soun_tag(data) for data in sounds]
+
+def bench_parse_timeline(corpus_dir):
+    """
+    reco_tag.parse_timeline over every film, with its tags loaded and head
+    parsed beforehand as parse_reco_file does
+    """
+    films = []
+    for path in sorted((corpus_dir / 'films').iterdir()):
+        (header, reco_data, reco, game_param, game_data, save_game) = reco_tag.parse_reco_head_data(path.read_bytes())
+        plugin_names = [codec.decode_string(p[0]) for p in game_param.plugin_data]
+        (game_version, tags, entrypoint_map, data_map, cutscenes) = loadtags.load_tags(corpus_dir, plugin_names)
+        films.append((header, tags, data_map, game_data, game_param, reco, reco_data))
+
+    def parse():
+        return [
+            reco_tag.parse_timeline(
+                header, tags, data_map, game_data,
+                game_param, reco, reco_data, None
+            )
+            for (header, tags, data_map, game_data, game_param, reco, reco_data) in films
+        ]
+
+    return parse
+
+def bench_build_seek_index(corpus_dir):
+    films = []
+    for path in sorted((corpus_dir / 'films').iterdir()):
+        (header, reco_data, reco, game_param, game_data, save_game) = reco_tag.parse_reco_head_data(path.read_bytes())
+        films.append((reco, reco_data))
+    return lambda: [reco_tag.build_seek_index(reco, reco_data) for (reco, reco_data) in films]
+
+BENCHMARKS = OrderedDict({
+    'loadtags.load_tags': bench_load_tags,
+    'myth_headers.get_mono_tags': bench_get_mono_tags,
+    'codec.decode': bench_codec_decode,
+    'codec.encode': bench_codec_encode,
+    **{
+        f'myth_collection.parse_bitmaps[{encoding}]': bench_parse_bitmaps(encoding)
+        for encoding in synthetic.ENCODINGS
+    },
+    'tag2png.make_png': bench_make_png,
+    'mesh_tag.parse_markers': bench_parse_markers,
+    'mesh_tag.parse_map_actions': bench_parse_map_actions,
+    'myth_sound.parse_soun_tag': bench_parse_soun_tag,
+    'reco_tag.parse_timeline': bench_parse_timeline,
+    'reco_tag.build_seek_index': bench_build_seek_index,
+})
+
+def import_time(importtime_output, module):
+    """Cumulative seconds for the top level import of module"""
+    for line in importtime_output.splitlines():
+        if line.startswith('import time:') and line.rsplit('|', 1)[1] == f' {module}':
+            return int(line.split('|')[1]) / 1_000_000
+    raise ValueError(f'No import time for {module}')
+
+def measure_import(module, repeat):
+    """
+    Import time in a fresh interpreter for each run, then one more run
+    under tracemalloc for the peak memory of the import
+    """
+    env = {k: v for k, v in os.environ.items() if k not in IMPORT_IGNORE_ENV}
+    times = []
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+            cwd=SCRIPTS_DIR, env=env, capture_output=True, text=True, check=True
+        )
+        times.append(import_time(proc.stderr, module))
+
+    proc = subprocess.run(
+        [
+            sys.executable, '-X', 'tracemalloc', '-c',
+            f'import tracemalloc; import {module}; print(tracemalloc.get_traced_memory()[1])'
+        ],
+        cwd=SCRIPTS_DIR, env=env, capture_output=True, text=True, check=True
+    )
+
+    return {
+        'runs': repeat,
+        'min_s': round(min(times), 6),
+        'median_s': round(statistics.median(times), 6),
+        'peak_bytes': int(proc.stdout),
+    }
+
+def measure(fun, repeat):
+    """
+    Timed runs first, then one run under tracemalloc for the peak, so the
+    tracing overhead doesn't count towards the time
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        fun()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        (start_bytes, _) = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        fun()
+        (_, peak_bytes) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'runs': repeat,
+        'min_s': round(min(times), 6),
+        'median_s': round(statistics.median(times), 6),
+        'peak_bytes': peak_bytes - start_bytes,
+    }
+
+def run_benchmarks(corpus_dir, filters, repeat):
+    results = OrderedDict()
+    for name, setup in BENCHMARKS.items():
+        if filters and not any(f in name for f in filters):
+            continue
+        fun = setup(corpus_dir)
+        results[name] = measure(fun, repeat)
+        if DEBUG:
+            print(f'[bench] {name} {results[name]}')
+
+    modules = [
+        module for module in IMPORT_BUDGETS
+        if not filters or any(f in f'import.{module}' for f in filters)
+    ]
+    if modules:
+        # Otherwise stale bytecode would be compiled on every run
+        compileall.compile_dir(SCRIPTS_DIR, quiet=1)
+    for module in modules:
+        name = f'import.{module}'
+        results[name] = measure_import(module, repeat)
+        if DEBUG:
+            print(f'[bench] {name} {results[name]}')
+
+    return {
+        'version': RESULTS_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'corpus': {'version': CORPUS_VERSION, 'sizes': CORPUS_SIZES},
+        'results': results,
+    }
+
+def write_results(results, path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'{path.name}.tmp')
+    with open(tmp_path, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+        results_file.write('\n')
+    os.replace(tmp_path, path)
+    return path
+
+def load_results(path):
+    try:
+        with open(path, 'r') as results_file:
+            results = json.load(results_file)
+        if results.get('version') == RESULTS_VERSION:
+            return results
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    return None
+
+def print_results(results):
+    print(f'{"benchmark":<48} {"median ms":>10} {"min ms":>10} {"peak KiB":>10}')
+    for name, result in results['results'].items():
+        print(
+            f'{name:<48} '
+            f'{result["median_s"] * 1000:>10.2f} '
+            f'{result["min_s"] * 1000:>10.2f} '
+            f'{result["peak_bytes"] / 1024:>10.1f}'
+        )
+
+def over_budget(results):
+    """Warn about the import benchmarks over their budget"""
+    for module, budget in IMPORT_BUDGETS.items():
+        name = f'import.{module}'
+        result = results['results'].get(name)
+        if result and result['min_s'] > budget:
+            print(f'[!] {name} took {result["min_s"] * 1000:.1f}ms, over its {budget * 1000:.1f}ms budget')
+
+def change(old, new):
+    if not old:
+        return 0
+    return (new - old) / old
+
+def compare(baseline, results, time_threshold, memory_threshold):
+    """Print results against the baseline and return the names that regressed"""
+    if baseline['corpus'] != results['corpus']:
+        print('[!] Baseline was measured on a different corpus')
+    if baseline['python'] != results['python']:
+        print(f'[!] Baseline was measured on Python {baseline["python"]}')
+
+    regressions = []
+    print(f'{"benchmark":<48} {"min ms":>10} {"change":>8} {"peak KiB":>10} {"change":>8}')
+    for name, result in results['results'].items():
+        base = baseline['results'].get(name)
+        if not base:
+            print(f'{name:<48} {result["min_s"] * 1000:>10.2f} {"new":>8} {result["peak_bytes"] / 1024:>10.1f} {"new":>8}')
+            continue
+        time_change = change(base['min_s'], result['min_s'])
+        memory_change = change(base['peak_bytes'], result['peak_bytes'])
+        status = ''
+        if time_change > time_threshold or memory_change > memory_threshold:
+            status = 'REGRESSION'
+            regressions.append(name)
+        print(
+            f'{name:<48} '
+            f'{result["min_s"] * 1000:>10.2f} {time_change:>+8.1%} '
+            f'{result["peak_bytes"] / 1024:>10.1f} {memory_change:>+8.1%} '
+            f'{status}'
+        )
+    return regressions
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python3 {sys.argv[0]} run [<benchmark_filter> ...] [<option>=<value> ...]")
+        print(f"       python3 {sys.argv[0]} baseline [<benchmark_filter> ...] [<option>=<value> ...]")
+        print(f"       options: {' '.join(f'{k}={v}' for k, v in OPTIONS.items())}")
+        sys.exit(1)
+
+    command = sys.argv[1]
+    args = sys.argv[2:]
+
+    try:
+        main(command, args)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except BrokenPipeError:
+        sys.stdout = None
+        sys.exit(1)
@@ -18,21 +18,22 @@ def main(game_directory, level, plugin_names):
     """
     Load Myth game tags and plugins and run a map action browser
     """
+    if not level:
+        mono2tag.print_entrypoint_map(loadtags.load_entrypoints(game_directory, plugin_names))
+        return
+
     try:
         (game_version, tags, entrypoint_map, data_map, cutscenes) = loadtags.load_tags(game_directory, plugin_names)
 
-        if level:
-            if level.startswith('file='):
-                file = level[5:]
-                mesh_tag_data = utils.load_file(file)
-            
-                tree_curses.enter(parse_mesh_actions(tags, data_map, mesh_tag_data))
-            else:
-                for mesh_id in mesh2info.mesh_entries(game_version, level, entrypoint_map, tags, plugin_names):
-                    mesh_tag_data = loadtags.get_tag_data(tags, data_map, 'mesh', mesh_id)
-                    tree_curses.enter(parse_mesh_actions(tags, data_map, mesh_tag_data))
+        if level.startswith('file='):
+            file = level[5:]
+            mesh_tag_data = utils.load_file(file)
+        
+            tree_curses.enter(parse_mesh_actions(tags, data_map, mesh_tag_data))
         else:
-            mono2tag.print_entrypoint_map(entrypoint_map)
+            for mesh_id in mesh2info.mesh_entries(game_version, level, entrypoint_map, tags, plugin_names):
+                mesh_tag_data = loadtags.get_tag_data(tags, data_map, 'mesh', mesh_id)
+                tree_curses.enter(parse_mesh_actions(tags, data_map, mesh_tag_data))
     except (struct.error, UnicodeDecodeError) as e:
         raise ValueError(f"Error processing binary data: {e}")
 
@@ -55,7 +56,8 @@ def build_action_help(tags, data_map):
                     'requirement': p_parts2[0].strip(),
                     'desc': p_parts[2].strip(),
                 }
-        action_help[action_type] = {
+        # Tag map keys are codec.TagKey ints, actions look up by name
+        action_help[str(action_type)] = {
             'name': template_lines[0].strip(),
             'expiration_mode': template_lines[1].strip(),
             'params': params
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+import json
+import lzma
+import os
+import pathlib
+import struct
+import sys
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import codec
+import mesh_tag
+import mono2tag
+import monopack
+import mons_tag
+import myth_collection
+import myth_headers
+import myth_projectile
+import myth_sound
+import myth_tags
+
+DEBUG = (os.environ.get('DEBUG') == '1')
+
+MAX_WORKERS = 16
+# A corrupt tag list can fail a check for every tag, only list the first ones
+MAX_ISSUES = 100
+
+TAG_SIGNATURES = {1: 'myth', 2: 'mth2'}
+
+# Type specific headers, as decoded by tag2info.py. Functions take the
+# game version
+HEADER_FORMATS = {
+    'mesh': mesh_tag.MeshHeaderFmt,
+    'soun': myth_sound.SoundHeaderFmt,
+    'amso': myth_sound.AmsoFmt,
+    'lpgr': myth_projectile.LpgrFmt,
+    'core': myth_collection.CollectionRefFmt,
+    'unit': mons_tag.UnitTagFmt,
+    'conn': myth_tags.ConnectorFmt,
+    'part': myth_tags.ParticleSysFmt,
+    'medi': myth_tags.MediaFmt,
+    'prgr': myth_projectile.PrgrHeadFmt,
+    'mode': myth_tags.ModelFmt,
+    'geom': myth_tags.GeomFmt,
+    'mons': mons_tag.MonsTagFmt,
+    'anim': myth_tags.AnimFmt,
+    'scen': myth_tags.SceneryFmt,
+    'proj': myth_projectile.ProjFmt,
+    'arti': mons_tag.ArtifactFmt,
+    '.256': myth_collection.Header256Fmt,
+    'ligh': myth_projectile.LightningFmt,
+    'obje': mons_tag.ObjeTagFmt,
+    'd256': myth_collection.D256HeadFmt,
+}
+
+def main(paths):
+    """
+    Check archives, or every archive in directories, for truncation,
+    out of bounds or overlapping tags, duplicate tags, bad signatures and
+    tags too short for their type's header. Prints a JSON report, exits with 1 if any have errors
+    """
+    files = list(walk_archives(paths))
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        reports = list(executor.map(check_archive, files))
+
+    failed = [report for report in reports if not report['ok']]
+    print(json.dumps({
+        'checked': len(reports),
+        'failed': len(failed),
+        'archives': reports,
+    }, indent=2))
+    if DEBUG:
+        for report in failed:
+            print(f'[checkarchives] {report["path"]}: {report["errors"]} errors', file=sys.stderr)
+    return 1 if failed else 0
+
+def walk_archives(paths):
+    """Files given, and files under directories given, skipping hidden ones"""
+    for path in paths:
+        path = pathlib.Path(path)
+        if path.is_dir():
+            for (dirpath, dirnames, filenames) in os.walk(path):
+                dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+                for filename in sorted(filenames):
+                    if not filename.startswith('.') and filename != 'plugin cache':
+                        yield pathlib.Path(dirpath, filename)
+        else:
+            yield path
+
+class Report:
+    __slots__ = ('path', 'issues', 'errors', 'warnings', 'info')
+
+    def __init__(self, path):
+        self.path = path
+        self.issues = []
+        self.errors = 0
+        self.warnings = 0
+        self.info = {}
+
+    def error(self, check, message, tag=None):
+        self.errors += 1
+        self.add('error', check, message, tag)
+
+    def warning(self, check, message, tag=None):
+        self.warnings += 1
+        self.add('warning', check, message, tag)
+
+    def add(self, severity, check, message, tag):
+        if len(self.issues) < MAX_ISSUES:
+            issue = {'severity': severity, 'check': check, 'message': message}
+            if tag:
+                issue['tag'] = tag
+            self.issues.append(issue)
+
+    def value(self):
+        return {
+            'path': str(self.path),
+            'ok': not self.errors,
+            'errors': self.errors,
+            'warnings': self.warnings,
+            **self.info,
+            'issues': self.issues,
+        }
+
+def check_archive(path):
+    report = Report(path)
+    try:
+        with open(path, 'rb') as archive_file:
+            lock = threading.Lock()
+            file_size = os.fstat(archive_file.fileno()).st_size
+            report.info['size'] = file_size
+
+            def read(offset, size):
+                return mono2tag.read_at(archive_file, lock, offset, size)
+
+            if monopack.is_packed(read(0, min(file_size, len(monopack.MAGIC)))):
+                check_packed_archive(path, file_size, report)
+            else:
+                check_open_archive(read, file_size, report)
+    except (OSError, ValueError) as e:
+        report.error('read', str(e))
+    return report.value()
+
+def check_packed_archive(path, file_size, report):
+    """
+    The chunk index of an archive packed by monopack.py against the file,
+    then the archive it holds. Only the chunks holding its mono header and
+    tag list are decompressed
+    """
+    report.info['packed'] = True
+    try:
+        packed = monopack.PackedArchive(path)
+    except (struct.error, ValueError) as e:
+        report.error('pack_index', str(e))
+        return
+    with packed:
+        packed_end = (
+            monopack.PACK_HEADER.size
+            + len(packed.chunk_entries) * monopack.CHUNK_ENTRY.size
+            + sum(packed_size for (compression, size, packed_size) in packed.chunk_entries)
+        )
+        if packed_end > file_size:
+            report.error('pack_index', f'Chunks end at {packed_end}, file is {file_size}, truncated')
+            return
+        elif packed_end < file_size:
+            report.warning('pack_index', f'{file_size - packed_end} bytes after the last chunk at {packed_end}')
+        compressions = set(monopack.Compression)
+        for (i, (compression, size, packed_size)) in enumerate(packed.chunk_entries):
+            if compression not in compressions:
+                report.error('pack_index', f'Chunk {i} has unknown compression {compression}')
+                return
+
+        report.info['unpacked_size'] = packed.size
+        try:
+            check_open_archive(lambda offset, size: packed[offset:offset + size], packed.size, report)
+        except (lzma.LZMAError, zlib.error) as e:
+            report.error('pack_chunk', f'Error decompressing: {e}')
+
+def check_open_archive(read, file_size, report):
+    """
+    Reads only the mono header and tag list, never tag data, with
+    read(offset, size)
+    """
+    header_data = read(0, min(file_size, myth_headers.SB_MONO_HEADER_SIZE))
+    try:
+        mono_header = myth_headers.parse_mono_header(report.path.name, header_data)
+    except ValueError as e:
+        report.error('signature', f'Not a TFL or SB archive: {e}')
+        return
+    except (struct.error, UnicodeDecodeError) as e:
+        report.error('mono_header', f'Error processing binary data: {e}')
+        return
+    game_version = mono_header.game_version
+    report.info['game_version'] = game_version
+    report.info['tag_count'] = mono_header.tag_count
+    mono2tag.debug_mono_header(mono_header, file_size)
+
+    if game_version == 2:
+        declared_size = mono_header.header.size
+        if declared_size > file_size:
+            report.error('mono_size', f'Header declares {declared_size} bytes, file is {file_size}, truncated')
+        elif declared_size < file_size:
+            report.warning('mono_size', f'{file_size - declared_size} bytes after the declared size of {declared_size}')
+
+    # Regions tag data can't overlap
+    reserved = [(0, mono_header.header_size, 'mono header')]
+    if mono_header.entry_tag_count:
+        entry_list_end = (
+            mono_header.entry_tag_list_start
+            + mono_header.entry_tag_count * myth_headers.ENTRY_TAG_HEADER_SIZE
+        )
+        reserved.append((mono_header.entry_tag_list_start, entry_list_end, 'entrypoint list'))
+    tag_list_end = mono_header.tag_list_start + mono_header.tag_list_size
+    reserved.append((mono_header.tag_list_start, tag_list_end, 'tag list'))
+
+    for (start, end, region) in reserved:
+        if end > file_size:
+            report.error('mono_header', f'The {region} ends at {end}, past the end of the file at {file_size}')
+            return
+
+    tag_list_data = read(mono_header.tag_list_start, mono_header.tag_list_size)
+    try:
+        tag_headers = myth_headers.decode_tag_list(game_version, mono_header.tag_count, tag_list_data)
+    except (struct.error, UnicodeDecodeError, ValueError) as e:
+        report.error('tag_list', f'Error processing binary data: {e}')
+        return
+
+    # Raw column values, decoding a row object per tag is most of the cost
+    # of checking an archive
+    types = tag_headers.column('tag_type')
+    ids = tag_headers.column('tag_id')
+    offsets = tag_headers.column('tag_data_offset')
+    sizes = tag_headers.column('tag_data_size')
+    signatures = tag_headers.column('signature')
+    signature = codec.encode_string(TAG_SIGNATURES[game_version])
+    header_sizes = type_header_sizes(game_version)
+
+    def tag_name(i):
+        return f'{codec.decode_string(types[i])}.{codec.decode_string(ids[i])}'
+
+    seen = {}
+    spans = []
+    for i in range(mono_header.tag_count):
+        if signatures[i] != signature:
+            report.error(
+                'tag_signature',
+                f"Signature '{codec.decode_string(signatures[i])}' in a version {game_version} archive",
+                tag_name(i)
+            )
+
+        key = (types[i], ids[i])
+        if key in seen:
+            report.error('duplicate_tag', f'Tag list entries {seen[key]} and {i} have the same type and id', tag_name(i))
+        else:
+            seen[key] = i
+
+        start = offsets[i]
+        size = sizes[i]
+        end = start + size
+        if start < 0 or size < 0 or end > file_size:
+            report.error('tag_bounds', f'Data {start}+{size} is outside the file of {file_size} bytes', tag_name(i))
+            continue
+        if not size:
+            continue
+        spans.append((start, end, i))
+
+        # Tags too short for the header their type starts with
+        (header_size, header_name) = header_sizes.get(types[i], (0, None))
+        if size < header_size:
+            report.warning('type_header', f'{size} bytes, shorter than a {header_size} byte {header_name}', tag_name(i))
+
+    check_overlaps(spans, reserved, tag_name, report)
+
+def check_overlaps(spans, reserved, tag_name, report):
+    spans.sort()
+    previous = None
+    for span in spans:
+        (start, end, i) = span
+        if previous and start < previous[1]:
+            report.error(
+                'overlap',
+                f'Data {start}-{end} overlaps {tag_name(previous[2])} at {previous[0]}-{previous[1]}',
+                tag_name(i)
+            )
+        if not previous or end > previous[1]:
+            previous = span
+        for (region_start, region_end, region) in reserved:
+            if start < region_end and region_start < end:
+                report.error('overlap', f'Data {start}-{end} overlaps the {region}', tag_name(i))
+
+# Encoded tag type to (header size, header name), by game version
+TYPE_HEADER_SIZES = {}
+
+def type_header_sizes(game_version):
+    if game_version not in TYPE_HEADER_SIZES:
+        header_sizes = {}
+        for (tag_type, header_format) in HEADER_FORMATS.items():
+            if callable(header_format):
+                header_format = header_format(game_version)
+            header_codec = codec.codec(header_format)
+            header_sizes[codec.encode_string(tag_type)] = (header_codec._item_def_size, header_codec._name)
+        TYPE_HEADER_SIZES[game_version] = header_sizes
+    return TYPE_HEADER_SIZES[game_version]
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python3 {sys.argv[0]} <archive_file_or_dir> [<archive_file_or_dir> ...]")
+        sys.exit(1)
+
+    paths = sys.argv[1:]
+
+    try:
+        sys.exit(main(paths))
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except BrokenPipeError:
+        sys.stdout = None
+        sys.exit(1)
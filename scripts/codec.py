@@ -1,3 +1,4 @@
+from array import array
 from collections import namedtuple
 import copy
 import struct
@@ -61,14 +62,15 @@ def value_encoder(
     if value_index is not None:
         if encoder:
             return lambda values, data: value_pack(fmt, encoder(values[value_index]))
-        elif decoder in [int, float]:
+        elif type(decoder) in [int, float]:
             return lambda values, data: value_pack(fmt, round(values[value_index] * decoder))
         elif decoder:
             return lambda values, data: value_pack(fmt, conditional_value(values[value_index]))
         else:
             return lambda values, data: value_pack(fmt, values[value_index])
     elif data_start is not None and data_end is not None:
-        return lambda values, data: value_pack(fmt, data[data_start:data_end] if data else None)
+        # Padding is zero filled when there's no original data to copy from
+        return lambda values, data: value_pack(fmt, data[data_start:data_end] if data else bytes(data_end - data_start))
     else:
         print('invalid encoder', value_index, encoder, decoder, data_start, data_end)
         sys.exit(1)
@@ -182,15 +184,7 @@ class _ListCodec:
     # items
 
     def __init__(self, item_data, offset=0):
-        if self.MAX_ITEMS is None:
-            self.original_data = item_data[offset:]
-            self.MAX_ITEMS = len(self.original_data) / self.data_size()
-            if not self.MAX_ITEMS.is_integer():
-                raise ValueError('Item data not divisible by format length')
-            self.MAX_ITEMS = round(self.MAX_ITEMS)
-        else:
-            data_end = offset + self.MAX_ITEMS * self.data_size()
-            self.original_data = item_data[offset:data_end]
+        self._slice_data(item_data, offset)
         self.items = []
 
         start = 0
@@ -204,6 +198,17 @@ class _ListCodec:
                 self.items.append(None)
             start = end
 
+    def _slice_data(self, item_data, offset):
+        if self.MAX_ITEMS is None:
+            self.original_data = item_data[offset:]
+            self.MAX_ITEMS = len(self.original_data) / self.data_size()
+            if not self.MAX_ITEMS.is_integer():
+                raise ValueError('Item data not divisible by format length')
+            self.MAX_ITEMS = round(self.MAX_ITEMS)
+        else:
+            data_end = offset + self.MAX_ITEMS * self.data_size()
+            self.original_data = item_data[offset:data_end]
+
     def data_size(self):
         return self.CODEC._item_def_size
 
@@ -233,37 +238,147 @@ class _ListCodec:
                 if self.EMPTY_VALUE:
                     item_data += self.EMPTY_VALUE
                 else:
-                    item_data += self.item_def_size * b'\x00'
+                    item_data += self.data_size() * b'\x00'
         return bytes(item_data)
 
+# Struct format character to array typecode for numeric columns
+ARRAY_TYPECODES = {
+    'b': 'b', 'B': 'B',
+    'h': 'h', 'H': 'H',
+    'i': 'q', 'I': 'Q',
+    'l': 'q', 'L': 'Q',
+    'q': 'q', 'Q': 'Q',
+    'f': 'f', 'd': 'd',
+}
+
+_FILTERED = object()
+
+class _BulkListCodec(_ListCodec):
+    """
+    Unpacks the whole list in one struct.iter_unpack pass and keeps the raw
+    values column-wise, numeric fields in arrays. Row objects (with decoders
+    and FILTER applied) are only built when an item is accessed
+    """
 
-class _Codec:
-    # Required attributes Populated dynamically by codec
-    _DefFmt = None
+    # Instance variables
+    # original_data
+    # _columns
+    # _rows
 
-    _fmt_string = None
-    _name = None
-    _decoders = []
-    _encoders = []
-    _fields = []
-    _nt = None
+    def __init__(self, item_data, offset=0):
+        self._slice_data(item_data, offset)
+        fields = self.CODEC._fields
+        columns = list(zip(*struct.iter_unpack(self.CODEC._fmt_string, self.original_data)))
+        if not columns:
+            columns = [()] * len(fields)
+        self._columns = []
+        for fmt, column in zip(self.CODEC._value_formats, columns):
+            typecode = ARRAY_TYPECODES.get(fmt)
+            self._columns.append(array(typecode, column) if typecode else column)
+        self._rows = [None] * self.MAX_ITEMS
+
+    def column(self, name):
+        """Raw undecoded values of a field for every item"""
+        return self._columns[self.CODEC._fields.index(name)]
+
+    def _row(self, index):
+        row = self._rows[index]
+        if row is None:
+            size = self.data_size()
+            start = index * size
+            row = self.CODEC._make(
+                tuple(column[index] for column in self._columns),
+                bytes(self.original_data[start:start + size])
+            )
+            if self.FILTER and not self.FILTER(row):
+                row = _FILTERED
+            self._rows[index] = row
+        if row is _FILTERED:
+            return None
+        return row
 
-    _item_def_size = 0
+    @property
+    def items(self):
+        return list(self)
 
-    # Instance variables
-    # _original_data
-    # _item
+    def __iter__(self):
+        return (self._row(i) for i in range(self.MAX_ITEMS))
+
+    def __contains__(self, x):
+        return x in iter(self)
+
+    def __len__(self):
+        return self.MAX_ITEMS
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._row(i) for i in range(*index.indices(self.MAX_ITEMS))]
+        if index < 0:
+            index += self.MAX_ITEMS
+        if not 0 <= index < self.MAX_ITEMS:
+            raise IndexError('list index out of range')
+        return self._row(index)
+
+
+# Built from _DefFmt on first use, see _CodecType
+_CODEC_ATTRIBUTES = frozenset([
+    '_fmt_string', '_decoders', '_encoders', '_fields', '_value_formats',
+    '_nt', '_item_def_size', '_has_padding',
+])
+
+class _CodecType(type):
+    """
+    Most codecs are defined at import but only a few are used by any one
+    script, so the struct format, decoders and namedtuple are built the
+    first time one of their attributes is looked up
+    """
+    def __getattr__(cls, name):
+        if name not in _CODEC_ATTRIBUTES or cls._DefFmt is None:
+            raise AttributeError(name)
+        (_, field_format) = cls._DefFmt
+        (_, fmt_string, decoders, encoders, fields) = _data_format(cls._DefFmt)
+        cls._fmt_string = fmt_string
+        cls._decoders = decoders
+        cls._encoders = encoders
+        cls._fields = fields
+        cls._value_formats = [f[0] for f in field_format if f[1]]
+        cls._nt = namedtuple(cls._name, fields)
+        cls._item_def_size = struct.calcsize(fmt_string)
+        # Original bytes are only needed to re-encode padding fields
+        cls._has_padding = any(not f[1] for f in field_format)
+        return type.__getattribute__(cls, name)
+
+class _Codec(metaclass=_CodecType):
+    # Required attributes Populated dynamically by codec, the rest are
+    # built by _CodecType
+    _DefFmt = None
+    _name = None
+
+    __slots__ = ('_original_data', '_item')
 
     def __init__(self, item_data=None, values=None, offset=0):
-        end = offset + self._item_def_size
+        # Class lookups, instance lookups of unbuilt attributes would end
+        # up in __getattr__ below
+        cls = type(self)
+        end = offset + cls._item_def_size
         self._original_data = None
         if item_data:
-            self._original_data = item_data[offset:end]
-        if self._original_data:
-            values = struct.unpack(self._fmt_string, self._original_data)
+            # Only copy this item, item_data may be a memoryview over a whole file
+            original_data = bytes(item_data[offset:end])
+            values = struct.unpack(cls._fmt_string, original_data)
+            if cls._has_padding:
+                self._original_data = original_data
         if values:
-            processed = _process_data_values(values, self._decoders)
-            self._item = self._nt._make(processed)
+            processed = _process_data_values(values, cls._decoders)
+            self._item = cls._nt._make(processed)
+
+    @classmethod
+    def _make(cls, values, original_data=None):
+        """Build from already unpacked values without unpacking again"""
+        obj = cls.__new__(cls)
+        obj._original_data = original_data if cls._has_padding else None
+        obj._item = cls._nt._make(_process_data_values(values, cls._decoders))
+        return obj
 
     def data_size(self):
         return self._item_def_size
@@ -300,18 +415,32 @@ class _Codec:
     def __repr__(self):
         return f'{self._item}'
 
+_NOT_DECODED = object()
+# Short strings (tag types and ids) repeat across every archive, share them
+INTERN_LENGTH = 4
+_INTERNED = {}
+
 class String:
-    def __init__(self, encoded):
-        self._encoded = encoded
-        self._decoded_value = None
-        self._is_decoded = False
+    __slots__ = ('_encoded', '_decoded_value')
+
+    def __new__(cls, encoded):
+        interned = len(encoded) <= INTERN_LENGTH and cls is String
+        if interned and encoded in _INTERNED:
+            return _INTERNED[encoded]
+        obj = super().__new__(cls)
+        obj._encoded = bytes(encoded)
+        obj._decoded_value = _NOT_DECODED
+        if interned:
+            _INTERNED[obj._encoded] = obj
+        return obj
 
     @property
     def _decoded(self):
-        if not self._is_decoded:
-            if not all_on(self._encoded):
+        if self._decoded_value is _NOT_DECODED:
+            if all_on(self._encoded):
+                self._decoded_value = None
+            else:
                 self._decoded_value = decode_string(self._encoded)
-            self._is_decoded = True
         return self._decoded_value
 
     @property
@@ -376,8 +505,122 @@ class String:
         return self._encoded.decode(*args, **kwargs)
 
     def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
         return getattr(self._decoded, name)
 
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (self.__class__, (self._encoded,))
+
+_TAG_KEYS = {}
+
+class TagKey(int):
+    """
+    4 byte tag type or id packed into a 32 bit int from its raw bytes.
+    Hashes and compares as an int, only decoded to a string for display
+    """
+    __slots__ = ()
+
+    def __new__(cls, value):
+        if type(value) is TagKey:
+            return value
+        if isinstance(value, String):
+            value = value.value
+        elif isinstance(value, (bytearray, memoryview)):
+            value = bytes(value)
+        # Keyed by the str, bytes or int given. Never by String, which
+        # compares equal to its text without anything after a null
+        key = _TAG_KEYS.get(value)
+        if key is None:
+            if isinstance(value, int):
+                raw = value.to_bytes(4, 'big')
+            elif isinstance(value, str):
+                raw = encode_string(value)
+            else:
+                raw = bytes(value)
+            # Decoding stops at the first null, so truncate and pad the same way
+            packed = int.from_bytes(raw.split(b'\0', 1)[0][:4].ljust(4, b'\0'), 'big')
+            key = _TAG_KEYS.get(packed)
+            if key is None:
+                key = super().__new__(cls, packed)
+                _TAG_KEYS[packed] = key
+            _TAG_KEYS[value] = key
+        return key
+
+    @property
+    def encoded(self):
+        return self.to_bytes(4, 'big')
+
+    @property
+    def value(self):
+        return self.encoded
+
+    def all_on(self):
+        return self == 0xffffffff
+
+    def all_off(self):
+        return self == 0
+
+    def is_null(self):
+        return self.all_on() or self.all_off()
+
+    def __eq__(self, other):
+        if isinstance(other, int):
+            return int.__eq__(self, other)
+        if isinstance(other, (str, bytes, String)):
+            return int.__eq__(self, TagKey(other))
+        return NotImplemented
+
+    def __ne__(self, other):
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    __hash__ = int.__hash__
+
+    def __str__(self):
+        return decode_string(self.encoded)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({str(self)!r})'
+
+    def __format__(self, format_spec):
+        return format(str(self), format_spec)
+
+    def __fspath__(self):
+        return str(self)
+
+    def __bytes__(self):
+        return self.encoded
+
+    def encode(self, *args, **kwargs):
+        return str(self).encode(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(str(self), name)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (self.__class__, (int(self),))
+
+def tag_key(value):
+    """TagKey from a str, bytes, String or int tag type/id. None passes through"""
+    if value is None:
+        return None
+    return TagKey(value)
+
 def list_pack(name, max_items, fmt, filter_fun=None, empty_value=None, offset=0):
     return type(name, (_ListPacker,), {
         'MAX_ITEMS': max_items,
@@ -389,7 +632,11 @@ def list_pack(name, max_items, fmt, filter_fun=None, empty_value=None, offset=0)
         'item_def_size': struct.calcsize(fmt),
     })
 
-def list_codec(max_items, fmt, filter_fun=None, empty_value=None):
+def list_codec(max_items, fmt, filter_fun=None, empty_value=None, bulk=False):
+    """
+    bulk: decode with a single unpack pass into columns, building row
+    objects on access. Best for long lists where few rows are used
+    """
     if isinstance(fmt, type) and issubclass(fmt, _Codec):
         fmt_codec = fmt
     else:
@@ -402,7 +649,8 @@ def list_codec(max_items, fmt, filter_fun=None, empty_value=None):
         'CODEC': fmt_codec,
     }
 
-    return type(f'{name}List', (_ListCodec,), attributes)
+    base = _BulkListCodec if bulk else _ListCodec
+    return type(f'{name}List', (base,), attributes)
 
 _CODEC_CACHE = {}
 
@@ -412,20 +660,11 @@ def codec(fmt):
     cache_key = (name, field_names)
     if cache_key in _CODEC_CACHE:
         return _CODEC_CACHE[cache_key]
-    (name, fmt_string, decoders, encoders, fields) = _data_format(fmt)
-    nt = namedtuple(name, fields)
 
-    _CODEC_CACHE[cache_key] = type(name, (_Codec,), {
+    _CODEC_CACHE[cache_key] = _CodecType(name, (_Codec,), {
+        '__slots__': (),
         '_DefFmt': fmt,
-
-        '_fmt_string': fmt_string,
         '_name': name,
-        '_decoders': decoders,
-        '_encoders': encoders,
-        '_fields': fields,
-        '_nt': nt,
-
-        '_item_def_size': struct.calcsize(fmt_string),
     })
     return _CODEC_CACHE[cache_key]
 
@@ -457,6 +696,8 @@ def decode_string_none(s):
         return decode_string(s)
 
 def decode_string(s):
+    if isinstance(s, String):
+        s = s.value
     return s.split(b'\0', 1)[0].decode('mac-roman')
 
 def encode_string_none(s):
@@ -482,6 +723,8 @@ class Simple:
     INT = False
     PRECISION = 3
 
+    __slots__ = ('encoded',)
+
     def __init__(self, encoded):
         self.encoded = encoded
 
@@ -595,28 +838,36 @@ class Simple:
 
 class Fixed(Simple):
     SF = FIXED_SF
+    __slots__ = ()
 
 class ShortFixed(Simple):
     SF = SHORT_FIXED_SF
+    __slots__ = ()
 
 class Percent(Simple):
     SF = PERCENT_SF
+    __slots__ = ()
 
 class ShortPercent(Percent):
     SF = SHORT_PERCENT_SF
+    __slots__ = ()
 
 class Angle(Simple):
     SF = ANGLE_SF
     INT = True
+    __slots__ = ()
 
 class AngularVelocity(Angle):
     SF = ANGULAR_VELOCITY_SF
+    __slots__ = ()
 
 class World(Simple):
     SF = WORLD_POINT_SF
+    __slots__ = ()
 
 class Time(Simple):
     SF = TIME_SF
+    __slots__ = ()
 
 def scale(value, sf, to_int):
     if sf != 1:
@@ -635,6 +886,8 @@ class _Delta:
     TYPE = Simple
     LOWER_BOUND = None
 
+    __slots__ = ('wrapped',)
+
     def __init__(self, encoded):
         self.wrapped = self.TYPE(encoded)
 
@@ -675,53 +928,62 @@ class _Delta:
 
 def delta(lower_bound):
     return type('Delta', (_Delta,), {
+        '__slots__': (),
         'LOWER_BOUND': lower_bound,
     })
 
 def world_delta(lower_bound):
     return type('WorldDelta', (_Delta,), {
+        '__slots__': (),
         'LOWER_BOUND': lower_bound,
         'TYPE': World,
     })
 
 def angle_delta(lower_bound):
     return type('AngleDelta', (_Delta,), {
+        '__slots__': (),
         'LOWER_BOUND': lower_bound,
         'TYPE': Angle
     })
 
 def angular_velocity_delta(lower_bound):
     return type('AngularVelocityDelta', (_Delta,), {
+        '__slots__': (),
         'LOWER_BOUND': lower_bound,
         'TYPE': AngularVelocity,
     })
 
 def time_delta(lower_bound):
     return type('TimeDelta', (_Delta,), {
+        '__slots__': (),
         'LOWER_BOUND': lower_bound,
         'TYPE': Time,
     })
 
 def fixed_delta(lower_bound):
     return type('FixedDelta', (_Delta,), {
+        '__slots__': (),
         'LOWER_BOUND': lower_bound,
         'TYPE': Fixed,
     })
 
 def short_fixed_delta(lower_bound):
     return type('ShortFixedDelta', (_Delta,), {
+        '__slots__': (),
         'LOWER_BOUND': lower_bound,
         'TYPE': ShortFixed,
     })
 
 def percent_delta(lower_bound):
     return type('PercentDelta', (_Delta,), {
+        '__slots__': (),
         'LOWER_BOUND': lower_bound,
         'TYPE': Percent,
     })
 
 def short_percent_delta(lower_bound):
     return type('ShortPercentDelta', (_Delta,), {
+        '__slots__': (),
         'LOWER_BOUND': lower_bound,
         'TYPE': ShortPercent,
     })
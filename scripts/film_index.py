@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+import datetime
+import os
+import pathlib
+import re
+import sqlite3
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import codec
+import mesh_tag
+import myth_headers
+import player_headers
+import reco_scan
+import reco_tag
+import utils
+
+# Only needed for the stats option
+reco2stats = utils.lazy_import('reco2stats')
+
+DEBUG = (os.environ.get('DEBUG') == '1')
+
+INDEX_FILE = '../output/cache/film_index.sqlite'
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS films (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    is_film INTEGER NOT NULL,
+    played TEXT,
+    scenario_tag TEXT,
+    game_type TEXT,
+    difficulty INTEGER,
+    time_limit INTEGER,
+    pregame_time_limit INTEGER,
+    option_flags INTEGER,
+    version INTEGER,
+    player_count INTEGER
+);
+CREATE TABLE IF NOT EXISTS players (
+    path TEXT NOT NULL REFERENCES films(path) ON DELETE CASCADE,
+    player_index INTEGER NOT NULL,
+    name TEXT,
+    team_name TEXT,
+    unique_identifier INTEGER,
+    team_captain_identifier INTEGER,
+    metaserver_player_id INTEGER,
+    observer INTEGER
+);
+CREATE TABLE IF NOT EXISTS plugins (
+    path TEXT NOT NULL REFERENCES films(path) ON DELETE CASCADE,
+    name TEXT,
+    url TEXT,
+    checksum INTEGER
+);
+CREATE INDEX IF NOT EXISTS films_scenario ON films(scenario_tag);
+CREATE INDEX IF NOT EXISTS films_game_type ON films(game_type);
+CREATE INDEX IF NOT EXISTS films_played ON films(played);
+CREATE INDEX IF NOT EXISTS players_path ON players(path);
+CREATE INDEX IF NOT EXISTS players_name ON players(name COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS plugins_path ON plugins(path);
+CREATE INDEX IF NOT EXISTS plugins_name ON plugins(name);
+"""
+
+BAGRADA_DATE = r'bagrada(\d{4,4})_(\d{2,2})_(\d{2,2})__(\d{2,2})_(\d{2,2})_(\d{2,2})'
+
+# Query filters in key=value form, mapped to a where clause
+FILTERS = {
+    'mesh': 'f.scenario_tag = ?',
+    'type': 'f.game_type = ?',
+    'difficulty': 'f.difficulty = ?',
+    'since': 'f.played >= ?',
+    'until': 'f.played < ?',
+    'player': 'f.path IN (SELECT path FROM players WHERE name LIKE ?)',
+    'plugin': 'f.path IN (SELECT path FROM plugins WHERE name = ?)',
+}
+
+def main(command, args):
+    """
+    Build and query an index of recording files
+    """
+    db = open_index()
+    if command == 'update':
+        for input_dir in args:
+            (added, removed, total) = update_index(db, input_dir)
+            print(f'{input_dir}: added={added} removed={removed} films={total}')
+    elif command == 'query':
+        for film in query_films(db, parse_filters(args)):
+            print_film(film)
+    elif command == 'stats':
+        game_directory = args[0]
+        for film in query_films(db, parse_filters(args[1:])):
+            print(film['path'])
+            reco2stats.main(game_directory, film['path'])
+    else:
+        print(f'Unknown command: {command}')
+        sys.exit(1)
+
+def index_path():
+    return pathlib.Path(sys.path[0], INDEX_FILE).resolve()
+
+def open_index(path=None):
+    if not path:
+        path = index_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    db.execute('PRAGMA foreign_keys = ON')
+    (version,) = db.execute('PRAGMA user_version').fetchone()
+    if version != SCHEMA_VERSION:
+        db.executescript(
+            'DROP TABLE IF EXISTS players;'
+            'DROP TABLE IF EXISTS plugins;'
+            'DROP TABLE IF EXISTS films;'
+        )
+        db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    db.executescript(SCHEMA)
+    return db
+
+def film_date(file_path, stat):
+    """Bagrada films carry their start time in the name, otherwise use mtime"""
+    m = re.search(BAGRADA_DATE, pathlib.Path(file_path).name)
+    if m:
+        return datetime.datetime(*[int(g) for g in m.groups()]).isoformat()
+    return datetime.datetime.fromtimestamp(stat.st_mtime).isoformat(timespec='seconds')
+
+def read_film(file_path):
+    try:
+        with open(file_path, 'rb') as f:
+            data = f.read(reco_tag.HEAD_READ_SIZE)
+        if len(data) < reco_tag.HEAD_READ_SIZE:
+            return None
+        if myth_headers.parse_header(data).tag_type != 'reco':
+            return None
+        (header, reco_data, reco, game_param, game_data, save_game) = reco_tag.parse_reco_head_data(data)
+        return (game_param, game_data)
+    except (struct.error, UnicodeDecodeError, ValueError):
+        return None
+    except OSError as e:
+        print(f"[!] Failed to read {file_path}: {e}")
+        return None
+
+def film_rows(file_path, stat, parsed):
+    (game_param, game_data) = parsed
+    film = (
+        file_path, stat.st_size, stat.st_mtime_ns, 1,
+        film_date(file_path, stat),
+        codec.decode_string(game_param.scenario_tag),
+        mesh_tag.NetgameFlagInfo.get(game_param.scoring),
+        game_param.difficulty_level,
+        game_param.time_limit,
+        game_param.pregame_time_limit,
+        game_param.option_flags.value,
+        game_param.version,
+        game_data.player_count,
+    )
+    players = [
+        (
+            file_path, player_index,
+            reco_tag.player_name(player),
+            str(player.appearance.team_name),
+            player.unique_identifier,
+            player.team_captain_identifier,
+            player.metaserver_player_id,
+            int(player_headers.is_observer(player)),
+        )
+        for player_index, player in enumerate(game_data.players)
+    ]
+    plugins = [
+        (file_path, codec.decode_string(name), codec.decode_string(url), checksum)
+        for (name, url, checksum) in game_param.plugin_data
+    ]
+    return (film, players, plugins)
+
+def update_index(db, input_dir):
+    """
+    Add new or modified films under input_dir to the index and drop films
+    that no longer exist. Unchanged files (by size and mtime) are not read
+    """
+    root = os.path.abspath(input_dir)
+    known = {
+        row['path']: (row['size'], row['mtime_ns'])
+        for row in db.execute('SELECT path, size, mtime_ns FROM films')
+        if row['path'].startswith(root + os.sep)
+    }
+
+    seen = set()
+    to_read = []
+    for (file_path, stat) in reco_scan.walk_files(root):
+        seen.add(file_path)
+        if known.get(file_path) != (stat.st_size, stat.st_mtime_ns):
+            to_read.append((file_path, stat))
+
+    removed = [(p,) for p in known if p not in seen]
+    added = 0
+    with db:
+        db.executemany('DELETE FROM films WHERE path = ?', removed)
+        if to_read:
+            with ThreadPoolExecutor(max_workers=reco_scan.MAX_WORKERS) as executor:
+                results = executor.map(read_film, [file_path for (file_path, stat) in to_read])
+                for ((file_path, stat), parsed) in zip(to_read, results):
+                    db.execute('DELETE FROM films WHERE path = ?', (file_path,))
+                    if parsed:
+                        (film, players, plugins) = film_rows(file_path, stat, parsed)
+                        db.execute(f'INSERT INTO films VALUES ({", ".join("?" * len(film))})', film)
+                        db.executemany('INSERT INTO players VALUES (?, ?, ?, ?, ?, ?, ?, ?)', players)
+                        db.executemany('INSERT INTO plugins VALUES (?, ?, ?, ?)', plugins)
+                        added += 1
+                    else:
+                        # Remember non-film files so they aren't read again
+                        db.execute(
+                            'INSERT INTO films (path, size, mtime_ns, is_film) VALUES (?, ?, ?, 0)',
+                            (file_path, stat.st_size, stat.st_mtime_ns)
+                        )
+
+    (total,) = db.execute(
+        "SELECT COUNT(*) FROM films WHERE is_film AND path LIKE ? || '%'", (root + os.sep,)
+    ).fetchone()
+    return (added, len(removed), total)
+
+def parse_filters(args):
+    filters = []
+    for arg in args:
+        (key, _, value) = arg.partition('=')
+        if key not in FILTERS:
+            print(f'Unknown filter: {key} (expected one of {", ".join(FILTERS)})')
+            sys.exit(1)
+        if key == 'type':
+            value = game_type_key(value)
+        elif key == 'difficulty' and not value.isdigit():
+            difficulties = [d.lower() for d in mesh_tag.Difficulty]
+            if value.lower() not in difficulties:
+                print(f'Unknown difficulty: {value} (expected one of {", ".join(difficulties)})')
+                sys.exit(1)
+            value = difficulties.index(value.lower())
+        elif key == 'player':
+            value = f'%{value}%'
+        filters.append((key, value))
+    return filters
+
+def game_type_key(value):
+    """Accept either the short name (terries) or the full name (Territories)"""
+    for key, name in mesh_tag.NetgameNames.items():
+        if value.lower() in (key, name.lower()):
+            return key
+    return value
+
+def query_films(db, filters):
+    where = ' AND '.join(['f.is_film'] + [FILTERS[key] for (key, value) in filters])
+    params = [value for (key, value) in filters]
+    films = db.execute(f'SELECT f.* FROM films f WHERE {where} ORDER BY f.played, f.path', params).fetchall()
+    return [
+        dict(film) | {
+            'players': db.execute(
+                'SELECT * FROM players WHERE path = ? ORDER BY player_index', (film['path'],)
+            ).fetchall(),
+            'plugins': db.execute(
+                'SELECT name FROM plugins WHERE path = ?', (film['path'],)
+            ).fetchall(),
+        }
+        for film in films
+    ]
+
+def print_film(film):
+    game_type = mesh_tag.NetgameNames.get(film['game_type'], 'Unknown')
+    print(
+        f'{film["played"]} '
+        f'{game_type}: mesh={film["scenario_tag"]} '
+        f'[{mesh_tag.difficulty(film["difficulty"])}] '
+        f'{film["path"]}'
+    )
+    players = [p['name'] for p in film['players'] if not p['observer']]
+    print(f'  players: {", ".join(players)}')
+    if film['plugins']:
+        print(f'  plugins: {", ".join(p["name"] for p in film["plugins"])}')
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python3 {sys.argv[0]} update <input_dir> [<input_dir> ...]")
+        print(f"       python3 {sys.argv[0]} query [<filter>=<value> ...]")
+        print(f"       python3 {sys.argv[0]} stats <game_directory> [<filter>=<value> ...]")
+        sys.exit(1)
+
+    command = sys.argv[1]
+    args = sys.argv[2:]
+
+    try:
+        main(command, args)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except BrokenPipeError:
+        sys.stdout = None
+        sys.exit(1)
@@ -22,7 +22,7 @@ def main(mono_path, output_file):
 
     try:
         mono_header = myth_headers.parse_mono_header(mono_path.name, data)
-        mono2tag.debug_mono_header(mono_header, data)
+        mono2tag.debug_mono_header(mono_header, len(data))
         entrypoints = mono2tag.get_entrypoints(data, mono_header)
         if len(entrypoints):
             mono2tag.print_entrypoint_map(entrypoints, ': Current')
@@ -31,7 +31,7 @@ def main(mono_path, output_file):
                 print("Entrypoints up to date")
             else:
                 new_mono_header = myth_headers.parse_mono_header(mono_path.name, new_mono_data)
-                mono2tag.debug_mono_header(new_mono_header, new_mono_data)
+                mono2tag.debug_mono_header(new_mono_header, len(new_mono_data))
                 new_entrypoints = mono2tag.get_entrypoints(new_mono_data, new_mono_header)
                 mono2tag.print_entrypoint_map(new_entrypoints, ': Fixed')
 
@@ -60,13 +60,14 @@ Mismatching entries that need fixing are marked with an x
 ------+------------------------------------------------------------------+------------------------------------------------------------------+"""
     )
     tags = myth_headers.get_mono_tags(data, mono_header)
+    index = mono2tag.tag_index(tags)
     fixed = False
     for entry_id, (entry_name, entry_long_name, archive_list) in entrypoints.items():
-        mesh_data = mono2tag.seek_tag(tags, 'mesh', entry_id, data, mono_header)
+        mesh_data = mono2tag.seek_tag(index, tags, 'mesh', entry_id, data)
         if mesh_data:
             mesh_header = mesh_tag.parse_header(mesh_data)
             desc_tag = codec.decode_string(mesh_header.map_description_string_list_tag)
-            desc_data = mono2tag.seek_tag(tags, 'stli', desc_tag, data, mono_header)
+            desc_data = mono2tag.seek_tag(index, tags, 'stli', desc_tag, data)
             if desc_data:
                 (_, desc_text) = myth_headers.parse_text_tag(desc_data)
                 level_name = codec.decode_string(desc_text.split(b'\r')[0])
@@ -1,7 +1,5 @@
 #!/usr/bin/env python3
 import enum
-import urllib.request
-import urllib.parse
 
 import codec
 import mesh_tag
@@ -44,7 +42,7 @@ class GameOptionFlags(enum.Flag):
 NewGameDataFmt = ('NewGameData', [
     ('h', 'player_count'),
     ('h', 'local_player_index'),
-    ('1984s', 'players', codec.list_codec(16, player_headers.NewPlayerDataFmt)),
+    ('1984s', 'players', codec.list_codec(16, player_headers.NewPlayerDataFmt, bulk=True)),
     ('L', 'public_tags_checksum'),
     ('L', 'private_tags_checksum'),
 ])
@@ -105,6 +103,10 @@ def parse_save(data):
     return codec.codec(SaveGameHeaderFmt)(data)
 
 def find_plugin(plugin):
+    # Slow to import and only needed when looking up missing plugins
+    import urllib.parse
+    import urllib.request
+
     # POST data
     data = {
         'plugin_name': codec.decode_string(plugin[0]),
@@ -4,15 +4,28 @@ import os
 import pathlib
 import struct
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import codec
 import myth_headers
 import mono2tag
+import tracing
 import utils
 
+# Only needed for packed archives
+monopack = utils.lazy_import('monopack')
+# Only needed in client mode
+sharedtags = utils.lazy_import('sharedtags')
+tagserver = utils.lazy_import('tagserver')
+
 DEBUG = (os.environ.get('DEBUG') == '1')
 IS_VTFL = (os.environ.get('VTFL') == '1')
 FORCE_VTFL = (os.environ.get('FORCE_VTFL') == '1')
 UNITY = os.environ.get('UNITY')
+USE_TAGSERVER = os.environ.get('TAGSERVER') not in [None, '', '0']
+
+MAX_WORKERS = 16
 
 UNITY_1_5 = 'Patch 1.5 Unity'
 UNITY_1_8_5 = 'Patch 1.8.5 Unity'
@@ -85,33 +98,203 @@ def main(game_directory, plugin_names):
     except (struct.error, UnicodeDecodeError) as e:
         raise ValueError(f"Error processing binary data: {e}")
 
+class TagMap(dict):
+    """
+    dict keyed by codec.TagKey. Lookups also accept str, bytes or
+    codec.String tag types and ids, which are packed the same way
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        return super().__getitem__(codec.tag_key(key))
+
+    def __setitem__(self, key, value):
+        super().__setitem__(codec.tag_key(key), value)
+
+    def __contains__(self, key):
+        return super().__contains__(codec.tag_key(key))
+
+    def get(self, key, default=None):
+        return super().get(codec.tag_key(key), default)
+
 def lookup_tag_header(tags, tag_type, tag_id):
     if tag_type in tags and tag_id in tags[tag_type]:
         return tags[tag_type][tag_id][-1]
     return (None, None)
 
-def load_tags(game_directory, plugin_names=[]):
+@tracing.traced()
+def load_tags(game_directory, plugin_names=[], tag_types=None):
+    """
+    With tag_types, only tags of those types are indexed and archive data
+    is read from disk as tags are fetched, for tools that need a few types
+    """
+    plugin_names = [os.path.basename(p) for p in plugin_names]
+    loaded = RESIDENT.get(resident_key(game_directory, plugin_names))
+    if loaded:
+        return select_loaded_types(loaded, tag_types)
+    # Read per call, sharedtags.publish() sets it after import for the
+    # processes it starts, including forked ones
+    shared_tags = os.environ.get('SHARED_TAGS')
+    if shared_tags:
+        loaded = sharedtags.load_tags(shared_tags, game_directory, plugin_names)
+    if not loaded and USE_TAGSERVER:
+        loaded = tagserver.load_tags(game_directory, plugin_names)
+    if loaded:
+        return select_loaded_types(loaded, tag_types)
+    return load_local_tags(game_directory, plugin_names, tag_types)
+
+# load_tags() results kept for the life of the process by keep_resident(),
+# including in workers forked from it
+RESIDENT = {}
+
+def resident_key(game_directory, plugin_names):
+    return (str(pathlib.Path(game_directory).resolve()), tuple(plugin_names))
+
+def keep_resident(game_directory, plugin_names=[]):
+    """
+    Load tags into this process, with later load_tags() calls for the same
+    tags returning them. Always loaded locally, a tag server connection
+    can't be shared with forked workers
+    """
     plugin_names = [os.path.basename(p) for p in plugin_names]
+    key = resident_key(game_directory, plugin_names)
+    if key not in RESIDENT:
+        RESIDENT[key] = load_local_tags(game_directory, plugin_names)
+    return RESIDENT[key]
+
+def select_loaded_types(loaded, tag_types):
+    if not tag_types:
+        return loaded
+    (game_version, tags, entrypoint_map, data_map, cutscenes) = loaded
+    return (game_version, select_tag_types(tags, tag_types), entrypoint_map, data_map, cutscenes)
+
+def load_local_tags(game_directory, plugin_names, tag_types=None):
+    """load_tags() without asking the tag server"""
     (files, cutscenes) = build_file_list(game_directory, plugin_names)
-    (game_version, tags, entrypoint_map, data_map) = build_tag_map(files)
+    (game_version, tags, entrypoint_map, data_map) = build_tag_map(files, tag_types)
     return (game_version, tags, entrypoint_map, data_map, cutscenes)
 
+def select_tag_types(tags, tag_types):
+    selected = TagMap()
+    for tag_type in tag_types:
+        if tag_type in tags:
+            selected[tag_type] = tags[tag_type]
+    return selected
+
+class SlicedData:
+    """
+    Archive data that isn't held in memory. Slicing reads just that range
+    with read(start, end), which is all get_tag_data and get_tag_info need
+    """
+    __slots__ = ('size',)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1 or None][0]
+        indices = range(*key.indices(self.size))
+        if not indices:
+            return b''
+        if indices.step != 1:
+            (low, high) = sorted((indices[0], indices[-1]))
+            return self[low:high + 1][indices[0] - low::indices.step]
+        return self.read(indices.start, indices.stop)
+
+    def read(self, start, end):
+        raise NotImplementedError
+
+class ArchiveData(SlicedData):
+    """Archive data left on disk"""
+    __slots__ = ('file', 'lock')
+
+    def __init__(self, path):
+        try:
+            self.file = open(path, 'rb')
+        except FileNotFoundError:
+            print(f"Error: File not found - {path}")
+            sys.exit(1)
+        self.lock = threading.Lock()
+        self.size = os.fstat(self.file.fileno()).st_size
+
+    def read(self, start, end):
+        return mono2tag.read_at(self.file, self.lock, start, end - start)
+
+@tracing.traced()
+def load_entrypoints(game_directory, plugin_names=[]):
+    """
+    Just the entrypoint map of load_tags, for listing levels. Only the
+    mono header and entrypoint table of each archive are read
+    """
+    plugin_names = [os.path.basename(p) for p in plugin_names]
+    (files, cutscenes) = build_file_list(game_directory, plugin_names)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        archive_entrypoints = executor.map(
+            read_entrypoints,
+            [path for (order, filename, path_dir, path, mono_header) in files],
+            [mono_header for (order, filename, path_dir, path, mono_header) in files],
+        )
+        entrypoint_map = {}
+        for entrypoints in archive_entrypoints:
+            merge_entrypoints(entrypoint_map, entrypoints)
+    return entrypoint_map
+
+def read_entrypoints(path, mono_header):
+    if not mono_header.entry_tag_count:
+        return {}
+    entrypoints_end = (
+        mono_header.entry_tag_list_start
+        + mono_header.entry_tag_count * myth_headers.ENTRY_TAG_HEADER_SIZE
+    )
+    return mono2tag.get_entrypoints(load_archive_head(path, entrypoints_end), mono_header)
+
+def load_archive_head(path, length):
+    """The first bytes of an archive, packed by monopack.py or not"""
+    data = utils.load_file(path, length)
+    if monopack.is_packed(data):
+        with monopack.PackedArchive(path) as packed:
+            return packed[:length]
+    return data
+
+def load_archive_data(path, tag_types=None):
+    """
+    The data_map entry of an archive. Packed archives and archives loaded
+    for some tag types are read as tags are fetched
+    """
+    if monopack.is_packed(utils.load_file(path, len(monopack.MAGIC))):
+        return monopack.PackedArchive(path)
+    if tag_types:
+        return ArchiveData(path)
+    return utils.load_file(path)
+
+def merge_entrypoints(entrypoint_map, entrypoints):
+    """Later archives replace an entrypoint's names and add to its archive list"""
+    for entry_id, (entry_name, entry_long_name, archive_list) in entrypoints.items():
+        current_archive_list = []
+        if entry_id in entrypoint_map:
+            current_archive_list = entrypoint_map[entry_id][2]
+
+        entrypoint_map[entry_id] = (entry_name, entry_long_name, current_archive_list + archive_list)
+
 def build_file_list(game_directory, plugin_names):
     files = []
-    cutscenes = {}
 
     for tag_dir in ['tags', 'plugins']:
         tags_dir = pathlib.Path(game_directory, tag_dir)
         if tags_dir.exists():
             files += read_file_headers(tags_dir, plugin_names)
 
+    return (sorted(set(files)), find_cutscenes(game_directory))
+
+def find_cutscenes(game_directory):
+    cutscenes = {}
     cutscene_dir = pathlib.Path(game_directory, 'cutscenes')
     if cutscene_dir.exists():
         for cutscene in os.scandir(cutscene_dir):
             if cutscene.is_file() and not cutscene.name.startswith('.'):
                 cutscenes[cutscene.name] = cutscene
-
-    return (sorted(set(files)), cutscenes)
+    return cutscenes
 
 def locate_tag_data(tags, data_map, tag_type, tag_id, location):
     tag_locations = tags[tag_type].get(tag_id)
@@ -127,6 +310,7 @@ def locate_tag_data(tags, data_map, tag_type, tag_id, location):
                 )
     return (None, None)
 
+@tracing.traced()
 def get_tag_data(tags, data_map, tag_type, tag_id):
     (location, tag_header) = lookup_tag_header(tags, tag_type, tag_id)
     if tag_header:
@@ -134,13 +318,14 @@ def get_tag_data(tags, data_map, tag_type, tag_id):
         tag_end = tag_start + tag_header.tag_data_size
         return myth_headers.encode_header(tag_header) + data_map[location][tag_start:tag_end]
 
+@tracing.traced()
 def get_tag_info(tags, data_map, tag_type, tag_id):
     (location, tag_header) = lookup_tag_header(tags, tag_type, tag_id)
     (tag_header, tag_data) = locate_tag_data(tags, data_map, tag_type, tag_id, location)
     return (location, tag_header, tag_data)
 
-def build_tag_map(files):
-    tags = {}
+def build_tag_map(files, tag_types=None):
+    tags = TagMap()
     data_map = {}
     entrypoint_map = {}
     game_version = None
@@ -151,35 +336,43 @@ def build_tag_map(files):
         if not game_version:
             game_version = mono_header.game_version
 
-        data = utils.load_file(path)
+        archive_start = tracing.now()
+        data = load_archive_data(path, tag_types)
         data_map[mono_header.filename] = data
 
         if mono_header.entry_tag_count:
-            entrypoints = mono2tag.get_entrypoints(data, mono_header)
-            for entry_id, (entry_name, entry_long_name, archive_list) in entrypoints.items():
-                current_archive_list = []
-                if entry_id in entrypoint_map:
-                    current_archive_list = entrypoint_map[entry_id][2]
-
-                entrypoint_map[entry_id] = (entry_name, entry_long_name, current_archive_list + archive_list)
-
-        append_tags_from_archive(tags, data, mono_header, filename)
+            merge_entrypoints(entrypoint_map, mono2tag.get_entrypoints(data, mono_header))
+
+        if tag_types:
+            tag_list_end = mono_header.tag_list_start + mono_header.tag_list_size
+            append_tag_headers(tags, myth_headers.decode_tag_list_types(
+                mono_header.game_version,
+                mono_header.tag_count,
+                data[mono_header.tag_list_start:tag_list_end],
+                tag_types
+            ), filename)
+        else:
+            append_tags_from_archive(tags, data, mono_header, filename)
+        tracing.record('loadtags.archive', archive_start, archive=mono_header.filename, tags=mono_header.tag_count)
 
     return (game_version, tags, entrypoint_map, data_map)
 
 def append_tags_from_archive(tags, data, mono_header, name):
-    for tag_header in myth_headers.get_mono_tags(data, mono_header):
-        tag_type_tags = tags.get(tag_header.tag_type, {})
+    append_tag_headers(tags, myth_headers.get_mono_tags(data, mono_header), name)
 
-        if tag_header.tag_id in tag_type_tags:
-            tag_id_list = tag_type_tags[tag_header.tag_id]
-        else:
-            tag_id_list = []
+def append_tag_headers(tags, tag_headers, name):
+    for tag_header in tag_headers:
+        tag_type = codec.TagKey(tag_header.tag_type.value)
+        tag_id = codec.TagKey(tag_header.tag_id.value)
+        tag_type_tags = tags.get(tag_type)
+        if tag_type_tags is None:
+            tag_type_tags = tags[tag_type] = TagMap()
 
-        tag_id_list.append((name, tag_header))
+        tag_id_list = tag_type_tags.get(tag_id)
+        if tag_id_list is None:
+            tag_id_list = tag_type_tags[tag_id] = []
 
-        tag_type_tags[tag_header.tag_id] = tag_id_list
-        tags[tag_header.tag_type] = tag_type_tags
+        tag_id_list.append((name, tag_header))
 
 def debug_include(mono_header, include, order):
     if DEBUG:
@@ -232,8 +425,7 @@ def plugin_version_flags(mono_header):
 
 def dep_plugin(path_dir, plugin_dep, sub_order):
     dep_path = pathlib.Path(path_dir, plugin_dep)
-    dep_header = utils.load_file(dep_path, myth_headers.SB_MONO_HEADER_SIZE)
-    dep_mono_header = myth_headers.parse_mono_header(dep_path.name, dep_header)
+    dep_mono_header = read_mono_header(dep_path)
     return (0, sub_order, dep_path, dep_mono_header)
 
 def append_dep_plugin(plugins, path_dir, plugin_dep, sub_order):
@@ -241,62 +433,96 @@ def append_dep_plugin(plugins, path_dir, plugin_dep, sub_order):
     sub_order += 1
     return sub_order
 
+# Parsed mono headers by (path, size, mtime), shared by directory scans
+# and dependency lookups, and across loads in long running processes
+MONO_HEADER_CACHE = {}
+
+def read_mono_header(path):
+    """Mono header of an archive, parsed once until its size or mtime change"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        print(f"Error: File not found - {path}")
+        sys.exit(1)
+    key = (str(path), stat.st_size, stat.st_mtime_ns)
+    mono_header = MONO_HEADER_CACHE.get(key)
+    if not mono_header:
+        header_data = load_archive_head(path, myth_headers.SB_MONO_HEADER_SIZE)
+        mono_header = myth_headers.parse_mono_header(pathlib.Path(path).name, header_data)
+        MONO_HEADER_CACHE[key] = mono_header
+    return mono_header
+
+def scan_mono_header(path):
+    """(mono_header, None) or (None, error) so one bad file doesn't stop a scan"""
+    try:
+        return (read_mono_header(path), None)
+    except (struct.error, UnicodeDecodeError, ValueError) as e:
+        return (None, e)
+
+@tracing.traced()
 def read_file_headers(path_dir, plugin_names):
-    # Build an initial plugin list
-    plugins = []
-    for dirfile in os.scandir(path_dir):
-        dirfile = pathlib.Path(dirfile)
+    candidates = [
+        pathlib.Path(dirfile) for dirfile in os.scandir(path_dir)
         if (
             dirfile.is_file()
             and not dirfile.name.startswith('.')
             and not dirfile.name == 'scrap.gor'
             and not dirfile.name == 'plugin cache'
-        ):
-            header_data = utils.load_file(dirfile, myth_headers.SB_MONO_HEADER_SIZE)
-            try:
-                mono_header = myth_headers.parse_mono_header(dirfile.name, header_data)
-                if mono_header.game_version == 1:
-                    priority = -1
-                else:
-                    priority = archive_priority(mono_header)
-                if (
-                    # Include foundation, patches
-                    priority < -1 or
-                    # Include patch template addons, not sure if this will always hold true
-                    # but we want to exclude large detail addons by default which all seem to
-                    # have version=101
-                    (priority == -1 and mono_header.version < 100)
-                ):
-                    plugins.append((priority, mono_header.version, dirfile, mono_header))
-                elif len(plugin_names) and dirfile.name == plugin_names[-1]:
-                    # Hack for now, treat last plugin passed in as the mesh/entrypoint plugin
-                    plugins.append((priority, 0, dirfile, mono_header))
-
-                    # Deal with other named plugins and dependencies, maintaining this sub order
-                    sub_order = 0
-                    plugin_dep = plugin_dependency(mono_header)
-                    plugin_flag = plugin_version_flags(mono_header)
-
-                    # 1. Mesh defined dependencies
-                    # TODO handle mesh tag defined dependencies (not widely used)
-
-                    # 2. Plugin defined dependencies
-                    if plugin_dep:
-                        sub_order = append_dep_plugin(plugins, path_dir, plugin_dep, sub_order)
-
-                    # 3. vTFL Unity
-                    # TODO handle mesh tag enforced vtfl
-                    if FORCE_VTFL or (IS_VTFL and plugin_flag and PluginFlag.VTFL in plugin_flag):
-                        sub_order = append_dep_plugin(plugins, path_dir, unity(dirfile.name), sub_order)
-
-                    # 4. Manual tagsets (other named plugins in order)
-                    if len(plugin_names) > 1:
-                        for plugin_name in plugin_names[:-1]:
-                            sub_order = append_dep_plugin(plugins, path_dir, plugin_name, sub_order)
-                else:
-                    debug_include(mono_header, False, (archive_priority(mono_header),0))
-            except (struct.error, UnicodeDecodeError, ValueError) as e:
-                print(f"- [ERROR] \x1b[1m{dirfile.name}\x1b[0m error decoding {e}")
+        )
+    ]
+    # Small reads that are mostly latency, so read them all at once.
+    # Results keep directory order, and the plan built from them with it
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        scanned = list(executor.map(scan_mono_header, candidates))
+
+    # Build an initial plugin list
+    plugins = []
+    for (dirfile, (mono_header, scan_error)) in zip(candidates, scanned):
+        try:
+            if scan_error:
+                raise scan_error
+            if mono_header.game_version == 1:
+                priority = -1
+            else:
+                priority = archive_priority(mono_header)
+            if (
+                # Include foundation, patches
+                priority < -1 or
+                # Include patch template addons, not sure if this will always hold true
+                # but we want to exclude large detail addons by default which all seem to
+                # have version=101
+                (priority == -1 and mono_header.version < 100)
+            ):
+                plugins.append((priority, mono_header.version, dirfile, mono_header))
+            elif len(plugin_names) and dirfile.name == plugin_names[-1]:
+                # Hack for now, treat last plugin passed in as the mesh/entrypoint plugin
+                plugins.append((priority, 0, dirfile, mono_header))
+
+                # Deal with other named plugins and dependencies, maintaining this sub order
+                sub_order = 0
+                plugin_dep = plugin_dependency(mono_header)
+                plugin_flag = plugin_version_flags(mono_header)
+
+                # 1. Mesh defined dependencies
+                # TODO handle mesh tag defined dependencies (not widely used)
+
+                # 2. Plugin defined dependencies
+                if plugin_dep:
+                    sub_order = append_dep_plugin(plugins, path_dir, plugin_dep, sub_order)
+
+                # 3. vTFL Unity
+                # TODO handle mesh tag enforced vtfl
+                if FORCE_VTFL or (IS_VTFL and plugin_flag and PluginFlag.VTFL in plugin_flag):
+                    sub_order = append_dep_plugin(plugins, path_dir, unity(dirfile.name), sub_order)
+
+                # 4. Manual tagsets (other named plugins in order)
+                if len(plugin_names) > 1:
+                    for plugin_name in plugin_names[:-1]:
+                        sub_order = append_dep_plugin(plugins, path_dir, plugin_name, sub_order)
+            else:
+                debug_include(mono_header, False, (archive_priority(mono_header),0))
+        except (struct.error, UnicodeDecodeError, ValueError) as e:
+            print(f"- [ERROR] \x1b[1m{dirfile.name}\x1b[0m error decoding {e}")
     
     # BROKEN logic for COMPATIBILITY
     load_order_enforced = False
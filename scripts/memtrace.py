@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+import ast
+import atexit
+import functools
+import json
+import linecache
+import os
+import pathlib
+import platform
+import sys
+import time
+import tokenize
+import tracemalloc
+from collections import OrderedDict
+
+# MEMTRACE=1 writes to the benchmarks output dir, MEMTRACE=<path> writes to that path
+MEMTRACE = os.environ.get('MEMTRACE')
+ENABLED = bool(MEMTRACE) and MEMTRACE != '0'
+
+RESULTS_VERSION = 1
+OUTPUT_DIR = '../output/benchmarks'
+TOP_ALLOCATORS = 10
+TRACE_FRAMES = 1
+
+PHASES = []
+GAUGES = OrderedDict()
+STACK = []
+
+def main(results_path):
+    """
+    Print the per phase memory summary of a MEMTRACE results file
+    """
+    with open(results_path, 'r') as results_file:
+        results = json.load(results_file)
+    print_summary(results, file=sys.stdout)
+
+class Phase:
+    __slots__ = ('name', 'args', 'start', 'snapshot', 'snapshot_bytes', 'traced_start', 'traced_peak', 'peak_rss')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end(self)
+        return False
+
+class NullPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_PHASE = NullPhase()
+
+def begin(name, /, **args):
+    """
+    Start a phase: snapshot the traced allocations and reset the peaks.
+    Returns the phase to pass to end(), or use it as a context manager.
+    Does nothing unless MEMTRACE is set
+    """
+    if not ENABLED:
+        return NULL_PHASE
+    phase = Phase()
+    phase.name = name
+    phase.args = args
+    # Resetting the peaks below would lose them for any enclosing phases
+    fold_peaks()
+    (before_snapshot, _) = tracemalloc.get_traced_memory()
+    phase.snapshot = take_snapshot()
+    (phase.traced_start, _) = tracemalloc.get_traced_memory()
+    phase.snapshot_bytes = phase.traced_start - before_snapshot
+    phase.traced_peak = 0
+    phase.peak_rss = None
+    tracemalloc.reset_peak()
+    reset_peak_rss()
+    phase.start = time.perf_counter()
+    STACK.append(phase)
+    return phase
+
+def end(phase):
+    """Finish a phase and record its peak memory and top allocators"""
+    if not ENABLED or phase is NULL_PHASE:
+        return
+    duration = time.perf_counter() - phase.start
+    fold_peaks()
+    (traced, _) = tracemalloc.get_traced_memory()
+    (rss, _) = read_rss()
+    snapshot = take_snapshot()
+    STACK.remove(phase)
+
+    PHASES.append({
+        'name': phase.name,
+        'args': {k: str(v) for k, v in phase.args.items()},
+        'depth': len(STACK),
+        'duration_s': round(duration, 6),
+        'peak_bytes': phase.traced_peak - phase.traced_start,
+        'allocated_bytes': traced - phase.traced_start,
+        'rss_bytes': rss,
+        'peak_rss_bytes': phase.peak_rss,
+        'gauges': {name: gauge() for name, gauge in GAUGES.items()},
+        'top': top_allocators(snapshot.compare_to(phase.snapshot, 'lineno')),
+    })
+    # Peaks were folded before the snapshot, so this only drops the
+    # snapshot's own memory from the enclosing phases
+    phase.snapshot = None
+    tracemalloc.reset_peak()
+
+def fold_peaks():
+    """
+    Carry the current peaks into every open phase, less the snapshots
+    held by the phases nested inside it
+    """
+    (_, traced_peak) = tracemalloc.get_traced_memory()
+    (_, peak_rss) = read_rss()
+    for i, open_phase in enumerate(STACK):
+        nested_snapshots = sum(p.snapshot_bytes for p in STACK[i + 1:])
+        open_phase.traced_peak = max(open_phase.traced_peak, traced_peak - nested_snapshots)
+        if peak_rss is not None:
+            open_phase.peak_rss = max(open_phase.peak_rss or 0, peak_rss)
+
+def phase(name, /, **args):
+    """Context manager form of begin() and end()"""
+    return begin(name, **args)
+
+def traced(name=None):
+    """
+    Decorator making every call a phase. Functions are returned untouched
+    unless MEMTRACE is set
+    """
+    def decorator(fun):
+        if not ENABLED:
+            return fun
+        phase_name = name or f'{pathlib.Path(fun.__code__.co_filename).stem}.{fun.__qualname__}'
+
+        @functools.wraps(fun)
+        def wrapper(*args, **kwargs):
+            with begin(phase_name):
+                return fun(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def gauge(name, fun):
+    """
+    Record fun() at the end of every phase, e.g. the size of a cache
+    """
+    if ENABLED:
+        GAUGES[name] = fun
+
+def take_snapshot():
+    # Leave out memtrace itself, including its source lookups for function names
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, module.__file__)
+        for module in [tracemalloc, ast, linecache, tokenize, sys.modules[__name__]]
+    ])
+
+def reset_peak_rss():
+    """Linux can reset the peak RSS (VmHWM), elsewhere it's the peak so far"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+def read_rss():
+    """(rss, peak_rss) in bytes, or None where unavailable"""
+    rss = None
+    peak_rss = None
+    try:
+        with open('/proc/self/status', 'r') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith('VmHWM:'):
+                    peak_rss = int(line.split()[1]) * 1024
+    except OSError:
+        try:
+            import resource
+            peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # bytes on macOS, kilobytes elsewhere
+            if sys.platform != 'darwin':
+                peak_rss *= 1024
+        except ImportError:
+            pass
+    return (rss, peak_rss)
+
+FUNCTION_LINES = {}
+
+def function_name(filename, lineno):
+    """Innermost function or class containing a line, from the source"""
+    if filename not in FUNCTION_LINES:
+        ranges = []
+        try:
+            tree = ast.parse(''.join(linecache.getlines(filename)))
+            for node in ast.walk(tree):
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                    ranges.append((node.lineno, node.end_lineno, node.name))
+        except (SyntaxError, ValueError):
+            pass
+        FUNCTION_LINES[filename] = ranges
+    best = None
+    for (start, end, name) in FUNCTION_LINES[filename]:
+        if start <= lineno <= end and (not best or start >= best[0]):
+            best = (start, end, name)
+    return best[2] if best else '<module>'
+
+def top_allocators(stats, limit=TOP_ALLOCATORS):
+    """
+    Group allocations (or differences between snapshots) by module and
+    function, largest first
+    """
+    grouped = {}
+    for stat in stats:
+        stat_size = getattr(stat, 'size_diff', stat.size)
+        stat_count = getattr(stat, 'count_diff', stat.count)
+        if not stat_size:
+            continue
+        frame = stat.traceback[0]
+        path = pathlib.Path(frame.filename)
+        module = path.parent.name if path.stem == '__init__' else path.stem
+        key = (module, function_name(frame.filename, frame.lineno))
+        (size, count, lines) = grouped.get(key, (0, 0, {}))
+        lines[frame.lineno] = lines.get(frame.lineno, 0) + stat_size
+        grouped[key] = (size + stat_size, count + stat_count, lines)
+
+    top = sorted(grouped.items(), key=lambda g: -g[1][0])[:limit]
+    return [
+        {
+            'module': module,
+            'function': function,
+            'size_bytes': size,
+            'count': count,
+            'line': max(lines.items(), key=lambda line_size: line_size[1])[0],
+        }
+        for ((module, function), (size, count, lines)) in top
+    ]
+
+def summarise(phases):
+    """Totals per phase name, in the same shape as the benchmark results"""
+    results = OrderedDict()
+    for p in phases:
+        result = results.get(p['name'])
+        if not result:
+            result = results[p['name']] = {
+                'runs': 0,
+                'total_s': 0,
+                'peak_bytes': 0,
+                'allocated_bytes': 0,
+                'peak_rss_bytes': None,
+            }
+        result['runs'] += 1
+        result['total_s'] = round(result['total_s'] + p['duration_s'], 6)
+        result['peak_bytes'] = max(result['peak_bytes'], p['peak_bytes'])
+        result['allocated_bytes'] += p['allocated_bytes']
+        if p['peak_rss_bytes'] is not None:
+            result['peak_rss_bytes'] = max(result['peak_rss_bytes'] or 0, p['peak_rss_bytes'])
+    return results
+
+def results_path():
+    if MEMTRACE != '1':
+        return pathlib.Path(MEMTRACE)
+    script = pathlib.Path(sys.argv[0]).stem or 'python'
+    timestamp = time.strftime('%Y%m%d-%H%M%S')
+    return pathlib.Path(sys.path[0], OUTPUT_DIR, f'memory-{script}-{timestamp}.json').resolve()
+
+def write_results(path):
+    snapshot = take_snapshot()
+    results = {
+        'version': RESULTS_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'command': sys.argv,
+        'results': summarise(PHASES),
+        'phases': PHASES,
+        # Everything still allocated at exit
+        'retained': top_allocators(snapshot.statistics('lineno')),
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+        results_file.write('\n')
+    return results
+
+def kib(value):
+    return f'{value / 1024:.1f}' if value is not None else '-'
+
+def print_summary(results, file=sys.stderr):
+    print(
+        f'{"phase":<40} {"runs":>6} {"total s":>10} {"peak KiB":>12} '
+        f'{"alloc KiB":>12} {"peak RSS KiB":>14}',
+        file=file
+    )
+    for name, result in results['results'].items():
+        print(
+            f'{name:<40} {result["runs"]:>6} {result["total_s"]:>10.3f} '
+            f'{kib(result["peak_bytes"]):>12} {kib(result["allocated_bytes"]):>12} '
+            f'{kib(result["peak_rss_bytes"]):>14}',
+            file=file
+        )
+    print('Retained at exit:', file=file)
+    for alloc in results['retained']:
+        print(
+            f'{kib(alloc["size_bytes"]):>12} KiB {alloc["count"]:>8} blocks '
+            f'{alloc["module"]}.{alloc["function"]}:{alloc["line"]}',
+            file=file
+        )
+
+def finish():
+    if not PHASES:
+        return
+    path = results_path()
+    results = write_results(path)
+    print_summary(results)
+    print(f'Memory results saved to {path}', file=sys.stderr)
+
+if ENABLED:
+    tracemalloc.start(TRACE_FRAMES)
+    atexit.register(finish)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python3 {sys.argv[0]} <results_file>")
+        sys.exit(1)
+
+    results_file = sys.argv[1]
+
+    try:
+        main(results_file)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except BrokenPipeError:
+        sys.stdout = None
+        sys.exit(1)
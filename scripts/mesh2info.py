@@ -14,14 +14,15 @@ def main(game_directory, level, plugin_names):
     """
     Load Myth game tags and plugins and output header info for a mesh
     """
+    if not level:
+        mono2tag.print_entrypoint_map(loadtags.load_entrypoints(game_directory, plugin_names))
+        return
+
     (game_version, tags, entrypoint_map, data_map, cutscenes) = loadtags.load_tags(game_directory, plugin_names)
 
     try:
-        if level:
-            for mesh_id in mesh_entries(game_version, level, entrypoint_map, tags, plugin_names):
-                parse_mesh_tag(game_version, tags, data_map, mesh_id)
-        else:
-            mono2tag.print_entrypoint_map(entrypoint_map)
+        for mesh_id in mesh_entries(game_version, level, entrypoint_map, tags, plugin_names):
+            parse_mesh_tag(game_version, tags, data_map, mesh_id)
     except (struct.error, UnicodeDecodeError) as e:
         raise ValueError(f"Error processing binary data: {e}")
 
@@ -54,7 +55,7 @@ def parse_level(level, tags):
         for mesh_id, tag_headers in tags['mesh'].items():
             latest = tag_headers[-1]
             if latest[1].name.startswith(f'{level} '):
-                ret = (mesh_id, latest[0], latest[1].name)
+                ret = (str(mesh_id), latest[0], latest[1].name)
     if ret:
         return ret
     else:
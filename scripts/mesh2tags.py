@@ -4,7 +4,6 @@ import os
 import pathlib
 import struct
 
-import codec
 import tag2local
 import mesh2info
 import mono2tag
@@ -37,7 +36,7 @@ def extract_mesh_tags(mesh_id, tags, data_map, plugin_names):
     )
     tdg = tag2local.TagDataGenerator(tags, data_map, plugin_names)
     all_tag_data = []
-    for td in tdg.get_tag_data('mesh', codec.encode_string(mesh_id)):
+    for td in tdg.get_tag_data('mesh', mesh_id):
         all_tag_data.append(td)
 
     output_dir = f'../output/mesh2tags/{mesh_tag_header.name}/local'
@@ -3,7 +3,6 @@ import os
 import pathlib
 import struct
 import sys
-import time
 
 import codec
 import myth_headers
@@ -11,23 +10,22 @@ import mesh_tag
 import mono2tag
 import mesh2info
 import loadtags
+import tracing
 import utils
 
 DEBUG = (os.environ.get('DEBUG') == '1')
-TIME = (os.environ.get('TIME') == '1')
 
 def load_file(path):
-    t = time.perf_counter()
-    data = utils.load_file(path)
-    TIME and print(path, f'{(time.perf_counter() - t):.3f}')
-
-    return data
+    with tracing.span('load_file', path=str(path)):
+        return utils.load_file(path)
 
 def main(game_directory, level, plugin_name, plugin_output):
     """
     Load Myth game tags and plugins and output basic text and html for the intro to a mesh
     """
-    (game_version, tags, entrypoint_map, data_map, cutscenes) = loadtags.load_tags(game_directory, [plugin_name])
+    (game_version, tags, entrypoint_map, data_map, cutscenes) = loadtags.load_tags(
+        game_directory, [plugin_name] if plugin_name else [], tag_types=['mesh', 'text', 'stli']
+    )
 
     try:
         if level:
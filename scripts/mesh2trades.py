@@ -27,29 +27,30 @@ def main(game_directory, level, plugin_names):
     """
     Load Myth game tags and plugins and output markers for a mesh
     """
+    if not level or level == 'list':
+        mono2tag.print_entrypoint_map(loadtags.load_entrypoints(game_directory, plugin_names))
+        mesh_input = input('Choose a mesh id: ')
+        main(game_directory, f'mesh={mesh_input}', plugin_names)
+        return
+
     (game_version, tags, entrypoint_map, data_map, cutscenes) = loadtags.load_tags(game_directory, plugin_names)
 
     counts = []
     if COUNTS:
         counts = [int(c) for c in COUNTS.split(',')]
     try:
-        if level and level != 'list':
-            for mesh_id in mesh2info.mesh_entries(game_version, level, entrypoint_map, tags, plugin_names):
-                ret = parse_mesh_trades(
-                    game_version, tags, data_map, mesh_id,
-                    DIFFICULTY, GAME_TYPE, TIME, counts
-                )
-
-                if ret:
-                    (trade_info, units, game_type) = ret
-                    (diffs, trade) = trade_info
-
-                    if not NO_TRADING:
-                        input_loop(game_type, units, diffs)
-        else:
-            mono2tag.print_entrypoint_map(entrypoint_map)
-            mesh_input = input('Choose a mesh id: ')
-            main(game_directory, f'mesh={mesh_input}', plugin_names)
+        for mesh_id in mesh2info.mesh_entries(game_version, level, entrypoint_map, tags, plugin_names):
+            ret = parse_mesh_trades(
+                game_version, tags, data_map, mesh_id,
+                DIFFICULTY, GAME_TYPE, TIME, counts
+            )
+
+            if ret:
+                (trade_info, units, game_type) = ret
+                (diffs, trade) = trade_info
+
+                if not NO_TRADING:
+                    input_loop(game_type, units, diffs)
     except (struct.error, UnicodeDecodeError) as e:
         raise ValueError(f"Error processing binary data: {e}")
 
@@ -8,7 +8,6 @@ from string import Template
 import struct
 import subprocess
 import sys
-import time
 
 import codec
 import myth_headers
@@ -19,55 +18,86 @@ import tag2png
 import mono2tag
 import mesh2info
 import loadtags
+import memtrace
+import tracing
 import utils
 
+workerpool = utils.lazy_import('workerpool')
+
 DEBUG = (os.environ.get('DEBUG') == '1')
-TIME = (os.environ.get('TIME') == '1')
 
 def load_file(path):
-    t = time.perf_counter()
-    data = utils.load_file(path)
-    TIME and print(path, f'{(time.perf_counter() - t):.3f}')
-
-    return data
+    with tracing.span('load_file', path=str(path)):
+        return utils.load_file(path)
 
 def main(game_directory, level, plugin_name, plugin_output):
     """
     Load Myth game tags and plugins and output a web page for the intro to a mesh
     """
-    (game_version, tags, entrypoint_map, data_map, cutscene_paths) = loadtags.load_tags(game_directory, [plugin_name])
+    plugin_names = [plugin_name] if plugin_name else []
+    if not level:
+        mono2tag.print_entrypoint_map(loadtags.load_entrypoints(game_directory, plugin_names))
+        return
+
+    with memtrace.phase('loadtags.load_tags'):
+        if level == 'all':
+            # Kept in this process for the worker pool to share
+            loaded = loadtags.keep_resident(game_directory, plugin_names)
+        else:
+            loaded = loadtags.load_tags(game_directory, plugin_names)
+        (game_version, tags, entrypoint_map, data_map, cutscene_paths) = loaded
+    memtrace.gauge('data_map', lambda: sum(len(data) for data in data_map.values()))
+    memtrace.gauge('codec._CODEC_CACHE', lambda: len(codec._CODEC_CACHE))
 
     try:
-        if level:
-            if game_version == 2 and level == 'all':
-                for mesh_id, (entry_name, entry_long_name, archive_list) in entrypoint_map.items():
-                    if not plugin_name or plugin_name in archive_list:
-                        if DEBUG:
-                            print(f'mesh={mesh_id} file=[{archive_list}] [{entry_name}] [{entry_long_name}]')
-                        plugin = plugin_name if plugin_name in archive_list else None
-                        extract_level(game_version, tags, data_map, cutscene_paths, mesh_id, plugin, plugin_output)
-                if not plugin_name:
-                    extract_sb_epilogue(tags, data_map, cutscene_paths)
-            elif game_version == 1 and level == 'all':
-                for level in range(1, 26):
-                    (mesh_id, header_name, entry_name) = mesh2info.parse_level(f'{level:02}', tags)
+        if game_version == 2 and level == 'all':
+            levels = []
+            for mesh_id, (entry_name, entry_long_name, archive_list) in entrypoint_map.items():
+                if not plugin_name or plugin_name in archive_list:
                     if DEBUG:
-                        print(f'level={level} mesh={mesh_id} file=[{header_name}] [{entry_name}]')
-                    plugin = None
-                    extract_level(game_version, tags, data_map, cutscene_paths, mesh_id, plugin, plugin_output)
-            elif game_version == 2 and not plugin_name and level == 'epilogue':
+                        print(f'mesh={mesh_id} file=[{archive_list}] [{entry_name}] [{entry_long_name}]')
+                    plugin = plugin_name if plugin_name in archive_list else None
+                    levels.append((mesh_id, plugin))
+            extract_levels(game_directory, plugin_names, levels, plugin_output)
+            if not plugin_name:
                 extract_sb_epilogue(tags, data_map, cutscene_paths)
-            else:
-                (mesh_id, header_name, entry_name) = mesh2info.parse_level(level, tags)
+        elif game_version == 1 and level == 'all':
+            levels = []
+            for level in range(1, 26):
+                (mesh_id, header_name, entry_name) = mesh2info.parse_level(f'{level:02}', tags)
                 if DEBUG:
                     print(f'level={level} mesh={mesh_id} file=[{header_name}] [{entry_name}]')
-                plugin = plugin_name if plugin_name == header_name else None
-                extract_level(game_version, tags, data_map, cutscene_paths, mesh_id, plugin, plugin_output)
+                plugin = None
+                levels.append((mesh_id, plugin))
+            extract_levels(game_directory, plugin_names, levels, plugin_output)
+        elif game_version == 2 and not plugin_name and level == 'epilogue':
+            extract_sb_epilogue(tags, data_map, cutscene_paths)
         else:
-            mono2tag.print_entrypoint_map(entrypoint_map)
+            (mesh_id, header_name, entry_name) = mesh2info.parse_level(level, tags)
+            if DEBUG:
+                print(f'level={level} mesh={mesh_id} file=[{header_name}] [{entry_name}]')
+            plugin = plugin_name if plugin_name == header_name else None
+            extract_level(game_version, tags, data_map, cutscene_paths, mesh_id, plugin, plugin_output)
     except (struct.error, UnicodeDecodeError) as e:
         raise ValueError(f"Error processing binary data: {e}")
 
+def extract_levels(game_directory, plugin_names, levels, plugin_output):
+    """
+    extract_level for each (mesh_id, plugin), spread over worker processes
+    forked after the tags were loaded. Workers can't prompt, so this asks
+    once for every level
+    """
+    if not prompt(archive_path()):
+        return
+    with workerpool.WorkerPool(game_directory, [plugin_names], warm_types=['mesh']) as pool:
+        futures = [
+            pool.submit('mesh', game_directory, plugin_names, mesh_id, plugin, plugin_output, True)
+            for (mesh_id, plugin) in levels
+        ]
+        for future in futures:
+            future.result()
+
+@memtrace.traced()
 def extract_sb_epilogue(tags, data_map, cutscene_paths):
     prefix = 'myth2'
     game_version = 2
@@ -116,7 +146,8 @@ def cutscenes2paths(cutscenes, cutscene_paths):
         paths.append(cutscene_path)
     return paths
 
-def extract_level(game_version, tags, data_map, cutscene_paths, mesh_id, plugin, plugin_output):
+@memtrace.traced()
+def extract_level(game_version, tags, data_map, cutscene_paths, mesh_id, plugin, plugin_output, confirmed=False):
     mesh_tag_data = loadtags.get_tag_data(tags, data_map, 'mesh', mesh_id)
     tag_header = myth_headers.parse_header(mesh_tag_data)
     level = tag_header.name.split(' ')[0]
@@ -149,9 +180,9 @@ def extract_level(game_version, tags, data_map, cutscene_paths, mesh_id, plugin,
     cutscenes = cutscenes2paths((None, codec.decode_string(cutscene_tag_pregame)), cutscene_paths)
 
     next_level = None
-    next_entry_data = loadtags.get_tag_data(tags, data_map, 'mesh', codec.decode_string(mesh_header.next_mesh_alternate))
+    next_entry_data = loadtags.get_tag_data(tags, data_map, 'mesh', mesh_header.next_mesh_alternate)
     if not next_entry_data or not mesh_tag.has_single_player_story(game_version, next_entry_data):
-        next_entry_data = loadtags.get_tag_data(tags, data_map, 'mesh', codec.decode_string(mesh_header.next_mesh))
+        next_entry_data = loadtags.get_tag_data(tags, data_map, 'mesh', mesh_header.next_mesh)
     if next_entry_data and mesh_tag.has_single_player_story(game_version, next_entry_data):
         next_header = myth_headers.parse_header(next_entry_data)
         next_level = next_header.name.split(' ')[0]
@@ -160,31 +191,31 @@ def extract_level(game_version, tags, data_map, cutscene_paths, mesh_id, plugin,
 
     # Extract narration text
     storyline_data = loadtags.get_tag_data(
-        tags, data_map, 'text', codec.decode_string(mesh_header.pregame_storyline_tag)
+        tags, data_map, 'text', mesh_header.pregame_storyline_tag
     )
 
     # Extract sound data
     sound_data = loadtags.get_tag_data(
-        tags, data_map, 'soun', codec.decode_string(mesh_header.narration_sound_tag)
+        tags, data_map, 'soun', mesh_header.narration_sound_tag
     )
     initial_delay = 5000
     scroll_rate = 10
 
     # Extract level name
     desc_data = loadtags.get_tag_data(
-        tags, data_map, 'stli', codec.decode_string(mesh_header.map_description_string_list_tag)
+        tags, data_map, 'stli', mesh_header.map_description_string_list_tag
     )
     (_, desc_text) = myth_headers.parse_text_tag(desc_data)
     level_name = codec.decode_string(desc_text.split(b'\r')[0])
 
     # Extract pregame captions
     caption_data = loadtags.get_tag_data(
-        tags, data_map, 'stli', codec.decode_string(mesh_header.picture_caption_string_list_tag)
+        tags, data_map, 'stli', mesh_header.picture_caption_string_list_tag
     )
     
     # Extract pregame art
     pregame_data = loadtags.get_tag_data(
-        tags, data_map, '.256', codec.decode_string(mesh_header.pregame_collection_tag)
+        tags, data_map, '.256', mesh_header.pregame_collection_tag
     )
     pregame_list = []
     map_dict = {}
@@ -194,7 +225,7 @@ def extract_level(game_version, tags, data_map, cutscene_paths, mesh_id, plugin,
 
     # Extract postgame art
     postgame_data = loadtags.get_tag_data(
-        tags, data_map, '.256', codec.decode_string(mesh_header.postgame_collection_tag)
+        tags, data_map, '.256', mesh_header.postgame_collection_tag
     )
     postgame_dict = {}
     if postgame_data:
@@ -209,15 +240,18 @@ def extract_level(game_version, tags, data_map, cutscene_paths, mesh_id, plugin,
         storyline_data, sound_data, colors, caption_data, pregame_list, art_dicts,
         bg_initial_path, bg_narration_path,
         prefix, version_class, level, level_name, next_level,
-        initial_delay, scroll_rate, cutscenes
+        initial_delay, scroll_rate, cutscenes, confirmed
     )
 
+def archive_path():
+    return pathlib.Path(sys.path[0], '../output/archive/').resolve()
+
 def output_html(
     game_version, plugin,
     storyline_data, sound_data, colors, caption_data, pregame_list, art_dicts,
     bg_initial_path, bg_narration_path,
     prefix, version_class, level, level_name, next_level,
-    initial_delay, scroll_rate, cutscenes
+    initial_delay, scroll_rate, cutscenes, confirmed=False
 ):
     # Extract text colors
     heading_color = (255,255,255,255)
@@ -243,8 +277,7 @@ def output_html(
         (_, caption_text) = myth_headers.parse_text_tag(caption_data)
         caption = codec.decode_string(caption_text.split(b'\r')[0])
 
-    output_dir = '../output/archive/'
-    root_path = pathlib.Path(sys.path[0], output_dir).resolve()
+    root_path = archive_path()
 
     static_prefix = '../../../'
 
@@ -256,7 +289,7 @@ def output_html(
     script_path = f'{static_prefix}script.js'
     output_path = root_path / f'{prefix}/level/{level}'
 
-    if prompt(output_path):
+    if confirmed or prompt(output_path):
         output_path.mkdir(parents=True, exist_ok=True)
 
         if aifc:
@@ -373,16 +406,14 @@ def output_html(
         print(f"Web page extracted. Output saved to {output_path}")
 
 def write_png(width, height, rows, output_path, png_path):
-    t = time.perf_counter()
     png = tag2png.make_png(width, height, rows)
-    TIME and print(png_path, f'{(time.perf_counter() - t):.3f}')
     with open(
         (output_path / png_path), 'wb'
     ) as png_file:
         png_file.write(png)
 
+@tracing.traced()
 def convert_mp3(aifc_path):
-    t = time.perf_counter()
     output_path = aifc_path.with_suffix('.mp3')
     subprocess.run([
         "ffmpeg", "-hide_banner", "-loglevel", "error",
@@ -390,11 +421,10 @@ def convert_mp3(aifc_path):
         "-i", aifc_path,
         output_path
     ])
-    TIME and print('convert_mp3', f'{(time.perf_counter() - t):.3f}')
     return output_path
 
+@tracing.traced()
 def convert_mp4(mov_path):
-    t = time.perf_counter()
     output_path = mov_path.with_suffix('.mp4')
     subprocess.run([
         "ffmpeg", "-hide_banner", "-loglevel", "error",
@@ -402,7 +432,6 @@ def convert_mp4(mov_path):
         "-i", mov_path,
         mov_path.with_suffix('.mp4')
     ])
-    TIME and print('convert_mp4', f'{(time.perf_counter() - t):.3f}')
     return output_path
 
 def rgba2css(rgba):
@@ -414,19 +443,17 @@ def text2html(text):
     lbr = text.decode('mac-roman').replace('\r', '<br>\n')
     return re.sub(r'[\\|]i([^|]+)[\\|]p', '<i>\\1</i>', lbr)
 
+@tracing.traced()
 def extract_epilogue_collection(data):
-    t = time.perf_counter()
     bitmaps = myth_collection.parse_sequence_bitmaps(data)
-    TIME and print('extract_epilogue_collection parse', f'{(time.perf_counter() - t):.3f}', len(data))
     background = bitmaps[0]['bitmaps'][0]
     colors = bitmaps[1]['bitmaps'][0]
 
     return (background, colors)
 
+@tracing.traced()
 def extract_pregame(data):
-    t = time.perf_counter()
     bitmaps = myth_collection.parse_sequence_bitmaps(data)
-    TIME and print('extract_pregame parse', f'{(time.perf_counter() - t):.3f}', len(data))
     maps = {
         'dark': bitmaps[0]['bitmaps'][0],
         'light': bitmaps[4]['bitmaps'][0]
@@ -438,10 +465,9 @@ def extract_pregame(data):
     z = zip(frame_durations, frames)
     return (z, maps, colors)
 
+@tracing.traced()
 def extract_postgame(data):
-    t = time.perf_counter()
     bitmaps = myth_collection.parse_sequence_bitmaps(data)
-    TIME and print('extract_postgame parse', f'{(time.perf_counter() - t):.3f}', len(data))
 
     postgame = {}
     if len(bitmaps[0]['bitmaps']):
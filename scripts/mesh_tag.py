@@ -7,6 +7,7 @@ import struct
 import codec
 import myth_headers
 import loadtags
+import tracing
 import utils
 
 DEBUG = (os.environ.get('DEBUG') == '1')
@@ -533,6 +534,7 @@ def get_game_info(mesh_header, level_name, game_type_choice, difficulty_level, g
     size = mesh_size(mesh_header)
     return f"{game_type}: {level_name} [{diff}] ({size}){game_time_mins}"
 
+@tracing.traced()
 def parse_markers(mesh_header, data):
     marker_palette_start = get_offset(mesh_header.marker_palette_offset)
     marker_palette_end = marker_palette_start + mesh_header.marker_palette_size
@@ -669,14 +671,12 @@ def encode_map_action_data(game_version, actions):
         for param in action['parameters']:
             param_data += encode_map_action_param(game_version, param)
 
-        action_type = codec.encode_string_none(action['type'])
-
         action_data += codec.encode_data(
             ActionHeadFmt,
             (
                 action_id,
                 action['expiration_mode'],
-                action_type,
+                action['type'],
                 action['flags'],
                 action['trigger_time_lower_bound'],
                 action['trigger_time_delta'],
@@ -753,6 +753,7 @@ def encode_map_actions(mesh_tag_data, actions):
     (map_action_count, map_action_data) = encode_map_action_data(myth_headers.game_version(tag_header), actions)
     return rewrite_action_data(map_action_count, map_action_data, mesh_tag_data)
 
+@tracing.traced()
 def parse_map_actions(mesh_header, data):
     tag_header = myth_headers.parse_header(data)
     game_version = myth_headers.game_version(tag_header)
@@ -3,57 +3,28 @@ import os
 import pathlib
 import sys
 
-import reco_tag
+import reco_scan
 import game_headers
-import myth_headers
 import codec
 
 DEBUG = (os.environ.get('DEBUG') == '1')
 
-def read_binary_headers(root_dir, num_bytes=64):
-    for dirpath, _, filenames in os.walk(root_dir):
-        for filename in filenames:
-            file_path = os.path.join(dirpath, filename)
-            try:
-                with open(file_path, 'rb') as f:
-                    try:
-                        header = myth_headers.parse_header(f.read(num_bytes))
-                        if header.tag_type == 'reco':
-                            yield file_path
-                    except ValueError:
-                        pass
-            except Exception as e:
-                print(f"[!] Failed to read {file_path}: {e}")
-
-
 def main(input_dir, game_directory):
     """
     Check downloaded films for missing plugins
     """
 
     input_path = pathlib.Path(input_dir)
-    
-    # Walk input_path looking for reco_files
-    reco_files = []
-    for file_match in read_binary_headers(input_path):
-        reco_files.append(file_match)
 
-    plugin_values = {}
-    for reco_file in reco_files:
-        (header, reco_data, reco, game_param, game_data, save_game) = reco_tag.parse_reco_head(
-            game_directory, reco_file, head_only=True
-        )
-
-        if DEBUG:
-            print(reco_file)
+    # Walk input_path reading film headers, one bounded read per new file
+    films = reco_scan.scan_films(input_path)
 
-        for plugin in game_param.plugin_data:
-            if plugin not in plugin_values:
-                plugin_values[plugin] = {
-                    'installed': is_installed(plugin),
-                    'films': []
-                }
-            plugin_values[plugin]['films'].append(reco_file)
+    plugin_values = {}
+    for plugin, film_paths in reco_scan.plugin_index(films).items():
+        plugin_values[plugin] = {
+            'installed': is_installed(plugin),
+            'films': film_paths,
+        }
 
     print('Missing:')
     for plugin_data, meta in plugin_values.items():
@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
+import errno
+import fnmatch
+import json
 import os
 import sys
 import struct
 import pathlib
 import re
+import threading
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import codec
 import myth_headers
@@ -12,54 +17,235 @@ import utils
 
 DEBUG = (os.environ.get('DEBUG') == '1')
 
+# Windows has no pread, reads there share the file position under a lock
+PREAD = hasattr(os, 'pread')
+# Copies file to file in the kernel. Linux sendfile takes any output
+# file, macOS only sockets
+KERNEL_COPY = hasattr(os, 'copy_file_range') or (sys.platform == 'linux' and hasattr(os, 'sendfile'))
+KERNEL_COPY_UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP}
+
+MAX_WORKERS = 16
+GLOB_CHARS = '*?['
+
 def main(mono_path, tag_type, tag_id, output_file):
     """
     Parse a Myth TFL or Myth II monolith file and export provided tag.
     If no tag provided, list all tags
     """
-    mono_path = pathlib.Path(mono_path)
-    data = utils.load_file(mono_path)
-
     try:
-        mono_header = myth_headers.parse_mono_header(mono_path.name, data)
+        with MonoArchive(mono_path) as archive:
+            debug_mono_header(archive.header, archive.size)
 
-        debug_mono_header(mono_header, data)
+            entrypoints = archive.entrypoints()
+            if len(entrypoints):
+                print_entrypoint_map(entrypoints)
 
-        entrypoints = get_entrypoints(data, mono_header)
-        if len(entrypoints):
-            print_entrypoint_map(entrypoints)
-
-        print(
-            """
+            print(
+                """
 Tags
 -----+------+------+------+-------
  idx | game | type | id   | name 
 -----+------+------+------+-------"""
-        )
-        for i, tag_header in enumerate(myth_headers.get_mono_tags(data, mono_header)):
-            if (
-                (not tag_id and not tag_type)
-                or (tag_type == tag_header.tag_type and tag_id == tag_header.tag_id)
-            ):
-                print(
-                    f' {i:03} | '
-                    f'{tag_header.signature} | '
-                    f'{tag_header.tag_type} | '
-                    f'{tag_header.tag_id} | '
-                    f'{tag_header.name}'
-                )
-                if tag_id and tag_type:
-                    export_tag(tag_header, data, output_file)
-                    return
+            )
+            if is_pattern(tag_type) or is_pattern(tag_id):
+                export_matching(archive, tag_type or '*', tag_id or '*', output_file)
+            elif tag_id and tag_type:
+                i = archive.find(tag_type, tag_id)
+                if i is not None:
+                    tag_header = archive.tags[i]
+                    print_tag_row(i, tag_header)
+                    export_tag(tag_header, archive.tag_data(tag_header), output_file)
+            else:
+                for i, tag_header in enumerate(archive.tags):
+                    print_tag_row(i, tag_header)
 
     except (struct.error, UnicodeDecodeError) as e:
         raise ValueError(f"Error processing binary data: {e}")
 
-def debug_mono_header(mono_header, data):
+def print_tag_row(i, tag_header):
+    print(
+        f' {i:03} | '
+        f'{tag_header.signature} | '
+        f'{tag_header.tag_type} | '
+        f'{tag_header.tag_id} | '
+        f'{tag_header.name}'
+    )
+
+class MonoArchive:
+    """
+    Random access to the tags in a monolith file. Only the mono header and
+    tag list are read when opened, tag data is read as it's asked for
+    """
+    __slots__ = ('path', 'file', 'lock', 'size', 'header', 'tags', 'index')
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        try:
+            self.file = open(self.path, 'rb')
+        except FileNotFoundError:
+            print(f"Error: File not found - {self.path}")
+            sys.exit(1)
+        self.lock = threading.Lock()
+        try:
+            self.size = os.fstat(self.file.fileno()).st_size
+            header_size = min(self.size, myth_headers.SB_MONO_HEADER_SIZE)
+            self.header = myth_headers.parse_mono_header(self.path.name, self.read_at(0, header_size))
+            tag_list = self.read_at(self.header.tag_list_start, self.header.tag_list_size)
+            self.tags = myth_headers.decode_tag_list(self.header.game_version, self.header.tag_count, tag_list)
+        except BaseException:
+            self.file.close()
+            raise
+        self.index = tag_index(self.tags)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        self.file.close()
+
+    def read_at(self, offset, size):
+        return read_at(self.file, self.lock, offset, size)
+
+    def entrypoints(self):
+        if not self.header.entry_tag_count:
+            return OrderedDict()
+        entrypoints_end = (
+            self.header.entry_tag_list_start
+            + self.header.entry_tag_count * myth_headers.ENTRY_TAG_HEADER_SIZE
+        )
+        return get_entrypoints(self.read_at(0, entrypoints_end), self.header)
+
+    def find(self, tag_type, tag_id):
+        """Position of a tag in the tag list, or None"""
+        return self.index.get((codec.tag_key(tag_type), codec.tag_key(tag_id)))
+
+    def tag_data(self, tag_header):
+        return self.read_at(tag_header.tag_data_offset, tag_header.tag_data_size)
+
+    def copy_tag_data(self, tag_header, out_file):
+        """
+        Append a tag's data to an unbuffered file, copied in the kernel
+        where the platform and filesystems allow
+        """
+        offset = tag_header.tag_data_offset
+        remaining = tag_header.tag_data_size
+        if KERNEL_COPY:
+            try:
+                while remaining:
+                    copied = kernel_copy(self.file.fileno(), out_file.fileno(), offset, remaining)
+                    if not copied:
+                        raise ValueError(f"Truncated archive {self.path.name}: tag data ends at {offset}")
+                    offset += copied
+                    remaining -= copied
+            except OSError as e:
+                if e.errno not in KERNEL_COPY_UNSUPPORTED:
+                    raise
+        if remaining:
+            out_file.write(self.read_at(offset, remaining))
+
+    def read_tag(self, tag_type, tag_id):
+        """A tag's header and data in standalone tag file form, or None"""
+        i = self.find(tag_type, tag_id)
+        if i is not None:
+            tag_header = self.tags[i]
+            return myth_headers.encode_header(tag_header) + self.tag_data(tag_header)
+
+def tag_index(tags):
+    """(type, id) to position in a tag list. The first of any duplicates wins"""
+    index = {}
+    for i, tag_header in enumerate(tags):
+        index.setdefault((codec.tag_key(tag_header.tag_type), codec.tag_key(tag_header.tag_id)), i)
+    return index
+
+def read_at(file, lock, offset, size):
+    """
+    Bytes at an offset in an archive file. Safe to call from several
+    threads, the lock is only used where there's no pread
+    """
+    if PREAD:
+        data = os.pread(file.fileno(), size, offset)
+    else:
+        with lock:
+            file.seek(offset)
+            data = file.read(size)
+    if len(data) < size:
+        name = pathlib.Path(file.name).name
+        raise ValueError(f"Truncated archive {name}: wanted {size} bytes at {offset}, got {len(data)}")
+    return data
+
+def kernel_copy(in_fd, out_fd, offset, count):
+    if hasattr(os, 'copy_file_range'):
+        return os.copy_file_range(in_fd, out_fd, count, offset)
+    return os.sendfile(out_fd, in_fd, offset, count)
+
+def is_pattern(value):
+    return bool(value) and any(c in value for c in GLOB_CHARS)
+
+def export_matching(archive, type_pattern, id_pattern, output_dir):
+    """
+    Export every tag whose type and id match glob patterns, without
+    prompting, and write a manifest of what was written
+    """
+    if not output_dir:
+        output_dir = pathlib.Path(sys.path[0], '../output/mono2tag', archive.path.name).resolve()
+    else:
+        output_dir = pathlib.Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    matching = [
+        i for i in archive.index.values()
+        if fnmatch.fnmatchcase(str(archive.tags[i].tag_type), type_pattern)
+        and fnmatch.fnmatchcase(str(archive.tags[i].tag_id), id_pattern)
+    ]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        written = list(executor.map(
+            lambda i: write_tag(archive, archive.tags[i], output_dir),
+            matching
+        ))
+
+    manifest = {
+        'archive': archive.path.name,
+        'game_version': archive.header.game_version,
+        'type': type_pattern,
+        'id': id_pattern,
+        'tags': [],
+    }
+    for i, tag_path in zip(matching, written):
+        tag_header = archive.tags[i]
+        print_tag_row(i, tag_header)
+        manifest['tags'].append({
+            'index': i,
+            'signature': str(tag_header.signature),
+            'type': str(tag_header.tag_type),
+            'id': str(tag_header.tag_id),
+            'name': str(tag_header.name),
+            'size': myth_headers.TAG_HEADER_SIZE + tag_header.tag_data_size,
+            'path': tag_path.name,
+        })
+    manifest_path = output_dir / 'manifest.json'
+    with open(manifest_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2)
+        manifest_file.write('\n')
+    total_size = sum(tag['size'] for tag in manifest['tags'])
+    print(f"{len(written)} tags extracted ({total_size} bytes). Output saved to {output_dir}")
+    return manifest
+
+def write_tag(archive, tag_header, output_dir):
+    tag_path = output_dir / f'{tag_header.signature}-{tag_header.tag_type}-{tag_header.tag_id}'
+    with open(tag_path, 'wb', buffering=0) as tag_file:
+        tag_file.write(myth_headers.encode_header(tag_header))
+        archive.copy_tag_data(tag_header, tag_file)
+    return tag_path
+
+def debug_mono_header(mono_header, file_size):
     if DEBUG:
         print(mono_header)
         print('     game version', mono_header.game_version)
-        print('total file length', len(data))
+        print('total file length', file_size)
         print('      header size', mono_header.header_size)
         if mono_header.entry_tag_count:
             print('    entry tag start', mono_header.entry_tag_list_start)
@@ -148,23 +334,17 @@ def entrypoint_entry(entry_id, entrypoint):
         f' {format_entry_name(entry_long_name, entry_name)}'
     )
 
-def seek_tag(tags, tag_type, tag_id, data, mono_header):
-    for tag_header in tags:
-        if (
-            tag_header.tag_type == tag_type and
-            tag_header.tag_id == tag_id
-        ):
-            tag_start = tag_header.tag_data_offset
-            tag_end = tag_start + tag_header.tag_data_size
-            return myth_headers.encode_header(tag_header) + data[tag_start:tag_end]
-
-def export_tag(tag_header, data, output_file):
-    tag_start = tag_header.tag_data_offset
-    tag_end = tag_start + tag_header.tag_data_size
-    tag_data = data[tag_start:tag_end]
+def seek_tag(index, tags, tag_type, tag_id, data):
+    i = index.get((codec.tag_key(tag_type), codec.tag_key(tag_id)))
+    if i is not None:
+        tag_header = tags[i]
+        tag_start = tag_header.tag_data_offset
+        tag_end = tag_start + tag_header.tag_data_size
+        return myth_headers.encode_header(tag_header) + data[tag_start:tag_end]
 
+def export_tag(tag_header, tag_data, output_file):
     if not output_file:
-        output_file = f'../tags/{tag_header.signature}-{tag_header.tag_type}-{tag_id}'
+        output_file = f'../tags/{tag_header.signature}-{tag_header.tag_type}-{tag_header.tag_id}'
         tag_path = pathlib.Path(sys.path[0], output_file).resolve()
     else:
         tag_path = pathlib.Path(output_file)
@@ -183,7 +363,7 @@ def prompt(prompt_path):
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print(f"Usage: python3 {sys.argv[0]} <input_file> [<tag_type> <tag_id> [<output_file>]]")
+        print(f"Usage: python3 {sys.argv[0]} <input_file> [<tag_type> <tag_id> [<output_file_or_dir>]]")
         sys.exit(1)
     
     input_file = sys.argv[1]
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+import bisect
+import enum
+import lzma
+import os
+import pathlib
+import struct
+import sys
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import loadtags
+import myth_headers
+import mono2tag
+import utils
+
+DEBUG = (os.environ.get('DEBUG') == '1')
+
+MAX_WORKERS = 16
+
+MAGIC = b'mpk1'
+# magic, original size, chunk count
+PACK_HEADER = struct.Struct('>4sQI')
+# compression, original size, packed size
+CHUNK_ENTRY = struct.Struct('>BII')
+
+LZMA_PRESET = 6
+LZMA_MAX_DICT_SIZE = 1 << 23
+LZMA_MIN_DICT_SIZE = 1 << 12
+
+class Compression(enum.IntEnum):
+    STORED = 0
+    ZLIB = 1
+    LZMA = 2
+
+def main(input_file, output_file, compression):
+    """
+    Pack a monolithic tag container into a compressed one that load_tags
+    reads tags from directly, or unpack one back to the original
+    """
+    if compression.upper() not in ['LZMA', 'ZLIB']:
+        raise ValueError(f'Unknown compression: {compression}')
+    input_path = pathlib.Path(input_file)
+    packed = is_packed(utils.load_file(input_path, PACK_HEADER.size))
+    if output_file:
+        output_path = pathlib.Path(output_file)
+    else:
+        output_path = pathlib.Path(
+            sys.path[0], '../output/monopack', 'unpacked' if packed else 'packed', input_path.name
+        ).resolve()
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if packed:
+        size = unpack_file(input_path, output_path)
+        print(f'Unpacked {size} bytes to {output_path}')
+    else:
+        (size, packed_size, chunk_count) = pack_file(input_path, output_path, Compression[compression.upper()])
+        print(
+            f'Packed {size} bytes to {packed_size} ({packed_size / max(1, size):.1%}) '
+            f'in {chunk_count} chunks to {output_path}'
+        )
+
+def is_packed(data):
+    return data[:len(MAGIC)] == MAGIC
+
+def chunk_spans(name, data):
+    """
+    (start, end) ranges covering the whole archive: one per tag's data, so
+    each tag decompresses on its own, and the headers and gaps between
+    """
+    try:
+        mono_header = myth_headers.parse_mono_header(name, data)
+        tag_headers = myth_headers.get_mono_tags(data, mono_header)
+    except (struct.error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f'{name} is not a TFL or SB archive: {e}')
+
+    tag_spans = sorted(
+        (start, start + size)
+        for (start, size) in zip(tag_headers.column('tag_data_offset'), tag_headers.column('tag_data_size'))
+        if size > 0 and start >= 0 and start + size <= len(data)
+    )
+    spans = []
+    position = 0
+    for (start, end) in tag_spans:
+        if start < position:
+            # Overlapping tag data shares a chunk
+            if end > position:
+                spans[-1] = (spans[-1][0], end)
+                position = end
+            continue
+        if start > position:
+            spans.append((position, start))
+        spans.append((start, end))
+        position = end
+    if position < len(data):
+        spans.append((position, len(data)))
+    return spans
+
+def lzma_filters(size):
+    """
+    Raw streams, the .xz container would add its headers to every chunk.
+    The dictionary only needs to hold the chunk, most are far smaller than
+    the preset's and setting one up is most of the cost of a small chunk
+    """
+    dict_size = max(LZMA_MIN_DICT_SIZE, min(LZMA_MAX_DICT_SIZE, size))
+    return [{'id': lzma.FILTER_LZMA2, 'preset': LZMA_PRESET, 'dict_size': dict_size}]
+
+def compress_chunk(chunk, compression):
+    if compression == Compression.LZMA:
+        packed = lzma.compress(chunk, format=lzma.FORMAT_RAW, filters=lzma_filters(len(chunk)))
+    elif compression == Compression.ZLIB:
+        packed = zlib.compress(chunk, 9)
+    else:
+        packed = chunk
+    if len(packed) >= len(chunk):
+        return (Compression.STORED, chunk)
+    if decompress_chunk(compression, packed, len(chunk)) != chunk:
+        raise ValueError(f'{compression.name} round trip failed')
+    return (compression, packed)
+
+def decompress_chunk(compression, packed, size):
+    if compression == Compression.LZMA:
+        return lzma.decompress(packed, format=lzma.FORMAT_RAW, filters=lzma_filters(size))
+    elif compression == Compression.ZLIB:
+        return zlib.decompress(packed)
+    return packed
+
+def pack_file(input_path, output_path, compression=Compression.LZMA):
+    data = utils.load_file(input_path)
+    spans = chunk_spans(input_path.name, data)
+    # Both compressors release the GIL
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        chunks = list(executor.map(
+            lambda span: compress_chunk(data[span[0]:span[1]], compression), spans
+        ))
+
+    index = b''.join(
+        CHUNK_ENTRY.pack(chunk_compression, end - start, len(packed))
+        for ((start, end), (chunk_compression, packed)) in zip(spans, chunks)
+    )
+    tmp_path = output_path.with_name(f'{output_path.name}.tmp')
+    with open(tmp_path, 'wb') as packed_file:
+        packed_file.write(PACK_HEADER.pack(MAGIC, len(data), len(chunks)))
+        packed_file.write(index)
+        for (chunk_compression, packed) in chunks:
+            packed_file.write(packed)
+        packed_size = packed_file.tell()
+    os.replace(tmp_path, output_path)
+    return (len(data), packed_size, len(chunks))
+
+def unpack_file(input_path, output_path):
+    with PackedArchive(input_path) as packed:
+        tmp_path = output_path.with_name(f'{output_path.name}.tmp')
+        with open(tmp_path, 'wb') as unpacked_file:
+            for i in range(len(packed.chunk_starts)):
+                unpacked_file.write(packed.chunk(i))
+            size = unpacked_file.tell()
+        if size != packed.size:
+            raise ValueError(f'Unpacked {size} bytes, expected {packed.size}')
+        os.replace(tmp_path, output_path)
+    return size
+
+class PackedArchive(loadtags.SlicedData):
+    """
+    The original archive data of a packed archive. Reads decompress just
+    the chunks in that range, and get_tag_data and get_tag_info only ever
+    need one
+    """
+    __slots__ = (
+        'path', 'file', 'lock',
+        'chunk_starts', 'chunk_offsets', 'chunk_entries', 'last_chunk',
+    )
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        try:
+            self.file = open(path, 'rb')
+        except FileNotFoundError:
+            print(f"Error: File not found - {path}")
+            sys.exit(1)
+        self.lock = threading.Lock()
+        (magic, self.size, chunk_count) = PACK_HEADER.unpack(self.read_at(0, PACK_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f'{self.path.name} is not a packed archive')
+        self.chunk_entries = list(CHUNK_ENTRY.iter_unpack(
+            self.read_at(PACK_HEADER.size, chunk_count * CHUNK_ENTRY.size)
+        ))
+        self.chunk_starts = []
+        self.chunk_offsets = []
+        start = 0
+        offset = PACK_HEADER.size + chunk_count * CHUNK_ENTRY.size
+        for (compression, size, packed_size) in self.chunk_entries:
+            self.chunk_starts.append(start)
+            self.chunk_offsets.append(offset)
+            start += size
+            offset += packed_size
+        if start != self.size:
+            raise ValueError(f'{self.path.name} chunks hold {start} bytes, expected {self.size}')
+        # Headers are read in several small reads from the same chunk
+        self.last_chunk = (None, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        self.file.close()
+
+    def read_at(self, offset, size):
+        return mono2tag.read_at(self.file, self.lock, offset, size)
+
+    def chunk(self, i):
+        (last_i, last_data) = self.last_chunk
+        if last_i == i:
+            return last_data
+        (compression, size, packed_size) = self.chunk_entries[i]
+        data = decompress_chunk(compression, self.read_at(self.chunk_offsets[i], packed_size), size)
+        if len(data) != size:
+            raise ValueError(f'{self.path.name} chunk {i} is {len(data)} bytes, expected {size}')
+        self.last_chunk = (i, data)
+        return data
+
+    def read(self, start, end):
+        parts = []
+        i = bisect.bisect_right(self.chunk_starts, start) - 1
+        while start < end:
+            chunk_start = self.chunk_starts[i]
+            (compression, size, packed_size) = self.chunk_entries[i]
+            chunk_end = min(end, chunk_start + size)
+            if compression == Compression.STORED:
+                parts.append(self.read_at(self.chunk_offsets[i] + start - chunk_start, chunk_end - start))
+            else:
+                parts.append(self.chunk(i)[start - chunk_start:chunk_end - chunk_start])
+            start = chunk_end
+            i += 1
+        return b''.join(parts)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python3 {sys.argv[0]} <input_file> [<output_file> [lzma|zlib]]")
+        sys.exit(1)
+
+    input_file = sys.argv[1]
+    output_file = None
+    compression = 'lzma'
+    if len(sys.argv) > 2:
+        output_file = sys.argv[2]
+    if len(sys.argv) > 3:
+        compression = sys.argv[3]
+
+    try:
+        main(input_file, output_file, compression)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except BrokenPipeError:
+        sys.stdout = None
+        sys.exit(1)
@@ -18,7 +18,9 @@ def main(game_directory, mons_id, plugin_names):
     """
     Load Myth game tags and plugins and output stats for all monsters
     """
-    (game_version, tags, entrypoint_map, data_map, cutscenes) = loadtags.load_tags(game_directory, plugin_names)
+    (game_version, tags, entrypoint_map, data_map, cutscenes) = loadtags.load_tags(
+        game_directory, plugin_names, tag_types=['mons', 'obje', 'prgr', 'proj', 'stli', '.256']
+    )
 
     try:
         if mons_id == 'all':
@@ -6,8 +6,11 @@ import sys
 
 import codec
 import myth_headers
+import tracing
 
 DEBUG_COLL = (os.environ.get('DEBUG_COLL') == '1')
+# Keep the second colour layer of R8G8B8A5H bitmaps
+SECONDARY_LAYER = (os.environ.get('SECONDARY_LAYER') == '1')
 
 FIXED_SF = 1 << 16
 
@@ -233,7 +236,8 @@ def parse_bitmap_instance(data, coll_header):
     bitmap_instance_start = coll_header.data_offset + coll_header.bitmap_instances_offset
     return codec.list_codec(
         coll_header.bitmap_instance_count,
-        BitmapInstanceFmt
+        BitmapInstanceFmt,
+        bulk=True
     )(data, offset=bitmap_instance_start)
 
 SEQ_DATA_SIZE = 64
@@ -331,6 +335,7 @@ BitmapReferenceFmt = ('BitmapReference', [
     ('16x', None),
 ])
 
+@tracing.traced()
 def parse_bitmaps(data, coll_header, color_table):
     bitmaps = []
     bitmap_reference_start = coll_header.data_offset + coll_header.bitmap_references_offset
@@ -387,7 +392,8 @@ def parse_shadow_maps(data, coll_header):
     shadow_map_start = coll_header.data_offset + coll_header.shadow_maps_offset
     return codec.list_codec(
         coll_header.shadow_map_count,
-        ShadowMapFmt
+        ShadowMapFmt,
+        bulk=True
     )(data, offset=shadow_map_start)
 
 def render_terminal(rows):
@@ -453,9 +459,10 @@ def parse_bitmap_data(total_size, start, data):
 
     return (bitmap_meta, bitmap_data)
 
+@tracing.traced()
 def decode_bitmap(bitdata, bitmap_data, color_table=None):
     if bitdata.encoding == ExtendedEncoding.EXT_R8G8B8A5H:
-        return decode_bitmap_64(bitmap_data, bitdata.width, bitdata.height)
+        return decode_bitmap_64(bitmap_data, bitdata.width, bitdata.height, SECONDARY_LAYER)
     elif bitdata.encoding == ExtendedEncoding.EXT_ARGB_8888_32:
         return decode_bitmap_32(bitmap_data, bitdata.width, bitdata.height)
     if BitmapFlags.TRANSPARENCY_ENCODED_1BIT in bitdata.flags:
@@ -618,63 +625,117 @@ def decode_bitmap_32(bitmap_data, width, height):
         rows.append(row)
     return rows
 
-def decode_pix_64(alpha_state, bitmap_data, byte_index):
-    pix = {
-        'a': a5h3_pixel_a_int(alpha_state),
-        'b': bitmap_data[byte_index],
-        'g': bitmap_data[byte_index+1],
-        'r': bitmap_data[byte_index+2],
-    }
+# Lowest bit of each byte: an odd blue value has a second colour after it
+ODD_BYTES = bytes(i & 1 for i in range(256))
+
+class BitmapPixels:
+    """
+    A decoded bitmap as one RGBA buffer, and the second colour layer of
+    extended encodings if asked for. Indexing and iterating give rows of
+    (r, g, b, a) like the other decoders, tag2png writes the buffer as is
+    """
+    __slots__ = ('width', 'height', 'rgba', 'secondary')
+
+    def __init__(self, width, height, rgba, secondary=None):
+        self.width = width
+        self.height = height
+        self.rgba = rgba
+        self.secondary = secondary
+
+    def __len__(self):
+        return self.height
+
+    def row(self, row_i):
+        stride = self.width * 4
+        row = self.rgba[row_i * stride:(row_i + 1) * stride]
+        return list(zip(row[0::4], row[1::4], row[2::4], row[3::4]))
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.row(row_i) for row_i in range(*key.indices(self.height))]
+        if key < 0:
+            key += self.height
+        if not 0 <= key < self.height:
+            raise IndexError('row index out of range')
+        return self.row(key)
+
+    def __iter__(self):
+        for row_i in range(self.height):
+            yield self.row(row_i)
+
+def decode_pix_64(bitmap_data, byte_index, alpha, rgba, secondary, offset):
+    (b, g, r) = bitmap_data[byte_index:byte_index+3]
+    rgba[offset:offset+4] = (r, g, b, alpha)
     byte_index += 3
-    if pix['b'] & 1:
-        pix['b2'] = bitmap_data[byte_index]
-        pix['g2'] = bitmap_data[byte_index+1]
-        pix['r2'] = bitmap_data[byte_index+2]
-        pix['a2'] = a5h3_pixel_a_int(bitmap_data[byte_index+3])
+    if b & 1:
+        if secondary is not None:
+            (b2, g2, r2, a2) = bitmap_data[byte_index:byte_index+4]
+            secondary[offset:offset+4] = (r2, g2, b2, a5h3_pixel_a_int(a2))
         byte_index += 4
-    return (pix, byte_index)
-
-def decode_bitmap_64(bitmap_data, width, height):
-    pixels = []
+    return byte_index
+
+def decode_opaque_run_64(bitmap_data, byte_index, rgba, secondary, pixel_i, run_length):
+    """
+    Pixels before the next one with a second colour are 3 bytes apart, so
+    each channel of them is copied with one strided slice
+    """
+    end_i = pixel_i + run_length
+    while pixel_i < end_i:
+        count = end_i - pixel_i
+        blues = bitmap_data[byte_index:byte_index + count * 3:3]
+        plain = blues.translate(ODD_BYTES).find(1)
+        if plain == -1:
+            plain = count
+        if plain:
+            data_end = byte_index + plain * 3
+            offset = pixel_i * 4
+            rgba_end = offset + plain * 4
+            rgba[offset:rgba_end:4] = bitmap_data[byte_index+2:data_end:3]
+            rgba[offset+1:rgba_end:4] = bitmap_data[byte_index+1:data_end:3]
+            rgba[offset+2:rgba_end:4] = bitmap_data[byte_index:data_end:3]
+            rgba[offset+3:rgba_end:4] = b'\xff' * plain
+            byte_index = data_end
+            pixel_i += plain
+        if pixel_i < end_i:
+            byte_index = decode_pix_64(bitmap_data, byte_index, 255, rgba, secondary, pixel_i * 4)
+            pixel_i += 1
+    return byte_index
+
+def decode_bitmap_64(bitmap_data, width, height, secondary=False):
+    """
+    Decodes into a preallocated RGBA buffer. It starts out transparent, so
+    transparent runs only move along. Runs past the last pixel are cut off
+    """
     pixel_count = width * height
+    rgba = bytearray(pixel_count * 4)
+    secondary_rgba = bytearray(pixel_count * 4) if secondary else None
 
     alpha_state = 0
     byte_index = 0
-    pixel_length = 0
-    while pixel_length < pixel_count:
+    pixel_i = 0
+    while pixel_i < pixel_count:
         if is_transparent_or_opaque(alpha_state):
             # Decode RLE
             run_length = bitmap_data[byte_index]
             byte_index += 1
-            for i in range(run_length):
-                if is_opaque(alpha_state):
-                    (pix, byte_index) = decode_pix_64(alpha_state, bitmap_data, byte_index)
-                else:
-                    pix = {'a': a5h3pixel_a(alpha_state), 'r': 0, 'g': 0, 'b': 0}
-                pixels.append(pix)
-            pixel_length += run_length
+            if is_opaque(alpha_state):
+                byte_index = decode_opaque_run_64(
+                    bitmap_data, byte_index, rgba, secondary_rgba,
+                    pixel_i, min(run_length, pixel_count - pixel_i)
+                )
+            pixel_i += run_length
             alpha_state = a5h3pixel(1, 0)
         else:
             # // Decode Plain
             alpha_state = bitmap_data[byte_index]
             byte_index += 1
             if a5h3pixel_a(alpha_state):
-                (pix, byte_index) = decode_pix_64(alpha_state, bitmap_data, byte_index)
-            else:
-                pix = {'a': a5h3pixel_a(alpha_state), 'r': 0, 'g': 0, 'b': 0}
-            pixels.append(pix)
-            pixel_length += 1
+                byte_index = decode_pix_64(
+                    bitmap_data, byte_index, a5h3_pixel_a_int(alpha_state), rgba, secondary_rgba, pixel_i * 4
+                )
+            pixel_i += 1
 
-    rows = []
-    pix_i = 0
-    for row_i in range(height):
-        row = []
-        for col_i in range(width):
-            pixel = pixels[pix_i]
-            row.append((pixel['r'], pixel['g'], pixel['b'], pixel['a']))
-            pix_i += 1
-        rows.append(row)
-    return rows
+    return BitmapPixels(width, height, rgba, secondary_rgba)
 
 def parse_d256_header(data):
     return myth_headers.parse_tag(D256HeadFmt, data)
@@ -3,11 +3,14 @@ import enum
 from collections import namedtuple
 
 import codec
+import tracing
 
 GOR_HEADER_SIZE = 64
 SB_MONO_HEADER_SIZE = 128
 TAG_HEADER_SIZE = 64
 ENTRY_TAG_HEADER_SIZE = 112
+# Where tag_type sits in a TFL and SB tag header, by game version
+TAG_TYPE_OFFSETS = {1: 32, 2: 36}
 
 class ArchiveType(enum.Enum):
     TAG = 0
@@ -277,14 +280,37 @@ def parse_tfl_header(header):
 def parse_sb_header(header):
     return SBHeader(header)
 
+@tracing.traced()
 def get_mono_tags(data, mono_header):
-    if mono_header.game_version == 1:
+    return decode_tag_list(
+        mono_header.game_version, mono_header.tag_count, data, mono_header.tag_list_start
+    )
+
+def decode_tag_list(game_version, tag_count, data, offset=0):
+    if game_version == 1:
         head_codec = TFLHeader
-    elif mono_header.game_version == 2:
+    elif game_version == 2:
         head_codec = SBHeader
     else:
-        raise ValueError(f"Incompatible game version: {mono_header.game_version}")
-    return codec.list_codec(mono_header.tag_count, head_codec)(data, offset=mono_header.tag_list_start)
+        raise ValueError(f"Incompatible game version: {game_version}")
+    return codec.list_codec(tag_count, head_codec, bulk=True)(data, offset=offset)
+
+def decode_tag_list_types(game_version, tag_count, data, tag_types, offset=0):
+    """
+    decode_tag_list for only the tags of some types. Other tags are
+    skipped on their raw type bytes without being decoded
+    """
+    type_start = TAG_TYPE_OFFSETS[game_version]
+    type_end = type_start + 4
+    wanted = {codec.tag_key(tag_type) for tag_type in tag_types}
+    tag_list_end = offset + tag_count * TAG_HEADER_SIZE
+    # TagKeys are cached by raw bytes, and ignore anything after a null
+    headers = [
+        data[start:start + TAG_HEADER_SIZE]
+        for start in range(offset, tag_list_end, TAG_HEADER_SIZE)
+        if codec.TagKey(data[start + type_start:start + type_end]) in wanted
+    ]
+    return decode_tag_list(game_version, len(headers), b''.join(headers))
 
 def parse_tag(fmt, data):
     return codec.codec(fmt)(data, offset=TAG_HEADER_SIZE)
@@ -4,6 +4,7 @@ import struct
 
 import codec
 import myth_headers
+import tracing
 
 AIFC_VERSION_1 = 2726318400
 SAMPLE_RATE_80_FLOAT_22050 = b'\x40\x0D\xAC\x44\x00\x00\x00\x00\x00\x00'
@@ -78,6 +79,7 @@ AmsoFmt = ('Amso', [
 def parse_soun_header(data):
     return myth_headers.parse_tag(SoundHeaderFmt, data)
 
+@tracing.traced()
 def parse_soun_tag(data):
     header = myth_headers.parse_header(data)
 
@@ -209,6 +211,7 @@ samp_frame: {p['num_sample_frames']}
 def parse_amso(data):
     return myth_headers.parse_tag(AmsoFmt, data)
 
+@tracing.traced()
 def generate_aifc(perm):
     offset = 0
     block_size = 0
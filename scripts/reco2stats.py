@@ -1,40 +1,85 @@
 #!/usr/bin/env python3
 import json
 import os
+import pathlib
 import struct
 import sys
 
+import codec
+import reco_scan
 import reco_tag
+import utils
+
+workerpool = utils.lazy_import('workerpool')
 
 DEBUG = (os.environ.get('DEBUG') == '1')
 
-def main(game_directory, reco_file):
+def main(game_directory, reco_file, start_minute=None, end_minute=None):
     """
-    Log commands from a recording file
+    Log commands from a recording file, optionally within a window of game time.
+    Given a directory, logs game stats of every film in it
     """
+    if pathlib.Path(reco_file).is_dir():
+        print(json.dumps(directory_stats(game_directory, reco_file, start_minute, end_minute), indent=2))
+        return
 
     try:
         (
             reco_header, players, players_idx, monsters, teams, teams_idx,
             plugins, mesh_header, level_name, game_time, game_type_choice, difficulty,
             overhead_map_data, chat_lines, trades, splits, game_stats
-        ) = reco_tag.parse_reco_file(game_directory, reco_file)
+        ) = reco_tag.parse_reco_file(game_directory, reco_file, start_minute, end_minute)
 
         print(json.dumps(game_stats, indent=2))
 
     except (struct.error, UnicodeDecodeError) as e:
         raise ValueError(f"Error processing binary data: {e}")
 
+def directory_stats(game_directory, reco_dir, start_minute, end_minute):
+    """
+    {film_path: game_stats} for every film under a directory, parsed in a
+    worker pool that loads the tags of each plugin combination once
+    """
+    films = reco_scan.scan_films(reco_dir)
+    plugin_sets = []
+    for plugin_data in films.values():
+        plugin_names = [codec.decode_string(p[0]) for p in plugin_data]
+        if plugin_names in plugin_sets:
+            continue
+        # Films with missing plugins fail on their own, don't load them here
+        if all(pathlib.Path(game_directory, 'plugins', plugin).exists() for plugin in plugin_names):
+            plugin_sets.append(plugin_names)
+
+    with workerpool.WorkerPool(game_directory, plugin_sets or [[]]) as pool:
+        futures = {
+            film_path: pool.submit('film', game_directory, film_path, start_minute, end_minute)
+            for film_path in films
+        }
+        stats = {}
+        for (film_path, future) in futures.items():
+            try:
+                stats[film_path] = future.result()
+            except (Exception, SystemExit) as e:
+                print(f'[reco2stats] Failed {film_path}: {e!r}', file=sys.stderr)
+                stats[film_path] = {'error': repr(e)}
+    return stats
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print(f"Usage: python3 {sys.argv[0]} <game_directory> <reco_file>")
+        print(f"Usage: python3 {sys.argv[0]} <game_directory> <reco_file_or_dir> [<start_minute> [<end_minute>]]")
         sys.exit(1)
     
     game_directory = sys.argv[1]
     reco_file = sys.argv[2]
+    start_minute = None
+    end_minute = None
+    if len(sys.argv) > 3:
+        start_minute = float(sys.argv[3])
+    if len(sys.argv) > 4:
+        end_minute = float(sys.argv[4])
 
     try:
-        main(game_directory, reco_file)
+        main(game_directory, reco_file, start_minute, end_minute)
     except KeyboardInterrupt:
         sys.exit(130)
     except BrokenPipeError:
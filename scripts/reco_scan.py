@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+import json
+import os
+import pathlib
+import struct
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import codec
+import myth_headers
+import reco_tag
+
+DEBUG = (os.environ.get('DEBUG') == '1')
+
+CACHE_VERSION = 1
+CACHE_FILE = '../output/cache/reco_scan.json'
+MAX_WORKERS = 16
+
+def main(input_dir):
+    """
+    Scan a directory of films and list the plugins each one needs
+    """
+    films = scan_films(input_dir)
+    for plugin, film_paths in plugin_index(films).items():
+        print(f'{codec.decode_string(plugin[0])} films={len(film_paths)}')
+        if DEBUG:
+            [print(f' - {p}') for p in film_paths]
+
+def cache_path():
+    return pathlib.Path(sys.path[0], CACHE_FILE).resolve()
+
+def walk_files(root_dir):
+    """Recursively yield (path, stat) for every regular file under root_dir"""
+    for entry in os.scandir(root_dir):
+        if entry.name.startswith('.'):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            yield from walk_files(entry.path)
+        elif entry.is_file():
+            yield (entry.path, entry.stat())
+
+def read_reco_plugins(file_path):
+    """
+    Read the tag header, RecoHeader and NewGameParamData of a film in one
+    bounded read. Returns the plugin list, or None if this isn't a film
+    """
+    try:
+        with open(file_path, 'rb') as f:
+            data = f.read(reco_tag.HEAD_READ_SIZE)
+        if len(data) < reco_tag.HEAD_READ_SIZE:
+            return None
+        header = myth_headers.parse_header(data)
+        if header.tag_type != 'reco':
+            return None
+        (reco, game_param) = reco_tag.parse_reco_params(data[myth_headers.TAG_HEADER_SIZE:])
+        return game_param.plugin_data
+    except (struct.error, UnicodeDecodeError, ValueError):
+        return None
+    except OSError as e:
+        print(f"[!] Failed to read {file_path}: {e}")
+        return None
+
+def encode_plugins(plugins):
+    if plugins is None:
+        return None
+    return [[codec.decode_string(name), codec.decode_string(url), checksum] for (name, url, checksum) in plugins]
+
+def decode_plugins(cached):
+    if cached is None:
+        return None
+    return [(codec.encode_string(name), codec.encode_string(url), checksum) for (name, url, checksum) in cached]
+
+def load_cache(path):
+    try:
+        with open(path, 'r') as cache_file:
+            cache = json.load(cache_file)
+        if cache.get('version') == CACHE_VERSION:
+            return cache['files']
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+    return {}
+
+def save_cache(path, files):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'{path.name}.tmp')
+    with open(tmp_path, 'w') as cache_file:
+        json.dump({'version': CACHE_VERSION, 'files': files}, cache_file)
+    os.replace(tmp_path, path)
+
+def scan_films(root_dir, use_cache=True):
+    """
+    Returns {film_path: plugin_data} for every film under root_dir.
+    Headers are read in parallel, results are cached by (path, size, mtime)
+    so only new or modified files are read on subsequent runs, and the
+    cache is only rewritten when something under root_dir changed
+    """
+    path = cache_path()
+    cached = load_cache(path) if use_cache else {}
+
+    entries = {}
+    to_read = []
+    for (file_path, stat) in walk_files(root_dir):
+        file_path = os.path.abspath(file_path)
+        key = [stat.st_size, stat.st_mtime_ns]
+        hit = cached.get(file_path)
+        if hit and hit[:2] == key:
+            entries[file_path] = hit
+        else:
+            to_read.append((file_path, key))
+
+    if DEBUG:
+        print(f'[reco_scan] cached={len(entries)} read={len(to_read)}')
+
+    if to_read:
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            results = executor.map(read_reco_plugins, [file_path for (file_path, key) in to_read])
+            for ((file_path, key), plugins) in zip(to_read, results):
+                entries[file_path] = key + [encode_plugins(plugins)]
+
+    if use_cache:
+        # Keep entries for other scanned directories, but not for files
+        # under this one that have been deleted or moved
+        root_prefix = os.path.join(os.path.abspath(root_dir), '')
+        stale = [
+            file_path for file_path in cached
+            if file_path.startswith(root_prefix) and file_path not in entries
+        ]
+        if to_read or stale:
+            for file_path in stale:
+                del cached[file_path]
+            save_cache(path, cached | entries)
+
+    return {
+        file_path: decode_plugins(entry[2])
+        for file_path, entry in sorted(entries.items()) if entry[2] is not None
+    }
+
+def plugin_index(films):
+    """Invert {film_path: plugins} into {plugin: [film_paths]}"""
+    index = {}
+    for film_path, plugins in films.items():
+        for plugin in plugins:
+            if plugin not in index:
+                index[plugin] = []
+            index[plugin].append(film_path)
+    return index
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python3 {sys.argv[0]} <input_dir>")
+        sys.exit(1)
+
+    input_dir = sys.argv[1]
+
+    try:
+        main(input_dir)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except BrokenPipeError:
+        sys.stdout = None
+        sys.exit(1)
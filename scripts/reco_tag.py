@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
-from collections import OrderedDict, Counter, defaultdict
+from collections import OrderedDict, Counter, defaultdict, namedtuple
 import enum
 import datetime
+import hashlib
 import json
 import os
 import pathlib
@@ -11,20 +12,29 @@ import sys
 
 import codec
 import myth_headers
-import mesh_tag
-import mesh2trades
-import mons_tag
 import pref2info
 import utils
-import loadtags
+import tracing
 import game_headers
 import player_headers
 
+# Only needed to parse the timeline, not the film headers
+loadtags = utils.lazy_import('loadtags')
+mesh_tag = utils.lazy_import('mesh_tag')
+mesh2trades = utils.lazy_import('mesh2trades')
+mons_tag = utils.lazy_import('mons_tag')
+
 DEBUG = (os.environ.get('DEBUG') == '1')
 DEBUG_CMDS = (os.environ.get('DEBUG_CMDS') == '1')
 DEBUG_PICKUP = (os.environ.get('DEBUG_PICKUP') == '1')
 
 HEADER_SIZE = 2606
+# Tag header plus everything parse_reco_head needs, in one bounded read
+HEAD_READ_SIZE = myth_headers.TAG_HEADER_SIZE + HEADER_SIZE
+
+SEEK_VERSION = 1
+SEEK_DIR = '../output/cache/seek'
+SEEK_INTERVAL = 30 * 30 # ticks between seek index entries
 
 class Commands(enum.Enum):
     # used by the server when no one is giving orders (0-1)
@@ -67,6 +77,22 @@ class Commands(enum.Enum):
     REPLACE_PLAYER = enum.auto()
     SET_TEAM_CAPTAIN = enum.auto()
 
+# Commands that change unit ownership, replayed when seeking
+STATE_COMMANDS = [
+    Commands.UNIT_ADJUSTMENT,
+    Commands.DETACH,
+]
+
+# Commands given to monsters, counted as actions
+MONSTER_COMMANDS = [
+    Commands.MOVEMENT,
+    Commands.GENERAL,
+    Commands.TARGET,
+    Commands.PICK_UP,
+    Commands.ATTACK_LOCATION,
+    Commands.ROTATION,
+]
+
 class GeneralCommands(enum.Enum):
     STOP = 0
     SCATTER = enum.auto()
@@ -141,6 +167,105 @@ MonsterInitializerFmt = ('MonsterInitializer', [
     ('18s', 'name'),
 ])
 
+# Typed command records, decoded from the data following each CommandHeader
+# The movement and rotation layouts haven't been worked out, keep them raw
+GeneralCommand = namedtuple('GeneralCommand', ['flags', 'general_type', 'monster_ids'])
+MovementCommand = namedtuple('MovementCommand', ['data'])
+TargetCommand = namedtuple('TargetCommand', ['flags', 'monster_ids', 'target_ids'])
+AttackLocationCommand = namedtuple('AttackLocationCommand', ['flags', 'x', 'y', 'z', 'monster_ids'])
+PickUpCommand = namedtuple('PickUpCommand', ['flags', 'object_index', 'object_identifier', 'monster_ids'])
+RotationCommand = namedtuple('RotationCommand', ['data'])
+ChatCommand = namedtuple('ChatCommand', ['flags', 'message'])
+DetachCommand = namedtuple('DetachCommand', ['flags', 'player_index', 'monster_ids'])
+UnitAdjustmentCommand = namedtuple('UnitAdjustmentCommand', ['flags', 'unit_counts'])
+RawCommand = namedtuple('RawCommand', ['data'])
+
+MonsterCountStruct = struct.Struct('>h')
+GeneralStruct = struct.Struct('>h h')
+TargetStruct = struct.Struct('>h')
+AttackLocationStruct = struct.Struct('>h 2x L L L')
+PickUpStruct = struct.Struct('>h 2x H H')
+ChatStruct = struct.Struct('>h')
+DetachStruct = struct.Struct('>h h h')
+UnitAdjustmentStruct = struct.Struct('>h h')
+
+def unpack_monster_ids(data, offset):
+    """Unpack a count prefixed list of monster ids, returns (ids, end offset)"""
+    (monster_count,) = MonsterCountStruct.unpack_from(data, offset)
+    offset += MonsterCountStruct.size
+    end = offset + (monster_count * 2)
+    return (struct.unpack_from(f'>{monster_count}h', data, offset), end)
+
+def decode_general(data):
+    (flags, general_type) = GeneralStruct.unpack_from(data)
+    (monster_ids, _end) = unpack_monster_ids(data, GeneralStruct.size)
+    return GeneralCommand(flags, general_type, monster_ids)
+
+def decode_movement(data):
+    return MovementCommand(bytes(data))
+
+def decode_target(data):
+    (flags,) = TargetStruct.unpack_from(data)
+    (monster_ids, end) = unpack_monster_ids(data, TargetStruct.size)
+    (target_ids, _end) = unpack_monster_ids(data, end)
+    return TargetCommand(TargetFlags(flags), monster_ids, target_ids)
+
+def decode_attack_location(data):
+    (flags, x, y, z) = AttackLocationStruct.unpack_from(data)
+    (monster_ids, _end) = unpack_monster_ids(data, AttackLocationStruct.size)
+    return AttackLocationCommand(AttackLocationFlags(flags), x, y, z, monster_ids)
+
+def decode_pick_up(data):
+    (flags, object_index, object_identifier) = PickUpStruct.unpack_from(data)
+    (monster_ids, _end) = unpack_monster_ids(data, PickUpStruct.size)
+    return PickUpCommand(flags, object_index, object_identifier, monster_ids)
+
+def decode_rotation(data):
+    return RotationCommand(bytes(data))
+
+def decode_chat(data):
+    (flags,) = ChatStruct.unpack_from(data)
+    return ChatCommand(flags, codec.decode_string(bytes(data[ChatStruct.size:])))
+
+def decode_detach(data):
+    (flags, player_index, monster_count) = DetachStruct.unpack_from(data)
+    monster_ids = struct.unpack_from(f'>{monster_count}h', data, DetachStruct.size)
+    return DetachCommand(flags, player_index, monster_ids)
+
+def decode_unit_adjustment(data):
+    (flags, unit_count) = UnitAdjustmentStruct.unpack_from(data)
+    unit_counts = struct.unpack_from(f'>{unit_count}h', data, UnitAdjustmentStruct.size)
+    return UnitAdjustmentCommand(flags, unit_counts)
+
+def decode_raw(data):
+    return RawCommand(bytes(data))
+
+CommandDecoders = {
+    Commands.GENERAL: decode_general,
+    Commands.MOVEMENT: decode_movement,
+    Commands.TARGET: decode_target,
+    Commands.ATTACK_LOCATION: decode_attack_location,
+    Commands.PICK_UP: decode_pick_up,
+    Commands.ROTATION: decode_rotation,
+    Commands.CHAT: decode_chat,
+    Commands.DETACH: decode_detach,
+    Commands.UNIT_ADJUSTMENT: decode_unit_adjustment,
+}
+
+# Extra consumers of decoded commands, called from parse_timeline
+# handler(command_header, command, player_id)
+CommandHandlers = defaultdict(list)
+
+def decode_command(verb, data):
+    return CommandDecoders.get(verb, decode_raw)(data)
+
+def register_command_decoder(verb, decoder):
+    CommandDecoders[verb] = decoder
+
+def register_command_handler(verb, handler):
+    """Register handler for a verb, or for every command if verb is None"""
+    CommandHandlers[verb].append(handler)
+
 BAGRADA_MATCH = r'bagrada\d{4,4}_\d{2,2}_\d{2,2}__\d{2,2}_\d{2,2}_\d{2,2}_\d{2,3}.m2rec'
 
 def fetch_bagrada_stats(file_path):
@@ -294,10 +419,14 @@ def print_metaserver_info(teams_idx, teams, players, game_stats):
         print('\n---\n')
 
 def parse_reco_head(game_directory, reco_file, head_only=False):
-    length = (myth_headers.TAG_HEADER_SIZE + HEADER_SIZE) if head_only else None
+    length = HEAD_READ_SIZE if head_only else None
     data = utils.load_file(reco_file, length)
+    return parse_reco_head_data(data)
+
+def parse_reco_head_data(data):
     header = myth_headers.parse_header(data)
-    reco_data = data[myth_headers.TAG_HEADER_SIZE:]
+    # Zero copy view, commands are read from it with explicit offsets
+    reco_data = memoryview(data)[myth_headers.TAG_HEADER_SIZE:]
 
     if DEBUG:
         print(header)
@@ -309,26 +438,8 @@ def parse_reco_head(game_directory, reco_file, head_only=False):
     # NewGameDataFmt
     # SaveGameHeader
 
-    offset = 0
-    reco = codec.codec(RecoHeaderFmt)(reco_data)
-
-    if DEBUG:
-        print(f'# {reco._name} [{offset}]')
-        for i, (f, val) in enumerate(reco._asdict().items()):
-            print(f'{f:<42} {utils.val_repr(val)}')
-
-    offset += reco.data_size()
-    game_param = game_headers.parse_params(reco_data[offset:])
-    game_param = game_param._replace(
-        plugin_data=pref2info.parse_pref_plugins(game_param.plugin_data, game_param.plugin_count)
-    )
-
-    if DEBUG:
-        print(f'\n# {game_param._name} [{offset}]')
-        for i, (f, val) in enumerate(game_param._asdict().items()):
-            print(f'{f:<42} {utils.val_repr(val)}')
-
-    offset += game_param.data_size()
+    (reco, game_param) = parse_reco_params(reco_data)
+    offset = reco.data_size() + game_param.data_size()
     game_data = game_headers.parse_data(reco_data[offset:])
     game_data = game_data._replace_raw(
         players=game_data.players[:game_data.player_count]
@@ -357,7 +468,33 @@ def parse_reco_head(game_directory, reco_file, head_only=False):
 
     return (header, reco_data, reco, game_param, game_data, save_game)
 
-def parse_reco_file(game_directory, reco_file):
+def parse_reco_params(reco_data):
+    """
+    Parse just the RecoHeader and NewGameParamData blocks, enough to find
+    the scenario and plugins without touching players or the save header
+    """
+    offset = 0
+    reco = codec.codec(RecoHeaderFmt)(reco_data)
+
+    if DEBUG:
+        print(f'# {reco._name} [{offset}]')
+        for i, (f, val) in enumerate(reco._asdict().items()):
+            print(f'{f:<42} {utils.val_repr(val)}')
+
+    offset += reco.data_size()
+    game_param = game_headers.parse_params(reco_data[offset:])
+    game_param = game_param._replace(
+        plugin_data=pref2info.parse_pref_plugins(game_param.plugin_data, game_param.plugin_count)
+    )
+
+    if DEBUG:
+        print(f'\n# {game_param._name} [{offset}]')
+        for i, (f, val) in enumerate(game_param._asdict().items()):
+            print(f'{f:<42} {utils.val_repr(val)}')
+
+    return (reco, game_param)
+
+def parse_reco_file(game_directory, reco_file, start_minute=None, end_minute=None):
     (header, reco_data, reco, game_param, game_data, save_game) = parse_reco_head(game_directory, reco_file)
 
     plugin_names = [codec.decode_string(p[0]) for p in game_param.plugin_data]
@@ -370,11 +507,114 @@ def parse_reco_file(game_directory, reco_file):
 
     metaserver_stats = fetch_bagrada_stats(reco_file)
 
+    # Optional window of game time, in minutes after planning
+    start_time = None
+    end_time = None
+    seek_index = None
+    if start_minute is not None:
+        start_time = ticks(start_minute, game_param)
+        seek_index = load_seek_index(reco_file, reco, reco_data)
+    if end_minute is not None:
+        end_time = ticks(end_minute, game_param)
+
     return parse_timeline(
         header, tags, data_map, game_data,
-        game_param, reco, reco_data, metaserver_stats
+        game_param, reco, reco_data, metaserver_stats,
+        start_time, end_time, seek_index
     )
 
+def seek_index_path(reco_file):
+    name = hashlib.sha1(str(pathlib.Path(reco_file).resolve()).encode('utf-8')).hexdigest()
+    return pathlib.Path(sys.path[0], SEEK_DIR, f'{name}.json').resolve()
+
+def load_seek_index(reco_file, reco, reco_data):
+    """
+    Load the seek index for a film from the cache, building it if it's
+    missing or the film has changed since it was built
+    """
+    stat = os.stat(reco_file)
+    path = seek_index_path(reco_file)
+    try:
+        with open(path, 'r') as seek_file:
+            seek_index = json.load(seek_file)
+        if (
+            seek_index['version'] == SEEK_VERSION
+            and seek_index['size'] == stat.st_size
+            and seek_index['mtime_ns'] == stat.st_mtime_ns
+        ):
+            return seek_index
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        pass
+
+    seek_index = {
+        'version': SEEK_VERSION,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+    } | build_seek_index(reco, reco_data)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as seek_file:
+        json.dump(seek_index, seek_file)
+    return seek_index
+
+@tracing.traced()
+def build_seek_index(reco, reco_data):
+    """
+    Walk the recording blocks once and record:
+    entries: (time, block_offset, state_count) every SEEK_INTERVAL ticks
+             where time is the first command time in that block
+    state: every command that changes split/trade state, in order.
+           The first state_count of these are replayed to restore the
+           state at an entry
+    """
+    block_header_codec = codec.codec(RecordingBlockHeaderFmt)
+    command_header_codec = codec.codec(CommandHeaderFmt)
+    entries = []
+    state = []
+    next_time = 0
+    block_offset = reco.data_offset
+    while block_offset < len(reco_data):
+        block_header = block_header_codec(reco_data, offset=block_offset)
+        commands_start = block_offset + block_header.data_size()
+        command_offset = commands_start
+        for command_i in range(block_header.command_count):
+            command_header = command_header_codec(reco_data, offset=command_offset)
+            if command_i == 0 and command_header.time >= next_time:
+                entries.append((command_header.time, block_offset, len(state)))
+                next_time = command_header.time + SEEK_INTERVAL
+            if command_header.verb in STATE_COMMANDS:
+                command_data = reco_data[command_offset + command_header.data_size():command_offset + command_header.size]
+                state.append((
+                    command_header.time, command_header.verb.value,
+                    command_header.player_index, command_data.hex()
+                ))
+            command_offset += command_header.size
+        block_offset = commands_start + block_header.size
+    return {'entries': entries, 'state': state}
+
+def seek(seek_index, start_time):
+    """
+    Find the last entry at or before start_time.
+    Returns the block offset to resume from and the state commands to
+    replay before resuming
+    """
+    entry = None
+    for candidate in seek_index['entries']:
+        if candidate[0] > start_time:
+            break
+        entry = candidate
+    if not entry:
+        return (None, None, [])
+    (entry_time, block_offset, state_count) = entry
+    state_commands = [
+        (command_time, Commands(verb), player_index, bytes.fromhex(command_data))
+        for (command_time, verb, player_index, command_data) in seek_index['state'][:state_count]
+    ]
+    return (entry_time, block_offset, state_commands)
+
+def ticks(minutes, game_param):
+    """Convert minutes of game time (after planning) to recording ticks"""
+    return game_param.pregame_time_limit + round(minutes * 60 * 30)
+
 def parse_mons_initializers(tags, data_map, reco, reco_data):
     mons_start = reco.monster_initializers_offset
     mons_end = mons_start + reco.monster_initializers_length
@@ -383,11 +623,11 @@ def parse_mons_initializers(tags, data_map, reco, reco_data):
     monster_initializers = codec.list_codec(None, MonsterInitializerFmt)(reco_data[mons_start:mons_end])
     for i, mons_init in enumerate(monster_initializers):
         (mons_loc, mons_header, mons_data) = loadtags.get_tag_info(
-            tags, data_map, 'mons', codec.decode_string(mons_init.monster_tag)
+            tags, data_map, 'mons', mons_init.monster_tag
         )
 
         (unit_loc, unit_header, unit_data) = loadtags.get_tag_info(
-            tags, data_map, 'unit', codec.decode_string(mons_init.unit_tag)
+            tags, data_map, 'unit', mons_init.unit_tag
         )
         print(
             f'{i:>2} [{mons_init.experience}] '
@@ -681,13 +921,15 @@ def init_cmd_counters():
         'overall': 0,
     }
 
+@tracing.traced()
 def parse_timeline(
     reco_header, tags, data_map, game_data,
-    game_param, reco, reco_data, metaserver_stats
+    game_param, reco, reco_data, metaserver_stats,
+    start_time=None, end_time=None, seek_index=None
 ):
     # Get mesh tag data
     (mesh_tag_location, mesh_tag_header, mesh_tag_data) = loadtags.get_tag_info(
-        tags, data_map, 'mesh', codec.decode_string(game_param.scenario_tag)
+        tags, data_map, 'mesh', game_param.scenario_tag
     )
     try:
         mesh_header = mesh_tag.parse_header(mesh_tag_data)
@@ -700,9 +942,7 @@ def parse_timeline(
     level_name = mesh_tag.get_level_name(mesh_header, tags, data_map)
 
     overhead_map_data = loadtags.get_tag_data(
-        tags, data_map, '.256', codec.decode_string(
-            mesh_header.overhead_map_collection_tag
-        )
+        tags, data_map, '.256', mesh_header.overhead_map_collection_tag
     )
 
     (ambients, ambient_monsters) = get_ambients(tags, data_map, palette)
@@ -808,21 +1048,44 @@ def parse_timeline(
         print_trades(teams_idx, trades)
 
     prev_command_time = None
+    if start_time is not None and seek_index:
+        # Jump to the closest block before start_time and restore unit ownership
+        (entry_time, entry_offset, state_commands) = seek(seek_index, start_time)
+        if entry_offset is not None:
+            for (command_time, verb, player_index, command_data) in state_commands:
+                (player_id, player_idx) = command_player(player_index, game_param, players_idx)
+                apply_state_command(
+                    tags, data_map, palette, mesh_header,
+                    level_name, game_param, game_type_choice, game_time,
+                    players, players_idx, monsters, trades,
+                    players.get(player_id), decode_command(verb, command_data)
+                )
+            block_offset = entry_offset
+            prev_command_time = entry_time
+            if entry_time > splits_time(game_param):
+                splits = get_splits(monsters, trades)
+
+    window_ended = False
     while block_offset < len(reco_data):
-        block_header = block_header_codec(reco_data[block_offset:])
+        block_start = tracing.now()
+        block_header = block_header_codec(reco_data, offset=block_offset)
         if DEBUG_CMDS:
             print(block_header)
 
         commands_start = block_offset + block_header.data_size()
         commands_end = commands_start + block_header.size
-        commands_data = reco_data[commands_start:commands_end]
 
-        command_offset = 0
+        command_offset = commands_start
         for command_i in range(block_header.command_count):
-            command_header = command_header_codec(commands_data[command_offset:])
+            command_header = command_header_codec(reco_data, offset=command_offset)
             command_data_start = command_offset + command_header.data_size()
             command_data_end = command_offset + command_header.size
-            command_data = commands_data[command_data_start:command_data_end]
+            command_data = reco_data[command_data_start:command_data_end]
+
+            if end_time is not None and command_header.time >= end_time:
+                window_ended = True
+                break
+            in_window = start_time is None or command_header.time >= start_time
 
             (pt, remaining) = time_vars(command_header.time, game_param)
 
@@ -830,124 +1093,75 @@ def parse_timeline(
                 print(command_i, tick_to_time(pt, remaining), command_header.time, prev_command_time, planning_ticks)
 
             player = None
-            # This changed after 1.8.4
-            if game_param.version <= 2184:
-                player_idx = command_header.player_index
-                player_id = players_idx[player_idx]
-            else:
-                player_id = command_header.player_index
-                player_idx = players_idx.index(player_id) if player_id in players_idx else None
+            (player_id, player_idx) = command_player(command_header.player_index, game_param, players_idx)
 
             if player_id in players:
                 player = players[player_id]
                 if DEBUG_CMDS:
                     print(f'- player_id={player_id} (idx={player_idx}) team={player.team_index}')
-            if command_header.verb == Commands.UNIT_ADJUSTMENT:
-                (unit_adjust_flags, unit_count) = struct.unpack('>h h', command_data[:4])
-                unit_counts = codec.list_pack('unit_counts', unit_count, '>h')(command_data[4:])
-                (trade_info, units, team_markers) = get_trades(
+            verb = command_header.verb
+            if verb in STATE_COMMANDS:
+                # Always applied, even before the window, to track unit ownership
+                command = decode_command(verb, command_data)
+                apply_state_command(
                     tags, data_map, palette, mesh_header,
                     level_name, game_param, game_type_choice, game_time,
-                    unit_counts, players_idx, player
+                    players, players_idx, monsters, trades,
+                    player, command, tick_to_time(pt, command_header.time)
                 )
-                monsters[player.team_index] = team_markers
-                trades[player.team_index] = (trade_info, units)
-                if DEBUG:
-                    print('trades', player.team_index, units.keys())
-                if DEBUG_CMDS:
-                    print(
-                        f'{tick_to_time(pt, command_header.time)}: '
-                        f'[player={player.unique_identifier:<2} team_index={player.team_index}] '
-                        f'Adjust Units={unit_counts} '
-                        f'{player_name(player)}'
-                    )
-                    ((diffs, trade), units) = trades[player.team_index]
-                    print('\n'.join(trade))
-
-            elif command_header.verb == Commands.DETACH:
-                (detach_flags, player_index, monster_count) = struct.unpack('>h h h', command_data[:6])
-                monster_ids = codec.list_pack('monster_ids', monster_count, '>h')(command_data[6:])
-                detached = []
-                if DEBUG_CMDS:
-                    print(
-                        f'from_id={player_id} '
-                        f'to_idx={player_index} to_id={players_idx[player_index]} '
-                        f'team_index={player.team_index} '
-                        f'monster_teams={list(monsters.keys())} '
-                        f'players_idx={players_idx} ({len(players_idx)})'
-                    )
-                    print('team_monsters', list(monsters[player.team_index].keys()))
-                for monster_id in monster_ids:
-                    if monster_id in monsters[player.team_index]:
-                        monsters[player.team_index][monster_id]['player_id'] = players_idx[player_index]
-                        monsters[player.team_index][monster_id]['player_index'] = player_index
-                        detached.append(str(monsters[player.team_index][monster_id]['tag']))
-                    else:
-                        print(f'! {monster_id} missing from team {player.team_index} monsters')
-                if DEBUG_CMDS:
-                    to_player = player_name(players[players_idx[player_index]])
-                    print(
-                        f'{tick_to_time(pt, command_header.time)}: '
-                        f'[player={player.unique_identifier:<2} team_index={player.team_index}] '
-                        f'DETACH {player_name(player)} '
-                        f'-> {to_player}[{player_index}] id={players_idx[player_index]} ' 
-                        f'{dict(Counter(detached)), monster_ids}'
-                    )
-                # TODO log_command
-
-            elif command_header.verb == Commands.CHAT:
-                (chat_flags,) = struct.unpack('>h', command_data[:2])
-                chat_message = codec.decode_string(command_data[2:])
-                chat_lines.append((pt, command_header.time, player, chat_flags, chat_message))
-
-                counters['chat']['player'][player_id] += 1
-                counters['chat']['team'][player.team_index] += 1
-                counters['chat']['overall'] += 1
-                if DEBUG_CMDS:
-                    print(
-                        f'{tick_to_time(pt, command_header.time)}: '
-                        f'{chat_message}'
-                    )
-
-            elif command_header.verb in [
-                Commands.MOVEMENT,
-                Commands.GENERAL,
-                Commands.TARGET,
-                Commands.PICK_UP,
-                Commands.ATTACK_LOCATION,
-                Commands.ROTATION,
-            ]:  
-                if DEBUG_CMDS:
-                    print(
-                        f'{tick_to_time(pt, command_header.time)}: '
-                        f'{command_header.verb} '
-                    )
-                if command_header.time > planning_ticks:
-                    cmd = log_command(
-                        players, player_id, monsters, computer_markers, computer_monsters, trades,
-                        command_header, command_data, self_heal_kill_dmg, planning_ticks
-                    )
-                    if cmd:
-                        if cmd.get('self_heal_kill'):
-                            validate_self_heal_kill_dmg(self_heal_kill_dmg, players_idx, monsters, trades)
-                        game_stats['commands'].append(cmd)
-
-                    if player:
-                        # init team and player indexes
-                        counters['command']['player'][player_id] += 1
-                        counters['command']['team'][player.team_index] += 1
-                        counters['command']['overall'] += 1
-                        if is_engagement(cmd):
-                            counters['engage']['player'][player_id] += 1
-                            counters['engage']['team'][player.team_index] += 1
-                            counters['engage']['overall'] += 1
-
+            elif in_window:
+                command = decode_command(verb, command_data)
             else:
-                if DEBUG_CMDS:
-                    print(
-                        f'{tick_to_time(pt, command_header.time)}: '
-                        f'{command_header.verb} {command_data.hex()}'
-                    )
+                command = None
+
+            if in_window:
+                if verb == Commands.CHAT:
+                    chat_lines.append((pt, command_header.time, player, command.flags, command.message))
+
+                    counters['chat']['player'][player_id] += 1
+                    counters['chat']['team'][player.team_index] += 1
+                    counters['chat']['overall'] += 1
+                    if DEBUG_CMDS:
+                        print(
+                            f'{tick_to_time(pt, command_header.time)}: '
+                            f'{command.message}'
+                        )
+
+                elif verb in MONSTER_COMMANDS:
+                    if DEBUG_CMDS:
+                        print(
+                            f'{tick_to_time(pt, command_header.time)}: '
+                            f'{verb} '
+                        )
+                    if command_header.time > planning_ticks:
+                        cmd = log_command(
+                            players, player_id, monsters, computer_markers, computer_monsters, trades,
+                            command_header, command, self_heal_kill_dmg, planning_ticks
+                        )
+                        if cmd:
+                            if cmd.get('self_heal_kill'):
+                                validate_self_heal_kill_dmg(self_heal_kill_dmg, players_idx, monsters, trades)
+                            game_stats['commands'].append(cmd)
+
+                        if player:
+                            # init team and player indexes
+                            counters['command']['player'][player_id] += 1
+                            counters['command']['team'][player.team_index] += 1
+                            counters['command']['overall'] += 1
+                            if is_engagement(cmd):
+                                counters['engage']['player'][player_id] += 1
+                                counters['engage']['team'][player.team_index] += 1
+                                counters['engage']['overall'] += 1
+
+                elif verb not in STATE_COMMANDS:
+                    if DEBUG_CMDS:
+                        print(
+                            f'{tick_to_time(pt, command_header.time)}: '
+                            f'{verb} {command_data.hex()}'
+                        )
+
+                for handler in CommandHandlers.get(verb, []) + CommandHandlers.get(None, []):
+                    handler(command_header, command, player_id)
 
             if pt_over(prev_command_time, command_header.time, game_param):
                 splits = get_splits(monsters, trades)
@@ -957,6 +1171,14 @@ def parse_timeline(
             prev_command_time = command_header.time
             command_offset = command_data_end
 
+        if tracing.ENABLED:
+            tracing.record('reco_tag.block', block_start, commands=block_header.command_count)
+            tracing.count('reco_tag.blocks')
+            tracing.count('reco_tag.commands', block_header.command_count)
+
+        if window_ended:
+            break
+
         block_offset = commands_end
         if DEBUG_CMDS:
             print('block_offset', block_offset)
@@ -972,6 +1194,74 @@ def parse_timeline(
         overhead_map_data, chat_lines, trades, splits, game_stats
     )
 
+def command_player(player_index, game_param, players_idx):
+    # This changed after 1.8.4
+    if game_param.version <= 2184:
+        player_idx = player_index
+        player_id = players_idx[player_idx]
+    else:
+        player_id = player_index
+        player_idx = players_idx.index(player_id) if player_id in players_idx else None
+    return (player_id, player_idx)
+
+def apply_state_command(
+    tags, data_map, palette, mesh_header,
+    level_name, game_param, game_type_choice, game_time,
+    players, players_idx, monsters, trades,
+    player, command, debug_time=''
+):
+    if isinstance(command, UnitAdjustmentCommand):
+        unit_counts = command.unit_counts
+        (trade_info, units, team_markers) = get_trades(
+            tags, data_map, palette, mesh_header,
+            level_name, game_param, game_type_choice, game_time,
+            unit_counts, players_idx, player
+        )
+        monsters[player.team_index] = team_markers
+        trades[player.team_index] = (trade_info, units)
+        if DEBUG:
+            print('trades', player.team_index, units.keys())
+        if DEBUG_CMDS:
+            print(
+                f'{debug_time}: '
+                f'[player={player.unique_identifier:<2} team_index={player.team_index}] '
+                f'Adjust Units={unit_counts} '
+                f'{player_name(player)}'
+            )
+            ((diffs, trade), units) = trades[player.team_index]
+            print('\n'.join(trade))
+
+    elif isinstance(command, DetachCommand):
+        player_index = command.player_index
+        monster_ids = command.monster_ids
+        detached = []
+        if DEBUG_CMDS:
+            print(
+                f'from_id={player.unique_identifier} '
+                f'to_idx={player_index} to_id={players_idx[player_index]} '
+                f'team_index={player.team_index} '
+                f'monster_teams={list(monsters.keys())} '
+                f'players_idx={players_idx} ({len(players_idx)})'
+            )
+            print('team_monsters', list(monsters[player.team_index].keys()))
+        for monster_id in monster_ids:
+            if monster_id in monsters[player.team_index]:
+                monsters[player.team_index][monster_id]['player_id'] = players_idx[player_index]
+                monsters[player.team_index][monster_id]['player_index'] = player_index
+                detached.append(str(monsters[player.team_index][monster_id]['tag']))
+            else:
+                print(f'! {monster_id} missing from team {player.team_index} monsters')
+        if DEBUG_CMDS:
+            to_player = player_name(players[players_idx[player_index]])
+            print(
+                f'{debug_time}: '
+                f'[player={player.unique_identifier:<2} team_index={player.team_index}] '
+                f'DETACH {player_name(player)} '
+                f'-> {to_player}[{player_index}] id={players_idx[player_index]} ' 
+                f'{dict(Counter(detached)), monster_ids}'
+            )
+        # TODO log_command
+
 def validate_self_heal_kill_dmg(self_heal_kill_dmg, players_idx, monsters, trades):
     for player_id, self_heal_kill_dmg_pallette in self_heal_kill_dmg.items():
         palette_max_dmg_counter = Counter()
@@ -1192,11 +1482,8 @@ def process_counters(game_stats, players, counters, self_heal_kill_dmg):
             game_stats['header']['teams'][player.team_index]['players'][player_id]['medals'].append(medal_stat)
 
 
-def parse_command_monsters(data, monsters, computer_markers, player=None):
+def parse_command_monsters(monster_ids, monsters, computer_markers, player=None):
     command_monsters = {}
-    (monster_count,) = struct.unpack('>h', data[:2])
-    end = 2 + (monster_count * 2)
-    monster_ids = codec.list_pack('monster_ids', monster_count, '>h')(data[2:end])
     for monster_id in monster_ids:
         if monster_id < 0:
             # Happens for e.g. frenzied myrks
@@ -1213,7 +1500,7 @@ def parse_command_monsters(data, monsters, computer_markers, player=None):
                     command_monsters[tag_id] = 0
                 command_monsters[tag_id] += 1
             else:
-                print(f'! {monster_id} missing from team {player.team_index} monsters {data.hex()}')
+                print(f'! {monster_id} missing from team {player.team_index} monsters {monster_ids}')
                 if 'invalid' not in command_monsters:
                     command_monsters['invalid'] = []
                 command_monsters['invalid'].append(monster_id)
@@ -1238,16 +1525,16 @@ def parse_command_monsters(data, monsters, computer_markers, player=None):
                         command_monsters['ambient'][tag_id] = 0
                     command_monsters['ambient'][tag_id] += 1
                 else:
-                    print(f'! {monster_id} missing from all team monsters and computers {data.hex()}')
+                    print(f'! {monster_id} missing from all team monsters and computers {monster_ids}')
                     if 'invalid' not in command_monsters:
                         command_monsters['invalid'] = []
                     command_monsters['invalid'].append(monster_id)
 
-    return (command_monsters, end)
+    return command_monsters
 
 def log_command(
     players, player_id, monsters, computer_markers, computer_monsters, trades,
-    command_header, command_data, self_heal_kill_dmg, planning_ticks=0
+    command_header, command, self_heal_kill_dmg, planning_ticks=0
 ):
     player = players[player_id]
     action = command_header.verb.name
@@ -1256,33 +1543,27 @@ def log_command(
     target_monsters = {}
     match command_header.verb:
         case Commands.GENERAL:
-            (general_flags, general_type) = struct.unpack('>h h', command_data[:4])
-            action = GeneralCommands(general_type).name
+            action = GeneralCommands(command.general_type).name
             if action == 'TAUNT':
                 return
-            (command_monsters, _offset) = parse_command_monsters(command_data[4:], monsters, computer_markers, player)
+            command_monsters = parse_command_monsters(command.monster_ids, monsters, computer_markers, player)
         case Commands.TARGET:
-            (target_flags,) = struct.unpack('>h', command_data[:2])
-            target_flags = TargetFlags(target_flags)
-            if TargetFlags.SPECIAL_ABILITY in target_flags:
+            if TargetFlags.SPECIAL_ABILITY in command.flags:
                 action = 'ATTACK_SPECIAL'
-            # elif TargetFlags.ATTACK_INDIVIDUAL in target_flags:
+            # elif TargetFlags.ATTACK_INDIVIDUAL in command.flags:
             #     action = 'ATTACK_ONE'
             else:
                 action = 'ATTACK'
-            (command_monsters, offset) = parse_command_monsters(command_data[2:], monsters, computer_markers, player)
-            (target_monsters, _offset2) = parse_command_monsters(command_data[offset+2:], monsters, computer_markers)
+            command_monsters = parse_command_monsters(command.monster_ids, monsters, computer_markers, player)
+            target_monsters = parse_command_monsters(command.target_ids, monsters, computer_markers)
         case Commands.ATTACK_LOCATION:
-            (attack_location_flags, x, y, z) = struct.unpack('>h 2x L L L', command_data[:16])
-            attack_location_flags = AttackLocationFlags(attack_location_flags)
-            (command_monsters, _offset) = parse_command_monsters(command_data[16:], monsters, computer_markers, player)
-            if AttackLocationFlags.SPECIAL_ABILITY in attack_location_flags:
+            command_monsters = parse_command_monsters(command.monster_ids, monsters, computer_markers, player)
+            if AttackLocationFlags.SPECIAL_ABILITY in command.flags:
                 action = 'GROUND_SPECIAL'
             else:
                 action = 'GROUND'
         case Commands.PICK_UP:
-            (pickup_flags, object_idx, object_id) = struct.unpack('>h 2x H H', command_data[:8])
-            (command_monsters, _offset) = parse_command_monsters(command_data[8:], monsters, computer_markers, player)
+            command_monsters = parse_command_monsters(command.monster_ids, monsters, computer_markers, player)
         case Commands.ROTATION:
             action = 'MOVEMENT'
     if len(command_monsters):
@@ -1504,12 +1785,15 @@ def time_vars(command_time, game_param):
 
     return (pt, remaining)
 
+def splits_time(game_param):
+    # Add 2s, late adjusts can come in slightly after pt is over
+    # Add further 30s to account for late splits
+    return game_param.pregame_time_limit + 60 + 900
+
 def pt_over(prev_command_time, command_time, game_param):
     if not prev_command_time:
         return False
-    # Add 2s, late adjusts can come in slightly after pt is over
-    # Add further 30s to account for late splits
-    planning_ticks = game_param.pregame_time_limit + 60 + 900
+    planning_ticks = splits_time(game_param)
     return prev_command_time <= planning_ticks and command_time > planning_ticks
 
 def tick_to_time(pt, ticks):
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+import json
+import os
+import pathlib
+import struct
+import subprocess
+import sys
+from multiprocessing import resource_tracker, shared_memory
+
+import loadtags
+import tagserver
+
+DEBUG = (os.environ.get('DEBUG') == '1')
+
+# meta json size, tag list size. Archive data follows them
+SEGMENT_HEADER = struct.Struct('>IQ')
+
+# Segment name to (shared memory, load_tags result) in each attached process
+ATTACHED = {}
+
+def main(game_directory, plugin_names, command):
+    """
+    Load tags once into shared memory and run a command whose processes
+    use them from there instead of each loading their own copy
+    """
+    with publish(game_directory, plugin_names) as shared:
+        print(f'[sharedtags] Published {shared.size} bytes as {shared.name}', file=sys.stderr)
+        return subprocess.call(command)
+
+class SharedTagSet:
+    """
+    A load_tags() result copied into a shared memory segment. The segment
+    is removed when this is closed, processes still attached keep their
+    mapping until they exit
+    """
+    __slots__ = ('shm', 'name', 'size', 'previous_env')
+
+    def __init__(self, shm):
+        self.shm = shm
+        self.name = shm.name
+        self.size = shm.size
+        self.previous_env = os.environ.get('SHARED_TAGS')
+        os.environ['SHARED_TAGS'] = self.name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        if self.previous_env is None:
+            os.environ.pop('SHARED_TAGS', None)
+        else:
+            os.environ['SHARED_TAGS'] = self.previous_env
+        self.shm.close()
+        self.shm.unlink()
+
+def publish(game_directory, plugin_names=[]):
+    """
+    Load tags and copy the archive data and packed tag index into a shared
+    memory segment. SHARED_TAGS names it to processes started while it's
+    open, so their load_tags() attach to it rather than loading
+    """
+    plugin_names = [os.path.basename(p) for p in plugin_names]
+    (game_version, tags, entrypoint_map, data_map, _) = loadtags.load_tags(game_directory, plugin_names)
+    (meta, tag_lists) = tagserver.pack_tag_set(
+        game_version, entrypoint_map, tagserver.archive_tag_lists(tags, data_map)
+    )
+    meta['game_directory'] = str(pathlib.Path(game_directory).resolve())
+    meta['plugin_names'] = plugin_names
+    meta['env'] = tagserver.load_env()
+
+    data_offset = 0
+    for archive in meta['archives']:
+        archive['data_offset'] = data_offset
+        data_offset += archive['size']
+    meta_data = json.dumps(meta).encode('utf8')
+
+    data_start = SEGMENT_HEADER.size + len(meta_data) + len(tag_lists)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, data_start + data_offset))
+    try:
+        SEGMENT_HEADER.pack_into(shm.buf, 0, len(meta_data), len(tag_lists))
+        offset = SEGMENT_HEADER.size
+        for chunk in [meta_data, tag_lists]:
+            shm.buf[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+        for archive in meta['archives']:
+            start = data_start + archive['data_offset']
+            shm.buf[start:start + archive['size']] = data_map[archive['filename']][:]
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    return SharedTagSet(shm)
+
+def attach_segment(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13 every process that attached would also
+        # remove the segment when it exited
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix':
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+def attach(name):
+    """
+    The load_tags() result in a published segment, decoding its tag index
+    once per process. The archive data isn't copied until tags are read
+    """
+    if name not in ATTACHED:
+        shm = attach_segment(name)
+        (meta_size, tag_lists_size) = SEGMENT_HEADER.unpack_from(shm.buf, 0)
+        meta_start = SEGMENT_HEADER.size
+        meta = json.loads(bytes(shm.buf[meta_start:meta_start + meta_size]))
+        tag_lists_start = meta_start + meta_size
+        data_start = tag_lists_start + tag_lists_size
+        tag_lists = bytes(shm.buf[tag_lists_start:data_start])
+        (tags, entrypoint_map, data_map) = tagserver.unpack_tag_set(
+            meta, tag_lists,
+            lambda archive: SharedData(shm, data_start + archive['data_offset'], archive['size'])
+        )
+        ATTACHED[name] = (shm, meta, (meta['game_version'], tags, entrypoint_map, data_map))
+    return ATTACHED[name]
+
+def load_tags(name, game_directory, plugin_names):
+    """
+    load_tags() from a published segment. Returns None if it's gone or
+    holds different tags, so the caller can load them itself
+    """
+    try:
+        (_, meta, (game_version, tags, entrypoint_map, data_map)) = attach(name)
+    except FileNotFoundError:
+        print(f'[sharedtags] {name} not found, loading tags locally', file=sys.stderr)
+        return None
+    if (
+        meta['game_directory'] != str(pathlib.Path(game_directory).resolve())
+        or meta['plugin_names'] != plugin_names
+        or meta['env'] != tagserver.load_env()
+    ):
+        if DEBUG:
+            print(f'[sharedtags] {name} holds other tags, loading tags locally', file=sys.stderr)
+        return None
+    cutscenes = loadtags.find_cutscenes(game_directory)
+    return (game_version, tags, entrypoint_map, data_map, cutscenes)
+
+class SharedData(loadtags.SlicedData):
+    """Archive data in a shared memory segment, copied out on read"""
+    __slots__ = ('shm', 'start')
+
+    def __init__(self, shm, start, size):
+        self.shm = shm
+        self.start = start
+        self.size = size
+
+    def read(self, start, end):
+        return bytes(self.shm.buf[self.start + start:self.start + end])
+
+if __name__ == "__main__":
+    if '--' not in sys.argv[2:] or sys.argv.index('--') == len(sys.argv) - 1:
+        print(f"Usage: python3 {sys.argv[0]} <game_directory> [<plugin_names> ...] -- <command> [<args> ...]")
+        sys.exit(1)
+
+    separator = sys.argv.index('--')
+    game_directory = sys.argv[1]
+    plugin_names = sys.argv[2:separator]
+    command = sys.argv[separator + 1:]
+
+    try:
+        sys.exit(main(game_directory, plugin_names, command))
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except BrokenPipeError:
+        sys.stdout = None
+        sys.exit(1)
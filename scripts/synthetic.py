@@ -0,0 +1,906 @@
+#!/usr/bin/env python3
+import os
+import pathlib
+import random
+import struct
+import sys
+from collections import OrderedDict
+
+import codec
+import game_headers
+import mesh_tag
+import mons_tag
+import myth_collection
+import myth_headers
+import myth_projectile
+import myth_sound
+import myth_tags
+import player_headers
+import reco_tag
+
+DEBUG = (os.environ.get('DEBUG') == '1')
+
+OUTPUT_DIR = '../output/synthetic'
+
+# Corpus sizes, all can be overridden with key=value arguments
+DEFAULTS = OrderedDict({
+    'seed': 1,
+    'plugins': 2, # SB plugin archives, each with meshes and entrypoints
+    'tfl_archives': 1, # TFL .gor archives (written outside tags/ so they aren't loaded)
+    'tags': 300, # filler tags per archive
+    'tag_size': 4096, # average filler tag size in bytes
+    'collections': 6, # .256 collections per archive
+    'bitmaps': 12, # bitmaps per collection, cycling through encodings
+    'bitmap_size': 64, # bitmap width and height
+    'sounds': 6, # soun tags per archive
+    'permutations': 3, # permutations per soun tag
+    'sound_frames': 2000, # IMA4 frames per permutation
+    'meshes': 3, # meshes per plugin
+    'markers': 400, # markers per mesh
+    'actions': 150, # map actions per mesh
+    'films': 4,
+    'commands': 20000, # commands per film
+    'players': 8, # players per film
+})
+
+# Bitmap encodings cycled through for each collection
+ENCODINGS = ['raw', 'compressed', 'compressed_4bit', 'r8g8b8a5h', 'argb8888']
+
+NULL_TAG = b'\xff\xff\xff\xff'
+ID_CHARS = '0123456789abcdefghijklmnopqrstuvwxyz'
+WORDS = [
+    'the', 'fallen', 'lords', 'soulblighter', 'legion', 'warrior', 'archer', 'dwarf',
+    'journeyman', 'berserk', 'ghol', 'thrall', 'myrkridia', 'trow', 'wight', 'forest',
+    'giant', 'balor', 'cloudspine', 'muirthemne', 'rainy', 'river', 'bridge', 'village',
+    'heron', 'guard', 'bandit', 'satchel', 'charge', 'flag', 'hill', 'ball', 'dagger',
+]
+TEXT_TAG_TYPES = ['stli', 'text', 'temp']
+BINARY_TAG_TYPES = ['obje', 'proj', 'prgr', 'phys', 'lpgr', 'unit', 'mons', 'core', 'amso', 'meli', 'wind', 'arti']
+
+def main(output_dir, args):
+    """
+    Generate a deterministic synthetic game directory (archives, tags and
+    films) for scale and performance testing
+    """
+    sizes = parse_sizes(args)
+    if not output_dir:
+        output_dir = pathlib.Path(sys.path[0], OUTPUT_DIR).resolve()
+    manifest = generate(output_dir, **sizes)
+    for kind, paths in manifest.items():
+        total = sum(os.path.getsize(p) for p in paths)
+        print(f'{kind:<8} files={len(paths):<4} size={total}')
+    print(f'Corpus written to {output_dir}')
+
+def parse_sizes(args):
+    sizes = {}
+    for arg in args:
+        (key, _, value) = arg.partition('=')
+        if key not in DEFAULTS:
+            print(f'Unknown size: {key} (expected one of {", ".join(DEFAULTS)})')
+            sys.exit(1)
+        sizes[key] = int(value)
+    return sizes
+
+def rng_for(seed, name):
+    """Independent generator per item so sizes can change without reshuffling everything else"""
+    return random.Random(f'{seed}:{name}')
+
+def make_tag_id(prefix, i):
+    """4 character tag id, 1 char prefix then base 36 index"""
+    digits = ''
+    for _ in range(3):
+        (i, d) = divmod(i, len(ID_CHARS))
+        digits = ID_CHARS[d] + digits
+    return f'{prefix}{digits}'
+
+def default_value(field_fmt):
+    if field_fmt.endswith('s'):
+        return b''
+    elif field_fmt.endswith(('f', 'd')):
+        return 0.0
+    return 0
+
+def pack(fmt, **values):
+    """Pack a *Fmt definition from raw values. Unset fields are zero/empty"""
+    raw = []
+    for field in fmt[1]:
+        if field[1]:
+            raw.append(values.get(field[1], default_value(field[0])))
+    return struct.pack(codec.codec(fmt)._fmt_string, *raw)
+
+def null_tags(fmt):
+    """All 4 byte tag reference fields set to none"""
+    return {field[1]: NULL_TAG for field in fmt[1] if field[0] == '4s' and field[1]}
+
+def make_tag(tag_type, tag_id, name, payload, game_version=2):
+    """
+    A standalone tag file. Built as a TFL tag and converted with
+    myth_headers.tfl2sb for Myth II
+    """
+    tfl_header = myth_headers.TFLHeader(pack(
+        myth_headers.TFLHeaderFmt,
+        name=codec.encode_string(name),
+        tag_type=codec.encode_string(tag_type),
+        tag_id=codec.encode_string(tag_id),
+        version=1,
+        tag_data_offset=myth_headers.TAG_HEADER_SIZE,
+        tag_data_size=len(payload),
+        signature=b'myth',
+    ))
+    if game_version == 1:
+        return tfl_header.value + payload
+    return myth_headers.tfl2sb(tfl_header, payload)
+
+def sb_archive(name, tags, archive_type=myth_headers.ArchiveType.FOUNDATION, version=0, entrypoints=()):
+    """
+    Myth II monolith: header, entrypoint list, tag list, then tag data
+    entrypoints: [(entry_id, entry_name, entry_long_name)]
+    """
+    entry_data = b''.join(
+        struct.pack('>16s 32s 64s', *[codec.encode_string(e) for e in entry])
+        for entry in entrypoints
+    )
+    tag_list_start = myth_headers.SB_MONO_HEADER_SIZE + len(entry_data)
+    offset = tag_list_start + len(tags) * myth_headers.TAG_HEADER_SIZE
+
+    tag_list = b''
+    tag_data = b''
+    for tag in tags:
+        header = myth_headers.SBHeader(tag)._replace(tag_data_offset=offset)
+        tag_list += header.value
+        tag_data += tag[myth_headers.TAG_HEADER_SIZE:]
+        offset += len(tag) - myth_headers.TAG_HEADER_SIZE
+
+    mono_header = pack(
+        myth_headers.SBMonoHeaderFmt,
+        type=archive_type.value,
+        version=version,
+        name=codec.encode_string(name),
+        description=codec.encode_string(f'Synthetic {archive_type.name.lower()}'),
+        entry_tag_count=len(entrypoints),
+        tag_list_count=len(tags),
+        checksum=struct.pack('>L', sum(len(t) for t in tags) & 0xffffffff),
+        size=offset,
+        signature=b'dng2',
+    )
+    return mono_header + entry_data + tag_list + tag_data
+
+def tfl_archive(name, tags):
+    """Myth TFL .gor: header, tag data, then the tag list"""
+    offset = myth_headers.GOR_HEADER_SIZE
+    tag_list = b''
+    tag_data = b''
+    for tag in tags:
+        header = myth_headers.TFLHeader(tag)._replace(tag_data_offset=offset)
+        tag_list += header.value
+        tag_data += tag[myth_headers.TAG_HEADER_SIZE:]
+        offset += len(tag) - myth_headers.TAG_HEADER_SIZE
+
+    gor_header = pack(
+        myth_headers.GORHeaderFmt,
+        type=1,
+        version=1,
+        name=codec.encode_string(name),
+        tag_list_offset=offset,
+        tag_list_count=len(tags),
+        header_size=myth_headers.GOR_HEADER_SIZE,
+    )
+    return gor_header + tag_data + tag_list
+
+def text_payload(rng, lines, words_per_line=8):
+    text = '\r'.join(
+        f'|b{rng.choice(WORDS).title()}|p ' + ' '.join(rng.choices(WORDS, k=words_per_line))
+        for _ in range(lines)
+    )
+    return codec.encode_string(text) + b'\0'
+
+def filler_payload(rng, tag_type, size):
+    if tag_type in TEXT_TAG_TYPES:
+        return text_payload(rng, max(1, size // 64))
+    # Low entropy so it compresses something like real tag data
+    return bytes(rng.choices(range(16), k=size))
+
+# Bitmaps
+
+def sprite_pixels(rng, size):
+    """
+    Round sprite on a transparent background with a soft edge.
+    Rows of (r, g, b, alpha) with alpha 0-255
+    """
+    center = (size - 1) / 2
+    radius = size * rng.uniform(0.3, 0.45)
+    base = (rng.randrange(256), rng.randrange(256), rng.randrange(256))
+    rows = []
+    for y in range(size):
+        row = []
+        for x in range(size):
+            distance = ((x - center) ** 2 + (y - center) ** 2) ** 0.5
+            if distance > radius + 2:
+                alpha = 0
+            elif distance > radius:
+                alpha = round(255 * (radius + 2 - distance) / 2)
+            else:
+                alpha = 255
+            shade = (x + y) % 32
+            row.append(((base[0] + shade) % 256, (base[1] + shade) % 256, (base[2] + shade) % 256, alpha))
+        rows.append(row)
+    return rows
+
+def color_index(pixel):
+    (r, g, b, alpha) = pixel
+    # Index 0 is transparent in indexed bitmaps
+    return 1 + (r + g + b) % 255
+
+def encode_raw(rows, size):
+    return b''.join(bytes(color_index(p) if p[3] else 0 for p in row) for row in rows)
+
+def encode_compressed(rows, size, alpha_4bit):
+    data = b''
+    for row in rows:
+        spans = []
+        pixels = b''
+        x = 0
+        while x < size:
+            if row[x][3]:
+                start = x
+                while x < size and row[x][3]:
+                    if alpha_4bit:
+                        # Inverse of myth_collection.decode_alpha
+                        pixels += bytes([15 - round(row[x][3] / 17), color_index(row[x])])
+                    else:
+                        pixels += bytes([color_index(row[x])])
+                    x += 1
+                spans.append((start, x))
+            else:
+                x += 1
+        data += struct.pack(f'>H H {len(spans) * 2}H', len(spans), sum(e - s for (s, e) in spans), *[v for span in spans for v in span])
+        data += pixels
+    return data
+
+def encode_r8g8b8a5h(rng, rows):
+    """
+    Inverse of myth_collection.decode_bitmap_64. Fully transparent and
+    opaque pixels are run length encoded, anything else is written with
+    its own alpha byte. Odd blue values carry a second colour layer
+    """
+    pixels = [p for row in rows for p in row]
+
+    def pixel_data(pixel):
+        (r, g, b, alpha) = pixel
+        if rng.random() < 0.1:
+            return bytes([b | 1, g, r, b, g, r, myth_collection.a5h3pixel(rng.randrange(32), 0)])
+        return bytes([b & 0xfe, g, r])
+
+    def a5(pixel):
+        return round(pixel[3] * myth_collection.A5H3PIXEL_A_MASK / 255)
+
+    data = bytearray()
+    state = 0
+    i = 0
+    while i < len(pixels):
+        if myth_collection.is_transparent_or_opaque(state):
+            run = 0
+            while i + run < len(pixels) and run < 255 and a5(pixels[i + run]) == myth_collection.a5h3pixel_a(state):
+                run += 1
+            data.append(run)
+            if myth_collection.is_opaque(state):
+                for pixel in pixels[i:i + run]:
+                    data += pixel_data(pixel)
+            i += run
+            state = myth_collection.a5h3pixel(1, 0)
+        else:
+            state = myth_collection.a5h3pixel(a5(pixels[i]), 0)
+            data.append(state)
+            if myth_collection.a5h3pixel_a(state):
+                data += pixel_data(pixels[i])
+            i += 1
+    return bytes(data)
+
+def encode_argb8888(rows):
+    return b''.join(bytes([b, g, r, alpha]) for row in rows for (r, g, b, alpha) in row)
+
+def bitmap_data(rng, encoding, size):
+    """BitmapMeta, row address table and pixel data for one bitmap"""
+    rows = sprite_pixels(rng, size)
+    flags = myth_collection.BitmapFlags(0)
+    extended = 0
+    if encoding == 'raw':
+        pixels = encode_raw(rows, size)
+    elif encoding in ['compressed', 'compressed_4bit']:
+        flags |= myth_collection.BitmapFlags.TRANSPARENCY_ENCODED_1BIT
+        if encoding == 'compressed_4bit':
+            flags |= myth_collection.BitmapFlags.TRANSPARENCY_ENCODED_4BIT
+        pixels = encode_compressed(rows, size, encoding == 'compressed_4bit')
+    elif encoding == 'r8g8b8a5h':
+        flags |= myth_collection.BitmapFlags.BITMAP_EXTENDED_ENCODING
+        extended = myth_collection.ExtendedEncoding.EXT_R8G8B8A5H.value
+        pixels = encode_r8g8b8a5h(rng, rows)
+    elif encoding == 'argb8888':
+        flags |= myth_collection.BitmapFlags.BITMAP_EXTENDED_ENCODING
+        extended = myth_collection.ExtendedEncoding.EXT_ARGB_8888_32.value
+        pixels = encode_argb8888(rows)
+    else:
+        raise ValueError(f'Unknown encoding: {encoding}')
+
+    meta = pack(
+        myth_collection.BitmapMetaFmt,
+        width=size,
+        height=size,
+        bytes_per_row=size if encoding == 'raw' else -1,
+        flags=flags.value,
+        logical_bit_depth=8,
+        encoding=extended,
+    )
+    address_table = bytes(4 * (size - 1))
+    return meta + address_table + pixels
+
+def collection_payload(rng, bitmap_count, size, encodings=ENCODINGS):
+    """
+    Header256 followed by the data block: color table, bitmap references,
+    bitmaps, bitmap instances, one sequence over every bitmap, shadow maps.
+    Bitmaps cycle through encodings
+    """
+    color_count = 256
+    color_table = struct.pack('>I 28x', color_count) + b''.join(
+        struct.pack('>Bx Bx Bx H', i, (i * 7) % 256, (i * 13) % 256, 0)
+        for i in range(color_count)
+    )
+
+    bitmaps = [bitmap_data(rng, encodings[i % len(encodings)], size) for i in range(bitmap_count)]
+
+    bitmap_references_offset = len(color_table)
+    bitmap_references_size = bitmap_count * codec.codec(myth_collection.BitmapReferenceFmt)._item_def_size
+    bitmap_offset = bitmap_references_offset + bitmap_references_size
+    references = b''
+    for i, bitmap in enumerate(bitmaps):
+        references += pack(
+            myth_collection.BitmapReferenceFmt,
+            name=codec.encode_string(f'bitmap {i} {encodings[i % len(encodings)]}'),
+            offset=bitmap_offset,
+            size=len(bitmap),
+            width=size,
+            height=size,
+        )
+        bitmap_offset += len(bitmap)
+
+    bitmap_instances_offset = bitmap_offset
+    instances = b''.join(
+        pack(
+            myth_collection.BitmapInstanceFmt,
+            bitmap_index=i,
+            highres_bitmap_index=-1,
+            reg_point_x=size // 2,
+            reg_point_y=size // 2,
+        )
+        for i in range(bitmap_count)
+    )
+
+    sequence_references_offset = bitmap_instances_offset + len(instances)
+    sequence_offset = sequence_references_offset + codec.codec(myth_collection.SequenceRefFmt)._item_def_size
+    frames = b''.join(
+        pack(myth_collection.SequenceFrameFmt, shadow_map_index=-1) + struct.pack('>h', i)
+        for i in range(bitmap_count)
+    )
+    sequence = pack(
+        myth_collection.SequenceDataFmt,
+        flags=myth_collection.SequenceFlags.HAS_FRAME_DATA.value,
+        number_of_views=1,
+        frames_per_view=bitmap_count,
+        ticks_per_frame=2,
+        sound_tag_first=NULL_TAG,
+        sound_tag_key=NULL_TAG,
+        sound_tag_last=NULL_TAG,
+    ) + frames
+    sequence_reference = pack(
+        myth_collection.SequenceRefFmt,
+        name=codec.encode_string('all bitmaps'),
+        offset=sequence_offset,
+        size=len(sequence),
+    )
+
+    shadow_maps_offset = sequence_offset + len(sequence)
+    shadow_maps = b''.join(
+        pack(myth_collection.ShadowMapFmt, bitmap_index=i)
+        for i in range(bitmap_count)
+    )
+
+    data_block = (
+        color_table + references + b''.join(bitmaps) + instances
+        + sequence_reference + sequence + shadow_maps
+    )
+    header = pack(
+        myth_collection.Header256Fmt,
+        color_table_count=1,
+        color_tables_offset=0,
+        color_tables_size=len(color_table),
+        bitmap_reference_count=bitmap_count,
+        bitmap_references_offset=bitmap_references_offset,
+        bitmap_references_size=bitmap_references_size,
+        bitmap_instance_count=bitmap_count,
+        bitmap_instances_offset=bitmap_instances_offset,
+        bitmap_instances_size=len(instances),
+        sequence_reference_count=1,
+        sequence_references_offset=sequence_references_offset,
+        sequence_references_size=len(sequence_reference),
+        shadow_map_count=bitmap_count,
+        shadow_maps_offset=shadow_maps_offset,
+        shadow_maps_size=len(shadow_maps),
+        data_offset=codec.codec(myth_collection.Header256Fmt)._item_def_size,
+        data_size=len(data_block),
+    )
+    return header + data_block
+
+# Sounds
+
+def soun_payload(rng, permutation_count, sound_frames):
+    """SoundHeader, permutation descriptions, permutation metadata, IMA4 data"""
+    descs = b''
+    metas = b''
+    sound_data = b''
+    for i in range(permutation_count):
+        frames = max(1, round(sound_frames * rng.uniform(0.5, 1.5)))
+        descs += struct.pack(myth_sound.PermDescFmt, 0, 0, 0, codec.encode_string(f'permutation {i}'))
+        metas += pack(
+            myth_sound.PermMetaFmt,
+            sample_size=16,
+            num_channels=1,
+            sample_rate=22050,
+            num_sample_frames=frames,
+        )
+        sound_data += bytes(rng.choices(range(256), k=frames * myth_sound.IMA4_BYTES_PER_FRAME))
+    header = pack(
+        myth_sound.SoundHeaderFmt,
+        loudness=1,
+        play_fraction=1,
+        sound_size=len(sound_data),
+        subtitle_string_list_tag=NULL_TAG,
+        permutation_count=permutation_count,
+        permutations_offset=myth_sound.SOUN_HEADER_SIZE,
+        permutations_size=len(descs),
+    )
+    return header + descs + metas + sound_data
+
+# Meshes
+
+MARKER_PALETTE = [
+    (mesh_tag.MarkerType.UNIT, 'unit', 0),
+    (mesh_tag.MarkerType.UNIT, 'unit', 1),
+    (mesh_tag.MarkerType.UNIT, 'unit', -1),
+    (mesh_tag.MarkerType.SCENERY, 'scen', -1),
+    (mesh_tag.MarkerType.AMBIENT_SOUND, 'amso', -1),
+    (mesh_tag.MarkerType.PROJECTILE, 'proj', -1),
+]
+
+def marker_tag_id(tag_type, palette_index):
+    return make_tag_id(tag_type[0], palette_index)
+
+def marker_tags(game_version=2):
+    """
+    The tags the marker palette refers to. Units get a mons tag, and units
+    and scenery an obje tag, all with the palette entry's id. Every other
+    reference is none
+    """
+    tags = []
+    for i, (marker_type, tag_type, team_index) in enumerate(MARKER_PALETTE):
+        tag_id = marker_tag_id(tag_type, i)
+        name = f'{tag_type} {i}'
+        if tag_type == 'unit':
+            payload = pack(mons_tag.UnitTagFmt, mons=codec.encode_string(tag_id), core=NULL_TAG)
+            mons = pack(mons_tag.MonsTagFmt, **null_tags(mons_tag.MonsTagFmt) | {
+                'object_tag': codec.encode_string(tag_id),
+                'cost': 1 + i,
+            })
+            tags.append(make_tag('mons', tag_id, name, mons, game_version))
+        elif tag_type == 'scen':
+            payload = pack(myth_tags.SceneryFmt, **null_tags(myth_tags.SceneryFmt) | {
+                'object_tag': codec.encode_string(tag_id),
+            })
+        elif tag_type == 'amso':
+            payload = pack(myth_sound.AmsoFmt, **null_tags(myth_sound.AmsoFmt))
+        else:
+            payload = pack(myth_projectile.ProjFmt, **null_tags(myth_projectile.ProjFmt))
+        tags.append(make_tag(tag_type, tag_id, name, payload, game_version))
+        if tag_type in ['unit', 'scen']:
+            tags.append(make_tag('obje', tag_id, name, pack(mons_tag.ObjeTagFmt), game_version))
+    return tags
+
+ACTION_TYPES = ['acli', 'mdel', 'soun', 'ligh', 'timg', 'mvis', 'unit']
+
+def map_actions(rng, action_count, sound_ids):
+    actions = OrderedDict()
+    for action_id in range(action_count):
+        action_type = rng.choice(ACTION_TYPES)
+        parameters = [
+            {'type': mesh_tag.ParamType.INTEGER, 'name': 'cont', 'elements': [rng.randrange(100)]},
+            {'type': mesh_tag.ParamType.FLAG, 'name': 'actv', 'elements': [True]},
+            {
+                'type': mesh_tag.ParamType.WORLD_POINT_2D, 'name': 'wpnt',
+                'elements': [(rng.randrange(512), rng.randrange(512)) for _ in range(rng.randrange(1, 4))]
+            },
+            {
+                'type': mesh_tag.ParamType.MONSTER_IDENTIFIER, 'name': 'subj',
+                'elements': [rng.randrange(1000) for _ in range(rng.randrange(1, 6))]
+            },
+        ]
+        if action_type == 'soun' and sound_ids:
+            parameters.append({'type': mesh_tag.ParamType.SOUND, 'name': 'soun', 'elements': rng.sample(sound_ids, 1)})
+        actions[action_id] = {
+            'type': action_type,
+            'name': f'action {action_id}' if rng.random() < 0.5 else '',
+            'expiration_mode': mesh_tag.ActionExpiration.NEVER,
+            'flags': mesh_tag.ActionFlag.INITIALLY_ACTIVE,
+            'trigger_time_lower_bound': rng.randrange(60),
+            'trigger_time_delta': 0,
+            'indent': rng.randrange(3),
+            'parameters': parameters,
+        }
+    return actions
+
+def marker_palette_index(marker_id):
+    """Markers cycle through the palette, so films know which are whose"""
+    return marker_id % len(MARKER_PALETTE)
+
+def unit_marker_ids(marker_count):
+    """{team_index: [marker ids]} of unit markers, -1 for ambient units"""
+    teams = {}
+    for marker_id in range(marker_count):
+        (marker_type, tag_type, team_index) = MARKER_PALETTE[marker_palette_index(marker_id)]
+        if marker_type == mesh_tag.MarkerType.UNIT:
+            teams.setdefault(team_index, []).append(marker_id)
+    return teams
+
+def palette_netgame(marker_type, team_index):
+    """Team units are tradeable and in the Territories game type the films play"""
+    if marker_type != mesh_tag.MarkerType.UNIT or team_index < 0:
+        return {}
+    return {
+        'flags': mesh_tag.MarkerPaletteFlag.MAY_BE_TRADED.value,
+        'netgame_flags': mesh_tag.NetgameFlag.TERRITORIES.value,
+    }
+
+def mesh_payload(rng, marker_count, action_count, stli_id, sound_ids, storyline_id=None, game_version=2):
+    """
+    MeshHeader then the data block: palette, markers, map actions, fake
+    mesh cells. Single player with a storyline text tag, otherwise a netgame
+    """
+    palette = b''.join(
+        pack(
+            mesh_tag.MarkerPaletteEntryFmt,
+            type=marker_type.value,
+            marker_tag=codec.encode_string(marker_tag_id(tag_type, i)),
+            team_index=team_index,
+            **palette_netgame(marker_type, team_index),
+        )
+        for i, (marker_type, tag_type, team_index) in enumerate(MARKER_PALETTE)
+    )
+    markers = b''
+    for marker_id in range(marker_count):
+        palette_index = marker_palette_index(marker_id)
+        (marker_type, prefix, team_index) = MARKER_PALETTE[palette_index]
+        # Palette indexes are per marker type
+        type_index = [t for (t, p, ti) in MARKER_PALETTE[:palette_index]].count(marker_type)
+        markers += pack(
+            mesh_tag.MarkerHeadFmt,
+            type=marker_type.value,
+            palette_index=type_index,
+            id=marker_id,
+            pos_x=rng.randrange(256 * mesh_tag.WORLD_POINT_SF),
+            pos_y=rng.randrange(256 * mesh_tag.WORLD_POINT_SF),
+            pos_z=rng.randrange(8 * mesh_tag.WORLD_POINT_SF),
+            yaw=rng.randrange(0xffff),
+        )
+    (map_action_count, action_data) = mesh_tag.encode_map_action_data(
+        game_version, map_actions(rng, action_count, sound_ids)
+    )
+    cells = bytes(rng.choices(range(8), k=64 * 64 * 4))
+
+    markers_offset = len(palette)
+    actions_offset = markers_offset + len(markers)
+    mesh_offset = actions_offset + len(action_data)
+    data_block = palette + markers + action_data + cells
+
+    if storyline_id:
+        flags = mesh_tag.MeshFlags.SINGLE_PLAYER_MAP
+    else:
+        flags = mesh_tag.MeshFlags.TERRITORIES | mesh_tag.MeshFlags.SUPPORTS_UNIT_TRADING
+    header_values = null_tags(mesh_tag.MeshHeaderFmt) | {
+        'submesh_width': 64,
+        'submesh_height': 64,
+        'mesh_offset': mesh_offset,
+        'mesh_size': len(cells),
+        'data_offset': 0,
+        'data_size': len(data_block),
+        'marker_palette_entries': len(MARKER_PALETTE),
+        'marker_palette_offset': 0,
+        'marker_palette_size': len(palette),
+        'marker_count': marker_count,
+        'markers_offset': markers_offset,
+        'markers_size': len(markers),
+        'flags': flags.value,
+        'team_count': 2,
+        'map_action_count': map_action_count,
+        'map_actions_offset': actions_offset,
+        'map_action_buffer_size': len(action_data),
+        'map_description_string_list_tag': codec.encode_string(stli_id),
+        'pregame_storyline_tag': codec.encode_string(storyline_id) if storyline_id else NULL_TAG,
+        'media_coverage_region_offset': mesh_offset,
+        'mesh_LOD_data_offset': mesh_offset,
+        'connectors_offset': mesh_offset,
+    }
+    header = pack(mesh_tag.MeshHeaderFmt, **header_values)
+    return header + data_block
+
+# Films
+
+def command_payload(rng, verb, player_index, player_count, unit_markers):
+    """
+    Players command their own team's units and target the other team's or
+    ambient ones. Teams alternate by player index
+    """
+    team_index = player_index % 2
+    team_ids = unit_markers.get(team_index) or [0]
+    monster_ids = rng.sample(team_ids, min(len(team_ids), rng.randrange(1, 8)))
+    id_list = struct.pack(f'>h {len(monster_ids)}h', len(monster_ids), *monster_ids)
+    if verb == reco_tag.Commands.GENERAL:
+        return reco_tag.GeneralStruct.pack(0, rng.randrange(len(reco_tag.GeneralCommands))) + id_list
+    elif verb == reco_tag.Commands.TARGET:
+        targets = unit_markers.get(1 - team_index, []) + unit_markers.get(-1, [])
+        target_ids = struct.pack('>h h', 1, rng.choice(targets or [0]))
+        return reco_tag.TargetStruct.pack(reco_tag.TargetFlags.PLAYER_INITIATED.value) + id_list + target_ids
+    elif verb == reco_tag.Commands.ATTACK_LOCATION:
+        return reco_tag.AttackLocationStruct.pack(
+            0, rng.randrange(1 << 17), rng.randrange(1 << 17), rng.randrange(1 << 12)
+        ) + id_list
+    elif verb == reco_tag.Commands.CHAT:
+        message = codec.encode_string(' '.join(rng.choices(WORDS, k=rng.randrange(1, 8))))
+        return reco_tag.ChatStruct.pack(0) + message + b'\0'
+    elif verb == reco_tag.Commands.DETACH:
+        teammate = rng.randrange(team_index, player_count, 2)
+        return reco_tag.DetachStruct.pack(0, teammate, len(monster_ids)) + struct.pack(f'>{len(monster_ids)}h', *monster_ids)
+    elif verb == reco_tag.Commands.UNIT_ADJUSTMENT:
+        # Each team has one unit type, keep all of them
+        return reco_tag.UnitAdjustmentStruct.pack(0, 1) + struct.pack('>h', len(team_ids))
+    # Movement and rotation layouts are unknown, so just fill them
+    return bytes(rng.choices(range(256), k=rng.randrange(4, 24, 2)))
+
+FILM_VERBS = [
+    (reco_tag.Commands.MOVEMENT, 40),
+    (reco_tag.Commands.GENERAL, 10),
+    (reco_tag.Commands.TARGET, 20),
+    (reco_tag.Commands.ATTACK_LOCATION, 10),
+    (reco_tag.Commands.ROTATION, 10),
+    (reco_tag.Commands.CHAT, 2),
+    (reco_tag.Commands.DETACH, 1),
+]
+
+def film_commands(rng, command_count, player_count, unit_markers, commands_per_block=64):
+    """Recording blocks of CommandHeader + payload, times in ticks"""
+    verbs = [v for (v, weight) in FILM_VERBS for _ in range(weight)]
+    command_header = codec.codec(reco_tag.CommandHeaderFmt)
+    blocks = b''
+    tick = 0
+    remaining = command_count
+    while remaining:
+        block = b''
+        count = min(commands_per_block, remaining)
+        for i in range(count):
+            tick += rng.randrange(0, 8)
+            # Unit trades happen in the planning phase
+            verb = reco_tag.Commands.UNIT_ADJUSTMENT if tick < 30 and i == 0 else rng.choice(verbs)
+            player_index = rng.randrange(player_count)
+            payload = command_payload(rng, verb, player_index, player_count, unit_markers)
+            payload += bytes(len(payload) % 2)
+            block += struct.pack(
+                command_header._fmt_string,
+                command_header._item_def_size + len(payload), verb.value,
+                player_index, tick
+            )
+            block += payload
+        blocks += pack(reco_tag.RecordingBlockHeaderFmt, size=len(block), command_count=count) + block
+        remaining -= count
+    return (blocks, tick)
+
+def player_data(rng, player_index, team_index):
+    color = struct.pack('>6B H', *[rng.randrange(256) for _ in range(6)], 0)
+    appearance = pack(
+        player_headers.PlayerAppearanceFmt,
+        name=codec.encode_string(f'Player {player_index}'),
+        team_name=codec.encode_string(f'Team {team_index}'),
+        color1=color,
+        color2=color,
+    )
+    return pack(
+        player_headers.NewPlayerDataFmt,
+        team_index=team_index,
+        team_captain_identifier=100 + team_index,
+        unique_identifier=100 + player_index,
+        agreed_to_play=1,
+        metaserver_player_id=1000 + player_index,
+        appearance=appearance,
+    )
+
+def film_payload(rng, command_count, player_count, scenario_tag, plugins, unit_markers={}):
+    """RecoHeader, NewGameParamData, NewGameData, SaveGameHeader then command blocks"""
+    plugin_data = b''.join(
+        struct.pack('>L', checksum) + codec.encode_string(name) + b'\0' + codec.encode_string(url) + b'\0'
+        for (name, url, checksum) in plugins
+    )
+    game_param = pack(
+        game_headers.NewGameParamDataFmt,
+        scoring=list(mesh_tag.NetgameFlagInfo).index(mesh_tag.NetgameFlag.TERRITORIES),
+        time_limit=20 * 60 * 30,
+        scenario_tag=codec.encode_string(scenario_tag),
+        difficulty_level=2,
+        maximum_players=16,
+        maximum_teams=2,
+        random_seed=rng.randrange(1 << 32),
+        pregame_time_limit=30 * 30,
+        version=1,
+        plugin_count=len(plugins),
+        plugin_count2=len(plugins),
+        plugin_data=plugin_data,
+    )
+    game_data = pack(
+        game_headers.NewGameDataFmt,
+        player_count=player_count,
+        players=b''.join(player_data(rng, i, i % 2) for i in range(player_count)),
+    )
+    save_game = pack(game_headers.SaveGameHeaderFmt)
+    (blocks, last_tick) = film_commands(rng, command_count, player_count, unit_markers)
+
+    head_size = codec.codec(reco_tag.RecoHeaderFmt)._item_def_size + len(game_param) + len(game_data) + len(save_game)
+    reco = pack(
+        reco_tag.RecoHeaderFmt,
+        version=1,
+        data_offset=head_size,
+        recording_ending_time=last_tick,
+    )
+    return reco + game_param + game_data + save_game + blocks
+
+# Corpus
+
+def archive_tags(seed, name, sizes, game_version=2, id_prefix='f'):
+    """Filler, text, collection and sound tags for one archive"""
+    tags = []
+    rng = rng_for(seed, f'{name}:filler')
+    for i in range(sizes['tags']):
+        tag_type = rng.choice(TEXT_TAG_TYPES + BINARY_TAG_TYPES)
+        size = max(16, round(sizes['tag_size'] * rng.uniform(0.25, 1.75)))
+        tags.append(make_tag(
+            tag_type, make_tag_id(id_prefix, i), f'{tag_type} {i}',
+            filler_payload(rng, tag_type, size), game_version
+        ))
+    for i in range(sizes['collections']):
+        rng = rng_for(seed, f'{name}:collection:{i}')
+        tags.append(make_tag(
+            '.256', make_tag_id('c', i), f'collection {i}',
+            collection_payload(rng, sizes['bitmaps'], sizes['bitmap_size']), game_version
+        ))
+    for i in range(sizes['sounds']):
+        rng = rng_for(seed, f'{name}:sound:{i}')
+        tags.append(make_tag(
+            'soun', make_tag_id('s', i), f'sound {i}',
+            soun_payload(rng, sizes['permutations'], sizes['sound_frames']), game_version
+        ))
+    return tags
+
+def mesh_tags(seed, name, sizes, plugin_index, game_version=2):
+    """
+    Meshes with their level name string lists, the tags their markers
+    refer to, and matching entrypoints. The first mesh is a single player
+    level with a storyline, the rest are netgames
+    """
+    tags = marker_tags(game_version)
+    entrypoints = []
+    sound_ids = [make_tag_id('s', i) for i in range(sizes['sounds'])]
+    for i in range(sizes['meshes']):
+        level = plugin_index * 100 + i + 1
+        mesh_id = make_tag_id('m', level)
+        stli_id = make_tag_id('l', level)
+        mesh_name = f'{level:02} Synthetic Level {level}'
+        rng = rng_for(seed, f'{name}:mesh:{i}')
+        tags.append(make_tag(
+            'stli', stli_id, f'{mesh_name} description',
+            codec.encode_string(f'|bSynthetic|p Level {level}\rA generated level\r') + b'\0', game_version
+        ))
+        storyline_id = None
+        if i == 0:
+            storyline_id = make_tag_id('t', level)
+            tags.append(make_tag(
+                'text', storyline_id, f'{mesh_name} storyline',
+                text_payload(rng_for(seed, f'{name}:storyline:{i}'), 6), game_version
+            ))
+        tags.append(make_tag(
+            'mesh', mesh_id, mesh_name,
+            mesh_payload(
+                rng, sizes['markers'], sizes['actions'], stli_id, sound_ids, storyline_id, game_version
+            ), game_version
+        ))
+        entrypoints.append((mesh_id, mesh_name, f'|bSynthetic|p Level {level}'))
+    return (tags, entrypoints)
+
+def write_file(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as out_file:
+        out_file.write(data)
+    return path
+
+def generate(output_dir, **sizes):
+    """
+    Write a synthetic game directory:
+      tags/     SB foundation archive
+      plugins/  SB plugin archives with meshes and entrypoints
+      tfl/      TFL .gor archives
+      films/    .m2rec films on the first plugin's meshes
+    Returns {kind: [paths]}
+    """
+    sizes = DEFAULTS | sizes
+    seed = sizes['seed']
+    output_dir = pathlib.Path(output_dir)
+    manifest = OrderedDict({'tags': [], 'plugins': [], 'tfl': [], 'films': []})
+
+    foundation = sb_archive('synthetic foundation', archive_tags(seed, 'foundation', sizes))
+    manifest['tags'].append(write_file(output_dir / 'tags' / 'synthetic foundation', foundation))
+
+    plugins = []
+    for p in range(sizes['plugins']):
+        name = f'Synthetic Plugin {p + 1}'
+        # Plugins override half of the foundation filler tags
+        plugin_sizes = sizes | {'tags': sizes['tags'] // 2, 'collections': 1, 'sounds': 1}
+        tags = archive_tags(seed, name, plugin_sizes)
+        (level_tags, entrypoints) = mesh_tags(seed, name, sizes, p + 1)
+        plugin = sb_archive(
+            name, tags + level_tags, myth_headers.ArchiveType.PLUGIN,
+            entrypoints=entrypoints
+        )
+        manifest['plugins'].append(write_file(output_dir / 'plugins' / name, plugin))
+        plugins.append((name, entrypoints))
+
+    for t in range(sizes['tfl_archives']):
+        name = f'synthetic tfl {t + 1}.gor'
+        tags = archive_tags(seed, name, sizes, game_version=1)
+        (level_tags, entrypoints) = mesh_tags(seed, name, sizes, 90 + t, game_version=1)
+        manifest['tfl'].append(write_file(output_dir / 'tfl' / name, tfl_archive(name, tags + level_tags)))
+
+    for f in range(sizes['films']):
+        rng = rng_for(seed, f'film:{f}')
+        if plugins:
+            (plugin_name, entrypoints) = plugins[f % len(plugins)]
+            # Netgames, the first mesh is single player
+            netgames = entrypoints[1:] or entrypoints
+            scenario_tag = netgames[f % len(netgames)][0] if netgames else 'none'
+            film_plugins = [(plugin_name, '', 0)]
+        else:
+            (scenario_tag, film_plugins) = ('none', [])
+        payload = film_payload(
+            rng, sizes['commands'], sizes['players'], scenario_tag, film_plugins,
+            unit_marker_ids(sizes['markers'])
+        )
+        film = make_tag('reco', make_tag_id('r', f), f'film {f}', payload)
+        manifest['films'].append(write_file(output_dir / 'films' / f'synthetic {f + 1}.m2rec', film))
+
+    if DEBUG:
+        for kind, paths in manifest.items():
+            for path in paths:
+                print(f'[synthetic] {kind} {path}')
+
+    return manifest
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in ['-h', '--help']:
+        print(f"Usage: python3 {sys.argv[0]} [<output_dir>] [<size>=<value> ...]")
+        print(f"       sizes: {' '.join(f'{k}={v}' for k, v in DEFAULTS.items())}")
+        sys.exit(1)
+
+    args = sys.argv[1:]
+    output_dir = None
+    if args and '=' not in args[0]:
+        output_dir = args.pop(0)
+
+    try:
+        main(output_dir, args)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except BrokenPipeError:
+        sys.stdout = None
+        sys.exit(1)
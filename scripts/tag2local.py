@@ -12,6 +12,7 @@ import myth_sound
 import myth_projectile
 import mons_tag
 import loadtags
+import memtrace
 import utils
 
 DEBUG = (os.environ.get('DEBUG') == '1')
@@ -21,7 +22,11 @@ def main(game_directory, tag_type, tag_id, plugin_names):
     """
     Recursively extracts all referenced tags from a tag into a local tree structure
     """
-    (game_version, tags, entrypoint_map, data_map, cutscenes) = loadtags.load_tags(game_directory, plugin_names)
+    with memtrace.phase('loadtags.load_tags'):
+        (game_version, tags, entrypoint_map, data_map, cutscenes) = loadtags.load_tags(game_directory, plugin_names)
+    memtrace.gauge('data_map', lambda: sum(len(data) for data in data_map.values()))
+    memtrace.gauge('codec._CODEC_CACHE', lambda: len(codec._CODEC_CACHE))
+    memtrace.gauge('TagDataGenerator.FETCHED', lambda: sum(len(ids) for ids in TagDataGenerator.FETCHED.values()))
 
     try:
         extract_tags(tag_type, tag_id, tags, data_map, plugin_names)
@@ -38,12 +43,14 @@ def extract_tags(tag_type, input_tag_id, tags, data_map, plugin_names):
         if tag_type in tags:
             for tag_id, locations in tags[tag_type].items():
                 (location, header) = locations[-1]
-                for td in tdg.get_tag_data(tag_type, codec.encode_string(tag_id)):
-                    extracted_header = td[0]
-                    if extracted_header.tag_type not in extracted_tags:
-                        extracted_tags[extracted_header.tag_type] = {}
-                    extracted_tags[extracted_header.tag_type][extracted_header.tag_id] = True
+                tag_phase = memtrace.begin('get_tag_data', tag_type=tag_type, tag_id=tag_id)
+                for td in tdg.get_tag_data(tag_type, tag_id):
+                    extracted_type = codec.TagKey(td[0].tag_type)
+                    if extracted_type not in extracted_tags:
+                        extracted_tags[extracted_type] = {}
+                    extracted_tags[extracted_type][codec.TagKey(td[0].tag_id)] = True
                     all_tag_data.append(td)
+                memtrace.end(tag_phase)
         if DEAD_TAGS:
             dead_tags = {}
             for check_tag_type, tag_type_tags in tags.items():
@@ -52,10 +59,11 @@ def extract_tags(tag_type, input_tag_id, tags, data_map, plugin_names):
                         check_tag_type not in extracted_tags or
                         check_tag_id not in extracted_tags[check_tag_type]
                     ):
-                        if check_tag_type not in dead_tags:
-                            dead_tags[check_tag_type] = {}
+                        dead_tag_type = str(check_tag_type)
+                        if dead_tag_type not in dead_tags:
+                            dead_tags[dead_tag_type] = {}
 
-                        dead_tags[check_tag_type][check_tag_id] = check_tag_locations
+                        dead_tags[dead_tag_type][str(check_tag_id)] = check_tag_locations
             for dead_tag_type, dead_tag_tags in dead_tags.items():
                 for dead_tag_id, dead_tag_locations in dead_tag_tags.items():
                     (dead_tag_location, dead_tag_header) = dead_tag_locations[-1]
@@ -70,12 +78,13 @@ def extract_tags(tag_type, input_tag_id, tags, data_map, plugin_names):
             sys.exit(1)
         output_dir = f'../output/tag2local/{tag_type}.{header.name}/local'
 
-        for td in tdg.get_tag_data(tag_type, codec.encode_string(input_tag_id)):
+        for td in tdg.get_tag_data(tag_type, input_tag_id):
             all_tag_data.append(td)
 
     output_path = pathlib.Path(sys.path[0], output_dir).resolve()
 
     if prompt(output_path):
+        write_phase = memtrace.begin('write_tags', count=len(all_tag_data))
         for (tag_header, tag_data) in all_tag_data:
             file_path = (output_path / f'{utils.local_folder(tag_header)}/{tag_header.name}')
             pathlib.Path(file_path.parent).mkdir(parents=True, exist_ok=True)
@@ -84,6 +93,7 @@ def extract_tags(tag_type, input_tag_id, tags, data_map, plugin_names):
                 tag_file.write(tag_data)
 
             print(f"Tag extracted. Output saved to {file_path}")
+        memtrace.end(write_phase)
 
 def prompt(prompt_path):
     # return True
@@ -104,14 +114,16 @@ class TagDataGenerator:
         return tag_id in self.FETCHED[tag_type]
 
     def get_tag_data(self, tag_type, tag_id, tree=[]):
+        tag_type = codec.TagKey(tag_type)
+        tag_id = codec.TagKey(tag_id)
         if self.fetched_check(tag_type, tag_id):
             return
         self.FETCHED[tag_type][tag_id] = True
 
-        if codec.all_on(tag_id) or codec.all_off(tag_id):
+        if tag_id.is_null():
             return
         (location, tag_header, tag_data) = loadtags.get_tag_info(
-            self.tags, self.data_map, tag_type, codec.decode_string(tag_id)
+            self.tags, self.data_map, tag_type, tag_id
         )
         if tag_data:
             # Copy otherwise this list is just a reference to the original list from
@@ -143,7 +155,7 @@ class TagDataGenerator:
                 for palette_type, p_list in palette.items():
                     for p_val in p_list:
                         tag_type = mesh_tag.Marker2Tag.get(palette_type)
-                        yield from self.get_tag_data(mesh_tag.Marker2Tag.get(palette_type), codec.encode_string(p_val['tag']), tree)
+                        yield from self.get_tag_data(tag_type, p_val['tag'], tree)
 
                 # action tags
                 (actions, _) = mesh_tag.parse_map_actions(mesh_header, tag_data)
@@ -152,12 +164,12 @@ class TagDataGenerator:
                         for p in act['parameters']:
                             if p['type'] == mesh_tag.ParamType.SOUND:
                                 for el in p['elements']:
-                                    yield from self.get_tag_data('soun', codec.encode_string(el), tree)
+                                    yield from self.get_tag_data('soun', el, tree)
                     elif act['type'] == 'ligh':
                         for p in act['parameters']:
                             if p['type'] == mesh_tag.ParamType.PROJECTILE:
                                 for el in p['elements']:
-                                    yield from self.get_tag_data('proj', codec.encode_string(el), tree)
+                                    yield from self.get_tag_data('proj', el, tree)
 
             elif tag_header.tag_type == 'soun':
                 soun = myth_sound.parse_soun_header(tag_data)
@@ -7,6 +7,7 @@ import zlib
 
 import myth_headers
 import myth_collection
+import tracing
 import utils
 
 BITMAP_META_SIZE = 52
@@ -31,14 +32,28 @@ def main(tag_path, output_dir):
     bitmap_count = len(bitmaps)
 
     if prompt(path, bitmap_count):
-        pathlib.Path(path).mkdir(parents=True, exist_ok=True)
-        for i, (name, width, height, rows) in enumerate(bitmaps):
-            png = make_png(width, height, rows)
-            
-            bitmap_path = path / f'{i}-{name}.png'
-            with open(bitmap_path, 'wb') as png_file:
-                png_file.write(png)
-                print(f"PNG extracted. Output saved to {bitmap_path} ({width} x {height})")
+        write_pngs(path, bitmaps)
+
+def write_pngs(path, bitmaps):
+    pathlib.Path(path).mkdir(parents=True, exist_ok=True)
+    bitmap_paths = []
+    for i, (name, width, height, rows) in enumerate(bitmaps):
+        png = make_png(width, height, rows)
+
+        bitmap_path = path / f'{i}-{name}.png'
+        with open(bitmap_path, 'wb') as png_file:
+            png_file.write(png)
+            print(f"PNG extracted. Output saved to {bitmap_path} ({width} x {height})")
+        bitmap_paths.append(bitmap_path)
+
+        secondary = getattr(rows, 'secondary', None)
+        if secondary is not None:
+            secondary_path = path / f'{i}-{name}-secondary.png'
+            with open(secondary_path, 'wb') as png_file:
+                png_file.write(make_png(width, height, myth_collection.BitmapPixels(width, height, secondary)))
+                print(f"Secondary layer saved to {secondary_path}")
+            bitmap_paths.append(secondary_path)
+    return bitmap_paths
 
 def prompt(prompt_path, bitmap_count):
     # return True
@@ -73,6 +88,7 @@ def parse_256_tag(data):
 # PNG
 # https://www.da.vidbuchanan.co.uk/blog/hello-png.html
 
+@tracing.traced()
 def make_png(width, height, pixel_rows):
     return (
         PNG_HEAD
@@ -95,6 +111,14 @@ def png_header(width, height):
     )
 
 def png_data(pixel_rows):
+    rgba = getattr(pixel_rows, 'rgba', None)
+    if rgba is not None:
+        # Already RGBA, just needs a filter type byte before each row
+        stride = pixel_rows.width * 4
+        filtered = b''.join(
+            b'\0' + rgba[start:start + stride] for start in range(0, stride * pixel_rows.height, stride)
+        )
+        return zlib.compress(filtered, level=9)
     filtered = []
     for row in pixel_rows:
         filtered.append(0)
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+import json
+import os
+import pathlib
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+import loadtags
+import myth_headers
+
+DEBUG = (os.environ.get('DEBUG') == '1')
+
+# TAGSERVER=1 uses the default socket, TAGSERVER=<path> uses that socket
+TAGSERVER = os.environ.get('TAGSERVER')
+ENABLED = bool(TAGSERVER) and TAGSERVER != '0'
+
+PROTOCOL_VERSION = 1
+
+# json size, payload size
+MESSAGE_HEADER = struct.Struct('>IQ')
+
+# Environment variables that change what load_tags returns. The server
+# only answers clients that have the same values
+LOAD_ENV = ['VTFL', 'FORCE_VTFL', 'UNITY']
+
+def main(command):
+    """
+    Keep loaded tag sets resident and serve them to other scripts over a
+    Unix socket, or query a running server
+    """
+    path = socket_path()
+    if command == 'serve':
+        serve(path)
+    elif command == 'status':
+        (status, _) = Client(path).request({'request': 'status'})
+        print(f'Tag server pid={status["pid"]} socket={path}')
+        for tag_set in status['tag_sets']:
+            plugins = ', '.join(tag_set['plugin_names']) or '-'
+            print(
+                f'{tag_set["id"]:>4} {tag_set["game_directory"]} plugins=[{plugins}] '
+                f'archives={tag_set["archives"]} size={tag_set["size"]} '
+                f'loaded={tag_set["load_s"]:.2f}s requests={tag_set["requests"]}'
+            )
+    elif command == 'stop':
+        Client(path).request({'request': 'stop'})
+        print(f'Tag server stopped: {path}')
+    else:
+        raise ValueError(f'Unknown command: {command}')
+
+def socket_path():
+    if TAGSERVER and TAGSERVER not in ['0', '1']:
+        return pathlib.Path(TAGSERVER)
+    # Unix socket paths are limited to ~100 bytes, so avoid the output dir
+    return pathlib.Path(tempfile.gettempdir(), f'mythextract-tagserver-{os.getuid()}.sock')
+
+def load_env():
+    return {name: os.environ.get(name) for name in LOAD_ENV}
+
+def send_message(sock, meta, payload=b''):
+    meta_data = json.dumps(meta).encode('utf8')
+    sock.sendall(MESSAGE_HEADER.pack(len(meta_data), len(payload)) + meta_data)
+    if payload:
+        sock.sendall(payload)
+
+def recv_exactly(sock, size):
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        chunk_size = sock.recv_into(view[received:])
+        if not chunk_size:
+            raise EOFError('Tag server connection closed')
+        received += chunk_size
+    return data
+
+def recv_message(sock):
+    (meta_size, payload_size) = MESSAGE_HEADER.unpack(recv_exactly(sock, MESSAGE_HEADER.size))
+    meta = json.loads(recv_exactly(sock, meta_size))
+    payload = bytes(recv_exactly(sock, payload_size)) if payload_size else b''
+    return (meta, payload)
+
+# Server
+
+class TagSet:
+    """A load_tags() result kept resident, with the file stamps it was loaded from"""
+    __slots__ = (
+        'id', 'game_directory', 'plugin_names', 'stamp', 'load_s', 'requests',
+        'game_version', 'tags', 'entrypoint_map', 'data_map', 'archives',
+    )
+
+def directory_stamp(game_directory):
+    """
+    (name, size, mtime) of every file load_tags could read, so added,
+    removed or modified plugins cause a reload
+    """
+    stamp = []
+    for tag_dir in ['tags', 'plugins']:
+        tags_dir = pathlib.Path(game_directory, tag_dir)
+        if tags_dir.exists():
+            for dirfile in os.scandir(tags_dir):
+                if dirfile.is_file():
+                    stat = dirfile.stat()
+                    stamp.append((tag_dir, dirfile.name, stat.st_size, stat.st_mtime_ns))
+    return sorted(stamp)
+
+class TagServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path):
+        super().__init__(str(path), TagRequestHandler)
+        self.env = load_env()
+        # Guards tag_sets and next_id. Loading holds only the lock of its own
+        # key, so other tag sets are served meanwhile
+        self.lock = threading.Lock()
+        self.load_locks = {}
+        self.tag_sets = {}
+        self.next_id = 1
+
+    def tag_set(self, game_directory, plugin_names):
+        key = (game_directory, tuple(plugin_names))
+        stamp = directory_stamp(game_directory)
+        with self.lock:
+            load_lock = self.load_locks.setdefault(key, threading.Lock())
+        with load_lock:
+            with self.lock:
+                tag_set = self.tag_sets.get(key)
+                if tag_set and tag_set.stamp == stamp:
+                    tag_set.requests += 1
+                    return tag_set
+
+            start = time.perf_counter()
+            (game_version, tags, entrypoint_map, data_map, _) = loadtags.load_local_tags(
+                game_directory, plugin_names
+            )
+            tag_set = TagSet()
+            tag_set.game_directory = game_directory
+            tag_set.plugin_names = list(plugin_names)
+            tag_set.stamp = stamp
+            tag_set.requests = 1
+            tag_set.game_version = game_version
+            tag_set.tags = tags
+            tag_set.entrypoint_map = entrypoint_map
+            tag_set.data_map = data_map
+            tag_set.archives = archive_tag_lists(tags, data_map)
+            tag_set.load_s = time.perf_counter() - start
+            with self.lock:
+                tag_set.id = self.next_id
+                self.next_id += 1
+                self.tag_sets[key] = tag_set
+            print(
+                f'Loaded [{tag_set.id}] {game_directory} plugins={plugin_names} '
+                f'in {tag_set.load_s:.2f}s'
+            )
+            return tag_set
+
+    def find_tag_set(self, tag_set_id):
+        with self.lock:
+            for tag_set in self.tag_sets.values():
+                if tag_set.id == tag_set_id:
+                    return tag_set
+        raise ValueError(f'Tag set {tag_set_id} was reloaded, load again')
+
+    def respond(self, request):
+        command = request.get('request')
+        if command == 'load':
+            if request['env'] != self.env:
+                raise ValueError(f'Server was started with different settings: {self.env}')
+            tag_set = self.tag_set(request['game_directory'], request['plugin_names'])
+            return load_response(tag_set)
+        elif command == 'read':
+            tag_set = self.find_tag_set(request['tag_set'])
+            data = tag_set.data_map[request['archive']]
+            return ({}, memoryview(data)[request['start']:request['end']])
+        elif command == 'status':
+            with self.lock:
+                tag_sets = list(self.tag_sets.values())
+            return ({
+                'pid': os.getpid(),
+                'tag_sets': [
+                    {
+                        'id': tag_set.id,
+                        'game_directory': tag_set.game_directory,
+                        'plugin_names': tag_set.plugin_names,
+                        'archives': len(tag_set.data_map),
+                        'size': sum(len(data) for data in tag_set.data_map.values()),
+                        'load_s': tag_set.load_s,
+                        'requests': tag_set.requests,
+                    }
+                    for tag_set in tag_sets
+                ],
+            }, b'')
+        elif command == 'stop':
+            # shutdown() waits for serve_forever, which this handler is blocking
+            threading.Thread(target=self.shutdown).start()
+            return ({}, b'')
+        else:
+            raise ValueError(f'Unknown request: {command}')
+
+def archive_tag_lists(tags, data_map):
+    """
+    The encoded tag headers of each archive in load order. Clients decode
+    these rather than the server pickling them
+    """
+    archives = {}
+    for tag_type_tags in tags.values():
+        for tag_id_list in tag_type_tags.values():
+            for (location, tag_header) in tag_id_list:
+                archives.setdefault(location, []).append(tag_header)
+
+    tag_lists = []
+    for location, data in data_map.items():
+        tag_headers = archives.get(location, [])
+        game_version = myth_headers.game_version(tag_headers[0]) if tag_headers else 2
+        tag_lists.append((
+            location, game_version, len(tag_headers), len(data),
+            b''.join(tag_header.value for tag_header in tag_headers)
+        ))
+    return tag_lists
+
+def load_response(tag_set):
+    (meta, payload) = pack_tag_set(tag_set.game_version, tag_set.entrypoint_map, tag_set.archives)
+    meta['tag_set'] = tag_set.id
+    return (meta, payload)
+
+def pack_tag_set(game_version, entrypoint_map, archive_tag_lists):
+    """
+    JSON metadata and the concatenated tag lists of a tag set, for
+    unpack_tag_set to rebuild in another process
+    """
+    archives = []
+    payload = []
+    offset = 0
+    for (location, archive_game_version, tag_count, size, tag_list) in archive_tag_lists:
+        archives.append({
+            'filename': location,
+            'game_version': archive_game_version,
+            'tag_count': tag_count,
+            'size': size,
+            'tag_list_offset': offset,
+        })
+        payload.append(tag_list)
+        offset += len(tag_list)
+    return ({
+        'game_version': game_version,
+        'entrypoints': [
+            [entry_id, entry_name, entry_long_name, archive_list]
+            for entry_id, (entry_name, entry_long_name, archive_list) in entrypoint_map.items()
+        ],
+        'archives': archives,
+    }, b''.join(payload))
+
+def unpack_tag_set(meta, payload, archive_data):
+    """
+    (tags, entrypoint_map, data_map) from pack_tag_set output, with
+    archive_data(archive) giving the data_map entry of each archive
+    """
+    tags = loadtags.TagMap()
+    data_map = {}
+    for archive in meta['archives']:
+        tag_headers = myth_headers.decode_tag_list(
+            archive['game_version'], archive['tag_count'], payload, archive['tag_list_offset']
+        )
+        loadtags.append_tag_headers(tags, tag_headers, archive['filename'])
+        data_map[archive['filename']] = archive_data(archive)
+    entrypoint_map = {
+        entry_id: (entry_name, entry_long_name, archive_list)
+        for (entry_id, entry_name, entry_long_name, archive_list) in meta['entrypoints']
+    }
+    return (tags, entrypoint_map, data_map)
+
+class TagRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                (request, _) = recv_message(self.request)
+            except (EOFError, ConnectionError):
+                return
+            try:
+                (meta, payload) = self.server.respond(request)
+            except (Exception, SystemExit) as e:
+                if DEBUG:
+                    import traceback
+                    traceback.print_exc()
+                (meta, payload) = ({'error': f'{type(e).__name__}: {e}'}, b'')
+            meta['version'] = PROTOCOL_VERSION
+            send_message(self.request, meta, payload)
+
+def serve(path):
+    if path.exists():
+        try:
+            Client(path).request({'request': 'status'})
+            print(f'Tag server already running: {path}')
+            sys.exit(1)
+        except OSError:
+            # Left behind by a server that didn't exit cleanly
+            path.unlink()
+
+    old_umask = os.umask(0o077)
+    try:
+        server = TagServer(path)
+    finally:
+        os.umask(old_umask)
+
+    print(f'Serving tags on {path}')
+    try:
+        with server:
+            server.serve_forever()
+    finally:
+        path.unlink(missing_ok=True)
+
+# Client
+
+class Client:
+    """A connection to the tag server, kept open for the life of the process"""
+    def __init__(self, path):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(str(path))
+        self.lock = threading.Lock()
+
+    def request(self, meta):
+        with self.lock:
+            send_message(self.sock, meta)
+            (response, payload) = recv_message(self.sock)
+        if response.get('version') != PROTOCOL_VERSION:
+            raise ValueError(f'Tag server protocol mismatch: {response.get("version")}')
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return (response, payload)
+
+class RemoteData(loadtags.SlicedData):
+    """Archive data held by the tag server"""
+    __slots__ = ('client', 'tag_set', 'archive')
+
+    def __init__(self, client, tag_set, archive, size):
+        self.client = client
+        self.tag_set = tag_set
+        self.archive = archive
+        self.size = size
+
+    def read(self, start, end):
+        (_, payload) = self.client.request({
+            'request': 'read',
+            'tag_set': self.tag_set,
+            'archive': self.archive,
+            'start': start,
+            'end': end,
+        })
+        return payload
+
+CLIENT = None
+
+def connect():
+    global CLIENT
+    if not CLIENT:
+        CLIENT = Client(socket_path())
+    return CLIENT
+
+def load_tags(game_directory, plugin_names):
+    """
+    load_tags() from the server. Returns None if the server isn't running
+    or can't load these tags, so the caller can load them itself
+    """
+    try:
+        client = connect()
+        (response, payload) = client.request({
+            'request': 'load',
+            'game_directory': str(pathlib.Path(game_directory).resolve()),
+            'plugin_names': plugin_names,
+            'env': load_env(),
+        })
+    except OSError:
+        print(f'[tagserver] Not running on {socket_path()}, loading tags locally', file=sys.stderr)
+        return None
+    except (EOFError, ValueError) as e:
+        print(f'[tagserver] {e}, loading tags locally', file=sys.stderr)
+        return None
+
+    (tags, entrypoint_map, data_map) = unpack_tag_set(response, payload, lambda archive: RemoteData(
+        client, response['tag_set'], archive['filename'], archive['size']
+    ))
+    cutscenes = loadtags.find_cutscenes(game_directory)
+    return (response['game_version'], tags, entrypoint_map, data_map, cutscenes)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python3 {sys.argv[0]} <serve|status|stop>")
+        sys.exit(1)
+
+    command = sys.argv[1]
+
+    try:
+        main(command)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except BrokenPipeError:
+        sys.stdout = None
+        sys.exit(1)
+    except (OSError, EOFError) as e:
+        print(f'Tag server not running: {e}')
+        sys.exit(1)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+import bisect
+import hashlib
+import json
+import os
+import pathlib
+import re
+import sys
+
+import codec
+import loadtags
+import tracing
+import utils
+
+DEBUG = (os.environ.get('DEBUG') == '1')
+
+CACHE_VERSION = 1
+CACHE_DIR = '../output/cache/textsearch'
+
+TEXT_TAG_TYPES = ['stli', 'text', 'temp']
+
+# Indexes built in this process by game directory, plugins and archive stats
+INDEX_CACHE = {}
+
+def main(game_directory, query, plugin_names):
+    """
+    Search the lines of every string list, text and template tag
+    """
+    index = load_index(game_directory, plugin_names)
+    results = index.search(query)
+    for (tag_type, tag_id, line_index, archive, text) in results:
+        print(f'{tag_type}.{tag_id} {line_index:>4} [{archive}] {text}')
+    if DEBUG:
+        print(f'[textsearch] {len(results)} of {len(index.lines)} lines', file=sys.stderr)
+
+def tokenize(text):
+    return re.findall(r'\w+', text.lower())
+
+class TextIndex:
+    """
+    Lines of text tags, and for each word the lines it's in. Queries are
+    words that must all be in a line, `word*` for any word starting with
+    it, and `"quoted phrases"` for words next to each other, which can
+    also end with a `*`
+    """
+    __slots__ = ('lines', 'postings', 'words')
+
+    def __init__(self, lines, postings):
+        # (tag_type, tag_id, line_index, archive, text)
+        self.lines = lines
+        # Word to ascending line numbers
+        self.postings = postings
+        self.words = sorted(postings)
+
+    def word_lines(self, word):
+        return set(self.postings.get(word, []))
+
+    def prefix_lines(self, prefix):
+        start = bisect.bisect_left(self.words, prefix)
+        end = bisect.bisect_left(self.words, prefix + '\U0010ffff')
+        lines = set()
+        for word in self.words[start:end]:
+            lines.update(self.postings[word])
+        return lines
+
+    @tracing.traced()
+    def search(self, query):
+        candidates = None
+        phrases = []
+        for (phrase, term) in re.findall(r'"([^"]*)"|(\S+)', query):
+            term = phrase or term
+            words = tokenize(term)
+            if not words:
+                continue
+            prefix = term.endswith('*')
+            if prefix:
+                term_lines = self.prefix_lines(words[-1])
+            else:
+                term_lines = self.word_lines(words[-1])
+            for word in words[:-1]:
+                term_lines &= self.word_lines(word)
+            if len(words) > 1:
+                phrases.append((words, prefix))
+            candidates = term_lines if candidates is None else candidates & term_lines
+            if not candidates:
+                return []
+        if not candidates:
+            return []
+        return [
+            self.lines[i] for i in sorted(candidates)
+            if all(has_phrase(tokenize(self.lines[i][4]), words, prefix) for (words, prefix) in phrases)
+        ]
+
+def has_phrase(line_words, words, prefix=False):
+    """words next to each other in line_words, the last one a prefix with prefix"""
+    count = len(words)
+    for start in range(len(line_words) - count + 1):
+        if line_words[start:start + count - 1] != words[:-1]:
+            continue
+        last_word = line_words[start + count - 1]
+        if last_word == words[-1] or (prefix and last_word.startswith(words[-1])):
+            return True
+    return False
+
+@tracing.traced()
+def build_index(tags, data_map):
+    """
+    A TextIndex of every text tag in every archive, not just the ones that
+    win, so text overridden by a plugin is found too
+    """
+    lines = []
+    postings = {}
+    for tag_type in TEXT_TAG_TYPES:
+        if tag_type not in tags:
+            continue
+        for (tag_id, tag_locations) in tags[tag_type].items():
+            for (location, tag_header) in tag_locations:
+                tag_start = tag_header.tag_data_offset
+                text = data_map[location][tag_start:tag_start + tag_header.tag_data_size]
+                for (line_index, line) in enumerate(text.split(b'\r')):
+                    line_text = utils.strip_format(codec.decode_string(line)).strip()
+                    line_words = tokenize(line_text)
+                    if not line_words:
+                        continue
+                    line_number = len(lines)
+                    lines.append((str(tag_type), str(tag_id), line_index, location, line_text))
+                    for word in set(line_words):
+                        word_lines = postings.get(word)
+                        if word_lines is None:
+                            word_lines = postings[word] = []
+                        word_lines.append(line_number)
+    return TextIndex(lines, postings)
+
+def index_key(game_directory, plugin_names):
+    """
+    Identifies the archives a tag set would load, changing when any of
+    them do
+    """
+    (files, cutscenes) = loadtags.build_file_list(game_directory, plugin_names)
+    archives = []
+    for (order, filename, path_dir, path, mono_header) in files:
+        stat = os.stat(path)
+        archives.append([str(path), stat.st_size, stat.st_mtime_ns])
+    return json.dumps([str(pathlib.Path(game_directory).resolve()), plugin_names, archives])
+
+def cache_path(game_directory, plugin_names):
+    """One file per tag set, replaced when its archives change"""
+    tag_set = json.dumps([str(pathlib.Path(game_directory).resolve()), plugin_names])
+    name = hashlib.sha1(tag_set.encode('utf8')).hexdigest()
+    return pathlib.Path(sys.path[0], CACHE_DIR, f'{name}.json').resolve()
+
+@tracing.traced()
+def load_index(game_directory, plugin_names=[], use_cache=True):
+    """
+    TextIndex of a tag set, built once and cached in memory and on disk
+    until an archive in it changes
+    """
+    plugin_names = [os.path.basename(p) for p in plugin_names]
+    key = index_key(game_directory, plugin_names)
+    if key in INDEX_CACHE:
+        return INDEX_CACHE[key]
+
+    path = cache_path(game_directory, plugin_names)
+    index = None
+    if use_cache:
+        index = load_cache(path, key)
+    if not index:
+        (game_version, tags, entrypoint_map, data_map, cutscenes) = loadtags.load_tags(
+            game_directory, plugin_names, tag_types=TEXT_TAG_TYPES
+        )
+        index = build_index(tags, data_map)
+        if use_cache:
+            save_cache(path, key, index)
+    elif DEBUG:
+        print(f'[textsearch] Loaded {path}', file=sys.stderr)
+
+    INDEX_CACHE[key] = index
+    return index
+
+def load_cache(path, key):
+    try:
+        with open(path, 'r') as cache_file:
+            cached = json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+    if cached.get('version') != CACHE_VERSION or cached.get('key') != key:
+        return None
+    return TextIndex([tuple(line) for line in cached['lines']], cached['postings'])
+
+def save_cache(path, key, index):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'{path.name}.tmp')
+    with open(tmp_path, 'w') as cache_file:
+        json.dump({
+            'version': CACHE_VERSION,
+            'key': key,
+            'lines': index.lines,
+            'postings': index.postings,
+        }, cache_file)
+    os.replace(tmp_path, path)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(f"Usage: python3 {sys.argv[0]} <game_directory> <query> [<plugin_names> ...]")
+        sys.exit(1)
+
+    game_directory = sys.argv[1]
+    query = sys.argv[2]
+    plugin_names = sys.argv[3:]
+
+    try:
+        main(game_directory, query, plugin_names)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except BrokenPipeError:
+        sys.stdout = None
+        sys.exit(1)
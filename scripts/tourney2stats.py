@@ -4,6 +4,8 @@ import os
 import pathlib
 import sys
 
+import codec
+import memtrace
 import reco_tag
 import myth_collection
 import tag2png
@@ -95,6 +97,7 @@ def main(tourney_dir, game_directory, output_dir):
     }
 
     if prompt(base_path, tourney_path, len(tourney_rounds)):
+        memtrace.gauge('codec._CODEC_CACHE', lambda: len(codec._CODEC_CACHE))
         for round_i, round_info in enumerate(tourney_info['rounds']):
             winning_teams = None
             # Relies on tourney specific data
@@ -120,11 +123,13 @@ def main(tourney_dir, game_directory, output_dir):
                     f'game {game_info['game_num']} ({game_info['bagrada_game']}): '
                     f'{game_info["game_path"]}/{film_name} ... ', end=''
                 )
+                parse_phase = memtrace.begin('reco_tag.parse_reco_file', film=reco_file)
                 (
                     reco_header, players, players_idx, monsters, teams, teams_idx,
                     plugins, mesh_header, level_name, game_time, game_type_choice, difficulty,
                     overhead_map_data, chat_lines, trades, splits, game_stats
                 ) = reco_tag.parse_reco_file(game_directory, reco_file)
+                memtrace.end(parse_phase)
 
                 print('PARSED... ', end='')
 
@@ -154,12 +159,14 @@ def main(tourney_dir, game_directory, output_dir):
 
                 reco_stats_out_path = game_dir / 'stats.json'
                 pathlib.Path(reco_stats_out_path.parent).mkdir(parents=True, exist_ok=True)
-                with open(reco_stats_out_path, 'w') as reco_stats_out_file:
-                    json.dump(game_stats, reco_stats_out_file, separators=(',', ':'))
+                with memtrace.phase('stats_json', film=reco_file):
+                    with open(reco_stats_out_path, 'w') as reco_stats_out_file:
+                        json.dump(game_stats, reco_stats_out_file, separators=(',', ':'))
 
                 print('STATS... ', end='')
 
                 # Extract overhead map
+                overhead_phase = memtrace.begin('overhead_map', film=reco_file)
                 overhead_bitmaps = myth_collection.parse_sequence_bitmaps(overhead_map_data)
                 if len(overhead_bitmaps):
                     (
@@ -169,6 +176,7 @@ def main(tourney_dir, game_directory, output_dir):
                     overhead_out_path = game_dir / 'overhead.png'
                     with open(overhead_out_path, 'wb') as png_file:
                         png_file.write(png)
+                memtrace.end(overhead_phase)
 
                 print('MAP... ', end='')
 
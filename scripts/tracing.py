@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+import atexit
+import functools
+import json
+import os
+import pathlib
+import sys
+import threading
+import time
+from collections import defaultdict
+
+# TRACE=1 writes to the output dir, TRACE=<path> writes to that path
+TRACE = os.environ.get('TRACE')
+ENABLED = bool(TRACE) and TRACE != '0'
+
+OUTPUT_DIR = '../output/trace'
+
+# Chrome trace events, see:
+# https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSzKEL1PNTM
+EVENTS = []
+COUNTERS = defaultdict(int)
+START = time.perf_counter_ns()
+
+def main(trace_path):
+    """
+    Print the summary table for a trace file written with TRACE=1
+    """
+    with open(trace_path, 'r') as trace_file:
+        trace = json.load(trace_file)
+    print_summary(trace['traceEvents'], file=sys.stdout)
+
+class Span:
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        add_span(self.name, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NULL_SPAN = NullSpan()
+
+def span(name, /, **args):
+    """
+    Context manager timing a block as a named span. Category is the name
+    up to the first dot. Does nothing unless TRACE is set
+    """
+    if not ENABLED:
+        return NULL_SPAN
+    return Span(name, args)
+
+def traced(name=None):
+    """
+    Decorator timing every call as a span. Functions are returned
+    untouched unless TRACE is set, so there's no overhead when disabled.
+    Generator functions are timed until the generator finishes, which
+    includes any time the caller spends between items
+    """
+    def decorator(fun):
+        if not ENABLED:
+            return fun
+        # Only imported when tracing, it's slow to import
+        import inspect
+        span_name = name or f'{pathlib.Path(fun.__code__.co_filename).stem}.{fun.__qualname__}'
+
+        if inspect.isgeneratorfunction(fun):
+            @functools.wraps(fun)
+            def generator_wrapper(*args, **kwargs):
+                with Span(span_name, None):
+                    return (yield from fun(*args, **kwargs))
+            return generator_wrapper
+
+        @functools.wraps(fun)
+        def wrapper(*args, **kwargs):
+            with Span(span_name, None):
+                return fun(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def now():
+    """Start time for record(), for loops that don't fit a with block"""
+    return time.perf_counter_ns() if ENABLED else 0
+
+def record(name, start, /, **args):
+    """Record a span from a now() start time until now"""
+    if not ENABLED:
+        return
+    add_span(name, start, time.perf_counter_ns(), args)
+
+def add_span(name, start, end, args):
+    event = {
+        'name': name,
+        'cat': name.partition('.')[0],
+        'ph': 'X',
+        'ts': (start - START) / 1000,
+        'dur': (end - start) / 1000,
+        'pid': os.getpid(),
+        'tid': threading.get_ident(),
+    }
+    if args:
+        event['args'] = args
+    EVENTS.append(event)
+
+def count(name, value=1):
+    """
+    Add to a named counter. In hot loops guard the call:
+    tracing.ENABLED and tracing.count(...)
+    """
+    if not ENABLED:
+        return
+    COUNTERS[name] += value
+    EVENTS.append({
+        'name': name,
+        'cat': name.partition('.')[0],
+        'ph': 'C',
+        'ts': (time.perf_counter_ns() - START) / 1000,
+        'pid': os.getpid(),
+        'args': {'value': COUNTERS[name]},
+    })
+
+def trace_path():
+    if TRACE != '1':
+        return pathlib.Path(TRACE)
+    script = pathlib.Path(sys.argv[0]).stem or 'python'
+    timestamp = time.strftime('%Y%m%d-%H%M%S')
+    return pathlib.Path(sys.path[0], OUTPUT_DIR, f'{script}-{timestamp}-{os.getpid()}.json').resolve()
+
+def write_trace(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w') as trace_file:
+        json.dump({'traceEvents': EVENTS, 'displayTimeUnit': 'ms'}, trace_file)
+    return path
+
+def summarise(events):
+    """
+    Totals per span name: (count, total_ms, max_ms), and the final
+    value of each counter
+    """
+    spans = {}
+    counters = {}
+    for event in events:
+        if event['ph'] == 'X':
+            (calls, total, longest) = spans.get(event['name'], (0, 0, 0))
+            duration = event['dur'] / 1000
+            spans[event['name']] = (calls + 1, total + duration, max(longest, duration))
+        elif event['ph'] == 'C':
+            counters[event['name']] = event['args']['value']
+    return (spans, counters)
+
+def print_summary(events, file=sys.stderr):
+    (spans, counters) = summarise(events)
+    if spans:
+        print(f'{"span":<48} {"count":>8} {"total ms":>12} {"mean ms":>10} {"max ms":>10}', file=file)
+        for name, (calls, total, longest) in sorted(spans.items(), key=lambda s: -s[1][1]):
+            print(
+                f'{name:<48} {calls:>8} {total:>12.2f} {total / calls:>10.3f} {longest:>10.2f}',
+                file=file
+            )
+    if counters:
+        print(f'{"counter":<48} {"value":>8}', file=file)
+        for name, value in sorted(counters.items()):
+            print(f'{name:<48} {value:>8}', file=file)
+
+def finish():
+    if not EVENTS:
+        return
+    path = write_trace(trace_path())
+    print_summary(EVENTS)
+    print(f'Trace saved to {path}', file=sys.stderr)
+
+if ENABLED:
+    atexit.register(finish)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print(f"Usage: python3 {sys.argv[0]} <trace_file>")
+        sys.exit(1)
+
+    trace_file = sys.argv[1]
+
+    try:
+        main(trace_file)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except BrokenPipeError:
+        sys.stdout = None
+        sys.exit(1)
@@ -1,17 +1,28 @@
+import importlib.util
 import re
 import struct
 import sys
 import unicodedata
 
-import cProfile
-import pstats
-
 import codec
 
-import urllib.request
-import urllib.parse
-
-PROFILER = cProfile.Profile()
+def lazy_import(name):
+    """
+    Module that is only executed when one of its attributes is first
+    used. For heavy modules only some code paths need, to keep startup
+    fast for the scripts that don't
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if not spec:
+        raise ModuleNotFoundError(f'No module named {name!r}', name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
 
 def myth_random(seed):
     RANDOM_A = 1664525
@@ -127,6 +138,10 @@ TagTypes = {
 }
 
 def http_request(url, method='GET', data=None, headers={}):
+    # Slow to import and only needed by the few scripts that fetch
+    import urllib.parse
+    import urllib.request
+
     if method == 'POST' and data:
         data = urllib.parse.urlencode(data).encode('utf-8')
     elif method == 'GET' and data:
@@ -199,10 +214,3 @@ def load_file(path, length=None):
         sys.exit(1)
 
     return data
-
-def profileStart():
-    PROFILER.enable()
-
-def profileEnd():
-    PROFILER.disable()
-    pstats.Stats(PROFILER).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(100)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+import gc
+import multiprocessing
+import os
+import pathlib
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# Every parser the tasks use is imported here, once in the parent, so
+# forked workers start with them
+import loadtags
+import mesh2web
+import mesh_tag
+import mons_tag
+import reco_tag
+import sharedtags
+import tag2png
+
+DEBUG = (os.environ.get('DEBUG') == '1')
+
+# WORKERS=<n> sets the number of worker processes, WORKERS=1 runs tasks in process
+WORKERS = int(os.environ.get('WORKERS') or os.cpu_count() or 1)
+
+# Forked workers share everything the parent loaded copy-on-write. Where
+# fork isn't safe, workers are spawned and attach to shared tag data instead
+FORK = 'fork' in multiprocessing.get_all_start_methods() and sys.platform == 'linux'
+
+# Tag types with one tag decoded in the parent, building the codecs and
+# string tables their parsers use. The parsed tags themselves aren't kept
+WARM_PARSERS = {
+    'mesh': mesh_tag.parse_header,
+    'unit': mons_tag.parse_unit,
+}
+
+TASKS = {}
+
+def task(name):
+    """Register a function that workers run by name"""
+    def decorator(fun):
+        TASKS[name] = fun
+        return fun
+    return decorator
+
+class WorkerPool:
+    """
+    Worker processes for batches of tasks over the same tags. Tags, parser
+    modules and codecs are loaded once in the parent, so tasks don't pay
+    for them. Submit tasks by name, e.g. pool.submit('film', game_directory, path)
+    """
+    def __init__(self, game_directory, plugin_sets=[[]], warm_types=['mesh', 'unit'], workers=WORKERS):
+        self.workers = workers
+        self.shared = None
+        self.executor = None
+
+        for plugin_names in plugin_sets:
+            loaded = loadtags.keep_resident(game_directory, plugin_names)
+            warm(loaded, warm_types)
+
+        if workers <= 1:
+            return
+        if FORK:
+            # Keep the collector from touching, and so copying, everything
+            # loaded so far in every worker
+            gc.freeze()
+            context = multiprocessing.get_context('fork')
+        else:
+            # Spawned workers only share tags published to shared memory
+            self.shared = sharedtags.publish(game_directory, plugin_sets[0])
+            context = multiprocessing.get_context('spawn')
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown()
+            if FORK:
+                gc.unfreeze()
+        if self.shared:
+            self.shared.close()
+
+    def submit(self, task_name, *args):
+        """Run a task, returning a Future of its result"""
+        if task_name not in TASKS:
+            raise ValueError(f'Unknown task: {task_name}')
+        if self.executor:
+            return self.executor.submit(run_task, task_name, args)
+        return InlineFuture(run_task, task_name, args)
+
+def run_task(task_name, args):
+    return TASKS[task_name](*args)
+
+class InlineFuture:
+    """The result of a task run in process, for WORKERS=1"""
+    __slots__ = ('value', 'error')
+
+    def __init__(self, fun, *args):
+        self.value = None
+        self.error = None
+        # Like a worker, keep errors for result(), but let Ctrl-C stop the batch
+        try:
+            self.value = fun(*args)
+        except (Exception, SystemExit) as e:
+            self.error = e
+
+    def result(self):
+        if self.error:
+            raise self.error
+        return self.value
+
+def warm(loaded, warm_types):
+    (game_version, tags, entrypoint_map, data_map, cutscenes) = loaded
+    for tag_type in warm_types:
+        parser = WARM_PARSERS.get(tag_type)
+        if not parser or tag_type not in tags:
+            continue
+        # The first tag that parses is enough
+        for tag_id in tags[tag_type]:
+            try:
+                parser(loadtags.get_tag_data(tags, data_map, tag_type, tag_id))
+                break
+            except (struct.error, UnicodeDecodeError, ValueError) as e:
+                if DEBUG:
+                    print(f'[workerpool] Not warmed {tag_type}.{tag_id}: {e}')
+
+# Tasks
+
+@task('film')
+def parse_film(game_directory, reco_file, start_minute=None, end_minute=None):
+    """Game stats of a recording file"""
+    parsed = reco_tag.parse_reco_file(game_directory, reco_file, start_minute, end_minute)
+    return parsed[-1]
+
+@task('collection')
+def export_collection(game_directory, plugin_names, coll_id, output_dir):
+    """Write every bitmap of a .256 collection as PNG, returns their paths"""
+    (game_version, tags, entrypoint_map, data_map, cutscenes) = loadtags.load_tags(game_directory, plugin_names)
+    data = loadtags.get_tag_data(tags, data_map, '.256', coll_id)
+    if not data:
+        raise ValueError(f'Collection not found: {coll_id}')
+    (signature, tag_id, bitmaps) = tag2png.parse_256_tag(data)
+    return tag2png.write_pngs(pathlib.Path(output_dir), bitmaps)
+
+@task('mesh')
+def render_mesh(game_directory, plugin_names, mesh_id, plugin, plugin_output, confirmed=False):
+    """The mesh2web page for a level, confirmed to write it without prompting"""
+    (game_version, tags, entrypoint_map, data_map, cutscenes) = loadtags.load_tags(game_directory, plugin_names)
+    mesh2web.extract_level(game_version, tags, data_map, cutscenes, mesh_id, plugin, plugin_output, confirmed)